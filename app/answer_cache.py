@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from .cache import LRUCache
+
+# === Semantic answer cache ===
+# Per-namespace memory of (question vector, retrieved chunk ids, answer). A new
+# question whose embedding is within ANSWER_CACHE_THRESHOLD cosine similarity
+# of a cached one gets the cached answer, skipping the pgvector search and the
+# Groq call. Any write to or delete of a namespace's collection invalidates it:
+# the namespace's entries are dropped and its version bumped, so an answer that
+# was being computed while the collection changed is not stored.
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "128"))               # answers per namespace
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))              # seconds an answer is reused
+ANSWER_CACHE_NAMESPACES = int(os.getenv("ANSWER_CACHE_NAMESPACES", "256"))   # namespaces kept in memory
+
+
+class _NamespaceAnswers:
+    """Answers for one namespace: a unit-vector matrix plus parallel entry lists."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.vectors = None          # (n, dim) float32, rows L2-normalized
+        self.entries = []            # [(created_at, chunk_ids, answer)]
+
+    def drop_expired(self, now: float, ttl: float) -> None:
+        keep = [i for i, (created, _, _) in enumerate(self.entries) if now - created <= ttl]
+        if len(keep) != len(self.entries):
+            self.entries = [self.entries[i] for i in keep]
+            self.vectors = self.vectors[keep] if keep else None
+
+    def best(self, vec: np.ndarray):
+        if self.vectors is None:
+            return None, 0.0
+        sims = self.vectors @ vec
+        i = int(np.argmax(sims))
+        return self.entries[i], float(sims[i])
+
+    def add(self, vec: np.ndarray, entry) -> None:
+        row = vec[None, :]
+        self.vectors = row if self.vectors is None else np.vstack([self.vectors, row])
+        self.entries.append(entry)
+        if len(self.entries) > self.maxsize:  # oldest first
+            self.vectors = self.vectors[-self.maxsize:]
+            self.entries = self.entries[-self.maxsize:]
+
+
+def _unit(vector) -> np.ndarray | None:
+    vec = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else None
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, size: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL, namespaces: int = ANSWER_CACHE_NAMESPACES,
+                 enabled: bool = ANSWER_CACHE):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.size = size
+        self.ttl = ttl
+        self._namespaces = LRUCache(namespaces)
+        self._versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    def version(self, namespace: str) -> int:
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    def lookup(self, namespace: str, query_vector):
+        """Cached answer for a question close enough to `query_vector`, else None."""
+        vec = _unit(query_vector)
+        with self._lock:
+            answers = self._namespaces.get(namespace)
+            entry, score = (None, 0.0)
+            if answers is not None and vec is not None:
+                answers.drop_expired(time.monotonic(), self.ttl)
+                entry, score = answers.best(vec)
+            if entry is not None and score >= self.threshold:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def store(self, namespace: str, query_vector, chunk_ids: list[str], answer: str, version: int) -> bool:
+        """
+        Remember an answer computed at namespace `version` (from `version()`
+        before retrieval). Dropped if the namespace changed in the meantime.
+        """
+        vec = _unit(query_vector)
+        if vec is None or not answer:
+            return False
+        with self._lock:
+            if self._versions.get(namespace, 0) != version:
+                return False
+            answers = self._namespaces.peek(namespace)
+            if answers is None:
+                answers = _NamespaceAnswers(self.size)
+                self._namespaces.put(namespace, answers)
+            answers.add(vec, (time.monotonic(), list(chunk_ids), answer))
+            self.stores += 1
+            return True
+
+    def invalidate(self, namespace: str) -> None:
+        """Call whenever rows of the namespace's collection are written or deleted."""
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            self._namespaces.pop(namespace)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "namespaces": len(self._namespaces),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+
+from langchain_core.documents import Document
+
+from .db_pool import database_url
+from .hybrid import HYBRID_CANDIDATES, HybridRetriever, reciprocal_rank_fusion, text_search_sql, tokenize
+from .memory_store import MemoryRetriever
+from .metrics import stage
+from .vector_index import IndexedPgRetriever, _collection_ids, search_settings, search_sql, vector_literal
+from .answer_cache import answer_cache
+from . import rag_engine as rag
+
+# === Async /ask ===
+# A sync /ask holds a worker thread for the whole embed -> pgvector -> Groq
+# round trip, and almost all of it is spent waiting on the network. This is the
+# same pipeline as rag_engine.ask_question, written as coroutines for the ASGI
+# server (asgi.py), so one worker keeps dozens of questions in flight:
+#   * the question is embedded with the endpoint client's async call;
+#   * vector and keyword search run on asyncpg, with the same SQL as the sync
+#     retrievers (app/vector_index.py, app/hybrid.py), the keyword search
+#     concurrently with the embedding call;
+#   * the answer comes from the chain's ainvoke (ChatGroq's async client).
+# In-memory guest stores are searched in process, as before; any other
+# retriever (VECTOR_SEARCH=pgvector) runs on a thread. The answer cache and
+# context assembly are shared with the sync path.
+
+ASYNC_PG_POOL_SIZE = int(os.getenv("ASYNC_PG_POOL_SIZE", "10"))
+
+_pool = None
+_pool_lock: asyncio.Lock | None = None
+
+
+def _dsn() -> str | None:
+    url = database_url()
+    if url and url.startswith("postgresql+"):
+        url = "postgresql" + url[url.index(":"):]  # drop a SQLAlchemy driver suffix
+    return url
+
+
+async def _init_connection(conn) -> None:
+    # LangChain creates cmetadata as json, or jsonb with use_jsonb=True (see vector_store.py)
+    for name in ("json", "jsonb"):
+        await conn.set_type_codec(name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def get_pool():
+    """The asyncpg pool of this event loop, created on first use."""
+    global _pool, _pool_lock
+    if _pool is None:
+        _pool_lock = _pool_lock or asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                import asyncpg
+                # statement_cache_size=0: the Supabase transaction pooler cannot keep prepared statements
+                _pool = await asyncpg.create_pool(_dsn(), min_size=1, max_size=ASYNC_PG_POOL_SIZE,
+                                                  statement_cache_size=0, init=_init_connection)
+    return _pool
+
+
+async def close_pool() -> None:
+    global _pool, _pool_lock
+    _pool_lock = None
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+async def acollection_id(collection: str):
+    """collection_id_for() over asyncpg, sharing its cache."""
+    cid = _collection_ids.get(collection)
+    if cid is None:
+        pool = await get_pool()
+        cid = await pool.fetchval("SELECT uuid FROM langchain_pg_collection WHERE name = $1", collection)
+        if cid is not None:
+            _collection_ids.put(collection, cid)
+    return cid
+
+
+async def asearch(retriever: IndexedPgRetriever, vector: list[float]) -> list[Document]:
+    """IndexedPgRetriever.search_by_vector over asyncpg."""
+    cid = await acollection_id(retriever.collection)
+    if cid is None:
+        return []
+    pool = await get_pool()
+    async with pool.acquire() as conn, conn.transaction():
+        await conn.execute("; ".join(search_settings(retriever.k, retriever.ef_search, retriever.probes)))
+        rows = await conn.fetch(search_sql(cid, "$1", "$2"), vector_literal(vector), retriever.k)
+    return [Document(page_content=doc, metadata={**(meta or {}), "score": round(1.0 - dist, 6)})
+            for doc, meta, dist in rows]
+
+
+async def atext_search(collection: str, query: str, k: int) -> list[Document]:
+    """hybrid.pg_text_search over asyncpg."""
+    if not tokenize(query):
+        return []
+    cid = await acollection_id(collection)
+    if cid is None:
+        return []
+    pool = await get_pool()
+    rows = await pool.fetch(text_search_sql(cid, "$1", "$2"), query, k)
+    return [Document(page_content=doc, metadata={**(meta or {}), "lexical_rank": float(rank)})
+            for doc, meta, rank in rows]
+
+
+async def _dense(retriever, vector: list[float]) -> list[Document]:
+    if isinstance(retriever, IndexedPgRetriever):
+        return await asearch(retriever, vector)
+    return retriever.search_by_vector(vector)  # MemoryRetriever: in process
+
+
+async def _hybrid(retriever: HybridRetriever, query: str, vector=None) -> list[Document]:
+    n = retriever.k * HYBRID_CANDIDATES
+    if isinstance(retriever.vector, IndexedPgRetriever):
+        # no full-text index yet: the vector ranking alone (see rag_engine.get_hybrid_retriever)
+        ready = rag._text_search["ready"] or await asyncio.to_thread(rag._text_search_ready)
+        lexical = asyncio.ensure_future(atext_search(retriever.vector.collection, query, n) if ready
+                                        else asyncio.sleep(0, []))
+    else:
+        lexical = asyncio.ensure_future(asyncio.to_thread(retriever.lexical, query, n))
+    try:
+        if vector is None:
+            vector = await retriever.embedding.aembed_query(query)
+        dense = await _dense(retriever.vector, vector)
+    except BaseException:
+        lexical.cancel()
+        raise
+    try:
+        sparse = await lexical
+    except Exception as e:  # lexical search is best effort
+        print(f"[HYBRID] lexical search failed: {e}")
+        sparse = []
+    return reciprocal_rank_fusion([dense, sparse], retriever.k)
+
+
+async def aretrieve(qa_chain, query: str, vector=None) -> list[Document]:
+    """rag_engine._retrieve without blocking the event loop on I/O."""
+    retriever = qa_chain.retriever
+    with stage("retrieve"):
+        if isinstance(retriever, HybridRetriever):
+            return await _hybrid(retriever, query, vector)
+        if isinstance(retriever, (IndexedPgRetriever, MemoryRetriever)):
+            if vector is None:
+                vector = await retriever.embedding.aembed_query(query)
+            return await _dense(retriever, vector)
+        return await asyncio.to_thread(rag._run_retriever, retriever, query, vector)
+
+
+async def aask_question(qa_chain, query: str, namespace: str | None = None) -> str:
+    """rag_engine.ask_question as a coroutine: same cache, retrieval, context and prompt."""
+    vector = version = None
+    if namespace is not None and answer_cache.enabled:
+        version = answer_cache.version(namespace)  # read before retrieval; see answer_cache.store
+        vector = await rag.get_embedding_model().aembed_query(query)
+        cached = answer_cache.lookup(namespace, vector)
+        if cached is not None:
+            return cached
+
+    docs = await aretrieve(qa_chain, query, vector)
+    context = rag._context(qa_chain, query, docs)
+    with stage("llm"):
+        out = await qa_chain.combine_documents_chain.ainvoke({"input_documents": context, "question": query})
+    answer = out["output_text"]
+    if vector is not None and docs:
+        answer_cache.store(namespace, vector, rag._chunk_ids(docs), answer, version)
+    return answer
@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU map with hit/miss/eviction counters.
+
+    `ttl` (seconds, optional) expires entries that have not been read or
+    written for that long. `on_evict(key, value, reason)` is called, outside
+    the lock, whenever an entry leaves the cache for "capacity", "expired"
+    or "removed" (pop/clear), so owners can release resources.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None, on_evict=None):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data = OrderedDict()  # key -> (value, last_used)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, last_used: float, now: float) -> bool:
+        return self.ttl is not None and now - last_used > self.ttl
+
+    def _notify(self, evicted) -> None:
+        if self.on_evict is None:
+            return
+        for key, value, reason in evicted:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                print(f"[CACHE] eviction callback failed for {key!r}: {e}")
+
+    def get(self, key, default=None):
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            entry = self._data.get(key)
+            if entry is not None and self._expired(entry[1], now):
+                del self._data[key]
+                self.expirations += 1
+                evicted.append((key, entry[0], "expired"))
+                entry = None
+            if entry is not None:
+                self._data[key] = (entry[0], now)
+                self._data.move_to_end(key)
+                self.hits += 1
+                value = entry[0]
+            else:
+                self.misses += 1
+                value = default
+        self._notify(evicted)
+        return value
+
+    def peek(self, key, default=None):
+        """Look up without touching recency, expiry or counters."""
+        with self._lock:
+            entry = self._data.get(key)
+            return default if entry is None else entry[0]
+
+    def put(self, key, value) -> None:
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            old = self._data.pop(key, None)
+            if old is not None and old[0] is not value:
+                evicted.append((key, old[0], "removed"))
+            self._data[key] = (value, now)
+            evicted.extend(self._collect_expired(now))
+            while len(self._data) > self.maxsize:
+                k, (v, _) = self._data.popitem(last=False)
+                self.evictions += 1
+                evicted.append((k, v, "capacity"))
+        self._notify(evicted)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        self._notify([(key, entry[0], "removed")])
+        return entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            evicted = [(k, v, "removed") for k, (v, _) in self._data.items()]
+            self._data.clear()
+        self._notify(evicted)
+
+    def _collect_expired(self, now: float) -> list:
+        if self.ttl is None:
+            return []
+        # least recently used first, so stop at the first entry still fresh
+        expired = []
+        for key, (value, last_used) in list(self._data.items()):
+            if not self._expired(last_used, now):
+                break
+            del self._data[key]
+            self.expirations += 1
+            expired.append((key, value, "expired"))
+        return expired
+
+    def purge_expired(self) -> int:
+        """Drop every idle-expired entry now; returns how many were removed."""
+        with self._lock:
+            expired = self._collect_expired(time.monotonic())
+        self._notify(expired)
+        return len(expired)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,250 @@
+import math
+import os
+import re
+from functools import lru_cache
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+# === Chunking ===
+# The first splitter cut each page on its own into 700-character pieces, so
+# every page boundary split a paragraph and left a short tail chunk behind.
+# Here the pages of a PDF are read as one stream of paragraphs and sentences,
+# and sentences are packed into chunks of up to CHUNK_TOKENS tokens of the
+# embedding model (all-MiniLM-L6-v2 reads 256 word pieces and ignores the
+# rest). Chunks:
+#   * run across page boundaries and record the pages they cover
+#     (metadata page .. page_end);
+#   * start at a heading line, unless the chunk so far is still below
+#     CHUNK_MIN_TOKENS, and carry the `section` (heading) they start in;
+#   * end at a paragraph break once they are 3/4 full; a chunk cut inside a
+#     paragraph hands its last sentences (up to CHUNK_OVERLAP_TOKENS) to the
+#     next one.
+# Tokens are counted with the model's own tokenizer when its tokenizer.json is
+# in the local Hugging Face cache (CHUNK_TOKENIZER=hf downloads it), and
+# estimated from word lengths otherwise; the estimate errs on the high side.
+# CHUNKER=chars keeps the old per-page splitter.
+
+CHUNKER = os.getenv("CHUNKER", "tokens")                       # tokens | chars
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "240"))           # per chunk; keep below the model's 256
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "48"))    # a heading does not cut a smaller chunk
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "auto")         # auto | hf | estimate
+
+# CHUNKER=chars
+CHUNK_SIZE = 700
+CHUNK_OVERLAP = 100
+splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+_PIECE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])[\"')\]]?\s+(?=[\"'(\[]?[A-Z0-9])")
+_PAGE_NUMBER = re.compile(r"(?i)(page\s+)?\d+(\s*(of|/)\s*\d+)?")
+_NUMBERED_HEADING = re.compile(r"(?i)(\d+(\.\d+)*\.?|[ivx]+\.|[A-Z]\.|chapter|section|appendix|part)\s+\S")
+
+
+def estimate_tokens(text: str) -> int:
+    """WordPiece-like count: one per punctuation mark, ~3 digits or ~8 letters per piece."""
+    n = 0
+    for piece in _PIECE.findall(text):
+        if piece.isdigit():
+            n += math.ceil(len(piece) / 3)
+        elif piece.isalpha():
+            n += 1 + (len(piece) - 1) // 8
+        else:
+            n += 1
+    return n
+
+
+@lru_cache(maxsize=4)
+def _hf_tokenizer(model_name: str, download: bool):
+    try:
+        from tokenizers import Tokenizer
+        if download:
+            return Tokenizer.from_pretrained(model_name)
+        from huggingface_hub import try_to_load_from_cache
+        path = try_to_load_from_cache(model_name, "tokenizer.json")
+        return Tokenizer.from_file(path) if isinstance(path, str) else None
+    except Exception as e:
+        print(f"[CHUNKING] tokenizer for {model_name} unavailable, estimating tokens: {e}")
+        return None
+
+
+def token_counter(model_name: str):
+    """(name, count(text) -> int) for the embedding model, per CHUNK_TOKENIZER."""
+    tokenizer = None
+    if CHUNK_TOKENIZER != "estimate":
+        tokenizer = _hf_tokenizer(model_name, download=CHUNK_TOKENIZER == "hf")
+    if tokenizer is None:
+        return "estimate", estimate_tokens
+    return "hf", lambda s: len(tokenizer.encode(s, add_special_tokens=False).ids)
+
+
+def chunking_signature(model_name: str) -> str:
+    """Part of the dedup fingerprint: identical settings give identical chunks."""
+    if CHUNKER == "chars":
+        return f"split={CHUNK_SIZE}/{CHUNK_OVERLAP}"
+    counter, _ = token_counter(model_name)
+    return f"tokens={CHUNK_TOKENS}/{CHUNK_OVERLAP_TOKENS}/{CHUNK_MIN_TOKENS}:{counter}"
+
+
+def _is_heading(line: str) -> bool:
+    words = line.split()
+    if not words or len(words) > 12 or len(line) > 80 or line[-1] in ".,;:!?" or not any(c.isalpha() for c in line):
+        return False
+    if _NUMBERED_HEADING.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) >= 3 and all(c.isupper() for c in letters):
+        return True
+    long_words = [w for w in words if len(w) > 3]
+    return bool(long_words) and sum(w[0].isupper() for w in long_words) >= 0.8 * len(long_words)
+
+
+def _page_blocks(pages):
+    """
+    Yield ("heading", text, page, page), ("sentence", text, first page,
+    last page) and ("break", ...) events for a stream of (page, text). A
+    paragraph left open at the end of a page continues on the next one.
+    """
+    para: list[tuple[int, str]] = []   # (page, line) of the open paragraph
+
+    def flush():
+        if not para:
+            return
+        # join the lines, remembering where each page's text starts
+        text, starts = "", []
+        for page, line in para:
+            if text.endswith("-") and text[-2:-1].isalpha() and line[:1].islower():
+                text = text[:-1]              # word hyphenated across lines
+            elif text:
+                text += " "
+            starts.append((len(text), page))
+            text += line
+        para.clear()
+
+        def page_at(offset):
+            return max((p for start, p in starts if start <= offset), default=starts[0][1])
+
+        begin = 0
+        for m in _SENTENCE_BREAK.finditer(text):
+            yield "sentence", text[begin:m.start()].strip(), page_at(begin), page_at(m.start() - 1)
+            begin = m.end()
+        if text[begin:].strip():
+            yield "sentence", text[begin:].strip(), page_at(begin), page_at(len(text) - 1)
+        yield "break", None, None, None
+
+    for page, text in pages:
+        lines = [" ".join(raw.split()) for raw in text.strip().split("\n")]
+        width = max(map(len, lines))
+        for line in lines:
+            if para and para[-1][1][-1] in ".!?:" and len(para[-1][1]) < 0.7 * width:
+                yield from flush()            # a short line that ends a sentence ends its paragraph
+            if not line:
+                yield from flush()
+            elif _PAGE_NUMBER.fullmatch(line):
+                continue                      # running page numbers
+            elif (not para or para[-1][1][-1] in ".!?:") and _is_heading(line):
+                yield from flush()
+                yield "heading", line, page, page
+            else:
+                para.append((page, line))
+    yield from flush()
+
+
+def _windows(word: str, count, limit: int):
+    """Cut one over-long word (URL, base64, table row without spaces) into pieces of at most `limit` tokens."""
+    while word:
+        lo, hi = 1, len(word)
+        while lo < hi:  # longest prefix within the limit
+            mid = (lo + hi + 1) // 2
+            if count(word[:mid]) <= limit:
+                lo = mid
+            else:
+                hi = mid - 1
+        yield word[:lo]
+        word = word[lo:]
+
+
+def chunk_pages(pages, metadata: dict, count=estimate_tokens, chunk_tokens: int = CHUNK_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS, min_tokens: int = CHUNK_MIN_TOKENS):
+    """
+    Chunk Documents for a stream of (page_index, text), as they fill up.
+    Metadata: page, page_end, section (the heading in force where the chunk
+    starts, if any), tokens.
+    """
+    units: list[list] = []   # [separator, text, tokens, first page, last page, section]
+    size = 0
+    section = None
+
+    def emit(overlap: bool):
+        nonlocal units, size
+        text = "".join(u[0] + u[1] for u in units).strip()
+        meta = {**metadata, "page": units[0][3], "page_end": max(u[4] for u in units), "tokens": size}
+        if units[0][5]:
+            meta["section"] = units[0][5]
+        chunk = Document(page_content=text, metadata=meta)
+        carry: list[list] = []
+        if overlap:
+            kept = 0
+            for unit in reversed(units[1:]):
+                if kept + unit[2] > overlap_tokens:
+                    break
+                carry.insert(0, unit)
+                kept += unit[2]
+        units, size = carry, sum(u[2] for u in carry)
+        if units:
+            units[0] = ["", *units[0][1:]]
+        return chunk
+
+    def add(sep: str, text: str, n: int, first: int, last: int):
+        nonlocal size
+        if units and size + n > chunk_tokens:
+            yield emit(overlap=True)
+            while units and size + n > chunk_tokens:  # the overlap must leave room for this unit
+                size -= units.pop(0)[2]
+            if units:
+                units[0] = ["", *units[0][1:]]
+        units.append([sep if units else "", text, n, first, last, section])
+        size += n
+
+    pending_sep = ""
+    for kind, text, first, last in _page_blocks(pages):
+        if kind == "break":
+            if size >= chunk_tokens * 3 // 4:
+                yield emit(overlap=False)
+            pending_sep = "\n"
+            continue
+        if kind == "heading":
+            if size >= min_tokens:
+                yield emit(overlap=False)
+            section = text
+            yield from add("\n", text, count(text), first, last)
+            pending_sep = "\n"
+            continue
+        n = count(text)
+        if n <= chunk_tokens:
+            yield from add(pending_sep or " ", text, n, first, last)
+        else:
+            # a "sentence" longer than a chunk (tables, lists without punctuation): cut by
+            # words, and a word longer than a chunk into token windows
+            words = (w for word in text.split()
+                     for w in (_windows(word, count, chunk_tokens) if count(word) > chunk_tokens else (word,)))
+            piece, piece_n = [], 0
+            for word in words:
+                w = count(word)
+                if piece and piece_n + w > chunk_tokens:
+                    yield from add(pending_sep or " ", " ".join(piece), piece_n, first, last)
+                    pending_sep, piece, piece_n = " ", [], 0
+                piece.append(word)
+                piece_n += w
+            if piece:
+                yield from add(pending_sep or " ", " ".join(piece), piece_n, first, last)
+        pending_sep = ""
+    if units:
+        yield emit(overlap=False)
+
+
+def split_page_chars(page: int, text: str, metadata: dict):
+    """CHUNKER=chars: the page on its own, 700-character pieces."""
+    for chunk in splitter.split_text(text):
+        yield Document(page_content=chunk, metadata={**metadata, "page": page})
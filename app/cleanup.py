@@ -0,0 +1,354 @@
+"""
+Session cleanup: storage objects, vectors and idle guests.
+
+    python -m app.cleanup reap [--ttl SECONDS] [--dry-run]   # purge guests idle longer than the TTL
+    python -m app.cleanup purge OWNER/NAMESPACE [...]         # purge these sessions now
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from sqlalchemy import text
+
+from .answer_cache import answer_cache
+from .cache import LRUCache
+from .fingerprints import REGISTRY_TABLE
+from .memory_store import is_memory_namespace, get_memory_store, drop_memory_store, _stores as _memory_stores
+from .metrics import stage
+from .partitions import is_partitioned, drop_partitions, partition_name
+from .rag_engine import (
+    _sql_engine, _collection_name, VECTOR_COLLECTION, release_namespace,
+    list_storage_objects, delete_storage_paths,
+)
+from .vector_index import index_name, forget_collection, drop_ann_index
+
+# === Cleanup ===
+# Deleting a session, or a guest leaving, used to list storage, remove objects
+# and delete vectors inside the request, one namespace at a time, and a guest
+# whose browser never sent the cleanup beacon kept everything forever. Here:
+#   * purge_sessions() lists every session folder page by page, removes the
+#     objects STORAGE_PAGE_SIZE per call, and deletes the vectors of the whole
+#     batch with set-based statements (collection_id = ANY(...) on the shared
+#     table, one DROP TABLE over all their partitions on the partitioned one);
+#   * the routes hand that work to one background thread and return at once;
+#   * guest namespaces record when they were last used (upload / ask, written
+#     at most once per GUEST_TOUCH_INTERVAL), and a reaper thread purges the
+#     ones idle for longer than GUEST_IDLE_TTL, REAPER_BATCH at a time. A
+#     Postgres advisory lock lets only one worker process reap at a time. The
+#     same tick drops idle-expired entries from the in-process caches (chains,
+#     guest memory stores), which otherwise only expire on their next access;
+#   * each purge reports the rows and bytes it reclaimed; totals are in /stats.
+
+GUEST_IDLE_TTL = float(os.getenv("GUEST_IDLE_TTL", "86400"))        # idle seconds before a guest is purged
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "900"))        # seconds between runs; 0 = no reaper thread
+REAPER_BATCH = int(os.getenv("REAPER_BATCH", "50"))                 # guest namespaces purged per batch
+GUEST_TOUCH_INTERVAL = float(os.getenv("GUEST_TOUCH_INTERVAL", "300"))
+
+ACTIVITY_TABLE = "doc_assistant_guest_activity"
+REAPER_LOCK_KEY = 0x646F6361  # pg advisory lock id ("doca")
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cleanup")
+_touched = LRUCache(8192)  # guest namespace -> monotonic time its activity was last written
+_totals_lock = threading.Lock()
+_totals = {"purges": 0, "namespaces": 0, "rows": 0, "bytes": 0, "storage_objects": 0, "storage_bytes": 0,
+           "guests_reaped": 0, "last_reap": None}
+_reaper_started = threading.Event()
+_stop = threading.Event()
+_idle_caches: list[LRUCache] = [_memory_stores]  # purge_expired() on every reaper tick
+
+
+def _on_postgres() -> bool:
+    # the activity table, advisory locks and vector purges are Postgres-only;
+    # on the SQLite fallback (e.g. bench.pipeline) guests live in memory only
+    return _sql_engine.dialect.name == "postgresql"
+
+
+@lru_cache(maxsize=1)
+def _ensure_activity_table() -> None:
+    with _sql_engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {ACTIVITY_TABLE} ("
+            " namespace TEXT PRIMARY KEY,"
+            " owner_id TEXT NOT NULL,"
+            " last_seen TIMESTAMPTZ NOT NULL DEFAULT now())"
+        ))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {ACTIVITY_TABLE}_last_seen ON {ACTIVITY_TABLE} (last_seen)"))
+
+
+def _write_touch(owner_id: str, namespace: str) -> None:
+    try:
+        _ensure_activity_table()
+        with _sql_engine.begin() as conn:
+            conn.execute(text(
+                f"INSERT INTO {ACTIVITY_TABLE} (namespace, owner_id) VALUES (:ns, :owner) "
+                "ON CONFLICT (namespace) DO UPDATE SET last_seen = now()"
+            ), {"ns": namespace, "owner": owner_id})
+    except Exception as e:
+        print(f"[CLEANUP] could not record guest activity for {namespace}: {e}")
+
+
+def touch_guest(owner_id: str, namespace: str) -> None:
+    """Mark a guest namespace as in use (written in the background, at most once per GUEST_TOUCH_INTERVAL)."""
+    now = time.monotonic()
+    last = _touched.get(namespace)
+    if last is not None and now - last < GUEST_TOUCH_INTERVAL:
+        return
+    _touched.put(namespace, now)
+    if _on_postgres():
+        _executor.submit(_write_touch, owner_id, namespace)
+
+
+def purge_namespaces(namespaces: list[str]) -> dict:
+    """
+    Delete the vectors of many namespaces at once. `rows`/`bytes` count what
+    was reclaimed: row sizes on the shared table, whole partitions (heap,
+    TOAST and indexes) on the partitioned layout, vectors + text in memory.
+    `purged` is how many namespaces had anything to delete.
+    """
+    namespaces = list(dict.fromkeys(namespaces))
+    report = {"namespaces": len(namespaces), "purged": 0, "rows": 0, "bytes": 0}
+    if not namespaces:
+        return report
+    for ns in namespaces:
+        release_namespace(ns)
+        answer_cache.invalidate(ns)
+        if is_memory_namespace(ns):
+            store = get_memory_store(ns, create=False)
+            if store is not None and len(store):
+                report["purged"] += 1
+                report["rows"] += len(store)
+                report["bytes"] += store.nbytes()
+            drop_memory_store(ns)
+
+    if not _on_postgres():
+        return report
+    # memory namespaces too: they may have rows from before GUEST_VECTOR_BACKEND=memory
+    names = [_collection_name(ns) for ns in namespaces]
+    with _sql_engine.begin() as conn:
+        ids = [str(c) for c in conn.execute(
+            text("SELECT uuid FROM langchain_pg_collection WHERE name = ANY(:names)"), {"names": names}
+        ).scalars()]
+        partitioned = is_partitioned(conn)
+        if ids:
+            if partitioned:
+                rows, size = conn.execute(text(
+                    "SELECT (SELECT count(*) FROM langchain_pg_embedding WHERE collection_id = ANY(CAST(:ids AS uuid[]))), "
+                    "       (SELECT coalesce(sum(pg_total_relation_size(to_regclass(p))), 0) FROM unnest(CAST(:parts AS text[])) AS p)"
+                ), {"ids": ids, "parts": [partition_name(c) for c in ids]}).one()
+                drop_partitions(conn, ids)
+            else:
+                rows, size = conn.execute(text(
+                    "WITH gone AS (DELETE FROM langchain_pg_embedding e WHERE collection_id = ANY(CAST(:ids AS uuid[])) "
+                    "              RETURNING pg_column_size(e.*) AS size) "
+                    "SELECT count(*), coalesce(sum(size), 0) FROM gone"
+                ), {"ids": ids}).one()
+            conn.execute(text("DELETE FROM langchain_pg_collection WHERE uuid = ANY(CAST(:ids AS uuid[]))"), {"ids": ids})
+            if conn.execute(text("SELECT to_regclass(:t) IS NOT NULL"), {"t": REGISTRY_TABLE}).scalar():
+                conn.execute(text(f"DELETE FROM {REGISTRY_TABLE} WHERE collection_id = ANY(CAST(:ids AS uuid[]))"),
+                             {"ids": ids})
+            report["purged"] += len(ids)
+            report["rows"] += int(rows)
+            report["bytes"] += int(size)
+        # partial ANN indexes (shared layout only: partition indexes went with their tables)
+        indexed = [] if partitioned or not ids else list(conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE indexname = ANY(:names)"),
+            {"names": [index_name(c) for c in ids]},
+        ).scalars())
+    for name in names:
+        forget_collection(name)
+    for cid in ids:
+        if index_name(cid) in indexed:
+            try:
+                drop_ann_index(_sql_engine, cid)
+            except Exception as e:
+                print(f"[VECTOR INDEX] could not drop index of collection {cid}: {e}")
+    return report
+
+
+def _record(report: dict, reaped: int = 0) -> None:
+    with _totals_lock:
+        _totals["purges"] += 1
+        for key in ("namespaces", "rows", "bytes", "storage_objects", "storage_bytes"):
+            _totals[key] += report.get(key, 0)
+        _totals["guests_reaped"] += reaped
+
+
+def purge_sessions(sessions: list[tuple[str, str]]) -> dict:
+    """
+    Remove everything of the given (owner_id, namespace) sessions: storage
+    objects, vectors and guest activity rows. Returns what was reclaimed.
+    """
+    started = time.perf_counter()
+    with stage("cleanup"):
+        paths, storage_bytes = [], 0
+        try:
+            for owner_id, namespace in sessions:
+                for path, size in list_storage_objects(f"{owner_id}/{namespace}"):
+                    paths.append(path)
+                    storage_bytes += size
+            delete_storage_paths(paths)
+        except Exception as e:  # storage is best effort: the vectors still go
+            print(f"[CLEANUP] storage cleanup failed: {e}")
+            paths, storage_bytes = [], 0
+        namespaces = [ns for _, ns in sessions]
+        report = purge_namespaces(namespaces)
+        if any(ns.endswith("_session") for ns in namespaces):
+            if _on_postgres():
+                _ensure_activity_table()
+                with _sql_engine.begin() as conn:
+                    conn.execute(text(f"DELETE FROM {ACTIVITY_TABLE} WHERE namespace = ANY(:ns)"), {"ns": namespaces})
+            for ns in namespaces:
+                _touched.pop(ns)
+    report.update(storage_objects=len(paths), storage_bytes=storage_bytes,
+                  seconds=round(time.perf_counter() - started, 3))
+    print(f"[CLEANUP] {report['namespaces']} namespaces: {report['rows']} rows / {report['bytes']} bytes, "
+          f"{report['storage_objects']} files / {report['storage_bytes']} bytes in {report['seconds']}s")
+    return report
+
+
+def _purge_in_background(sessions: list[tuple[str, str]]) -> None:
+    try:
+        _record(purge_sessions(sessions))
+    except Exception as e:
+        print(f"[CLEANUP ERROR] {sessions}: {e}")
+
+
+def schedule_purge(sessions: list[tuple[str, str]]):
+    """Queue purge_sessions() on the cleanup thread; returns its future."""
+    return _executor.submit(_purge_in_background, list(sessions))
+
+
+def _adopt_guest_collections(conn) -> int:
+    """
+    Guest collections without an activity row (created before it was tracked)
+    get one stamped now, so they are reaped one TTL from now.
+    """
+    prefix = f"{VECTOR_COLLECTION}_"
+    return conn.execute(text(
+        f"INSERT INTO {ACTIVITY_TABLE} (namespace, owner_id) "
+        "SELECT substr(name, :start), left(substr(name, :start), -length('_session')) "
+        "FROM langchain_pg_collection WHERE name LIKE :pattern "
+        "ON CONFLICT (namespace) DO NOTHING"
+    ), {"start": len(prefix) + 1, "pattern": prefix + r"guest%\_session"}).rowcount
+
+
+def reap_idle_guests(ttl: float | None = None, batch: int | None = None, dry_run: bool = False) -> dict:
+    """
+    Purge guest namespaces idle for longer than `ttl` seconds, `batch` per
+    round, until none are left. Skipped if another process is reaping, and
+    when the database is not Postgres.
+    """
+    ttl = GUEST_IDLE_TTL if ttl is None else ttl
+    batch = batch or REAPER_BATCH
+    result = {"guests": 0, "batches": 0, "rows": 0, "bytes": 0, "storage_objects": 0, "storage_bytes": 0}
+    if not _on_postgres():
+        return {**result, "skipped": "database is not Postgres"}
+    _ensure_activity_table()
+    idle_query = text(
+        f"SELECT owner_id, namespace FROM {ACTIVITY_TABLE} "
+        "WHERE last_seen < now() - make_interval(secs => :ttl) ORDER BY last_seen LIMIT :n"
+    )
+    with _sql_engine.connect() as lock_conn:
+        # session-level lock, held across the batches below (which use their own connections)
+        locked = lock_conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": REAPER_LOCK_KEY}).scalar()
+        lock_conn.commit()
+        if not locked:
+            return {**result, "skipped": "another process is reaping"}
+        try:
+            with _sql_engine.connect() as conn:
+                result["adopted"] = _adopt_guest_collections(conn)
+                if dry_run:
+                    idle = conn.execute(idle_query, {"ttl": ttl, "n": 1_000_000}).all()
+                    conn.rollback()
+                    return {**result, "guests": len(idle), "idle": [ns for _, ns in idle]}
+                conn.commit()
+            while True:
+                with _sql_engine.connect() as conn:
+                    idle = [tuple(row) for row in conn.execute(idle_query, {"ttl": ttl, "n": batch}).all()]
+                if not idle:
+                    break
+                report = purge_sessions(idle)
+                _record(report, reaped=len(idle))
+                result["guests"] += len(idle)
+                result["batches"] += 1
+                for key in ("rows", "bytes", "storage_objects", "storage_bytes"):
+                    result[key] += report[key]
+                if len(idle) < batch:
+                    break
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": REAPER_LOCK_KEY})
+            lock_conn.commit()
+    with _totals_lock:
+        _totals["last_reap"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    if result["guests"]:
+        print(f"[REAPER] purged {result['guests']} idle guests in {result['batches']} batches: "
+              f"{result['rows']} rows / {result['bytes']} bytes, "
+              f"{result['storage_objects']} files / {result['storage_bytes']} bytes")
+    return result
+
+
+def register_idle_cache(cache: LRUCache) -> None:
+    """Have the reaper thread drop `cache`'s expired entries even when nothing reads it."""
+    _idle_caches.append(cache)
+
+
+def purge_idle_caches() -> int:
+    expired = 0
+    for cache in _idle_caches:
+        try:
+            expired += cache.purge_expired()
+        except Exception as e:
+            print(f"[REAPER ERROR] cache purge: {e}")
+    if expired:
+        print(f"[REAPER] dropped {expired} idle cache entries")
+    return expired
+
+
+def _reaper_loop() -> None:
+    reap = _on_postgres()  # elsewhere the thread only expires the in-process caches
+    while not _stop.wait(REAPER_INTERVAL):
+        purge_idle_caches()
+        if not reap:
+            continue
+        try:
+            reap_idle_guests()
+        except Exception as e:
+            print(f"[REAPER ERROR] {e}")
+
+
+def start_reaper() -> bool:
+    """Start the idle-guest reaper thread (once per process). False if REAPER_INTERVAL is 0."""
+    if REAPER_INTERVAL <= 0 or _reaper_started.is_set():
+        return False
+    _reaper_started.set()
+    threading.Thread(target=_reaper_loop, name="guest-reaper", daemon=True).start()
+    return True
+
+
+def cleanup_stats() -> dict:
+    with _totals_lock:
+        totals = dict(_totals)
+    return {**totals, "guest_idle_ttl": GUEST_IDLE_TTL, "reaper_interval": REAPER_INTERVAL,
+            "reaper_running": _reaper_started.is_set()}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Purge sessions and idle guest namespaces.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    reap = sub.add_parser("reap", help="purge guest namespaces idle for longer than the TTL")
+    reap.add_argument("--ttl", type=float, default=None, help=f"idle seconds (default GUEST_IDLE_TTL={GUEST_IDLE_TTL:g})")
+    reap.add_argument("--dry-run", action="store_true", help="only list what would be purged")
+    purge = sub.add_parser("purge", help="purge the given sessions now")
+    purge.add_argument("sessions", nargs="+", metavar="OWNER/NAMESPACE")
+    args = ap.parse_args()
+    if args.cmd == "reap":
+        print(reap_idle_guests(ttl=args.ttl, dry_run=args.dry_run))
+    else:
+        print(purge_sessions([tuple(s.split("/", 1)) for s in args.sessions]))
+
+
+if __name__ == "__main__":
+    main()
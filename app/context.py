@@ -0,0 +1,167 @@
+import os
+import re
+
+from langchain_core.documents import Document
+
+from .chunking import estimate_tokens
+
+# === Context assembly ===
+# RetrievalQA's "stuff" step pastes every retrieved chunk into the prompt.
+# Between retrieval and the LLM call, assemble_context():
+#   * drops chunks whose cosine `score` is below CONTEXT_MIN_SCORE, unless the
+#     keyword search also found them (the best chunk is always kept);
+#   * merges chunks of the same document that overlap (the overlap is kept
+#     once) or are neighbours (consecutive `chunk` numbers), in reading order;
+#   * fills CONTEXT_TOKEN_BUDGET tokens with the result, best first; the
+#     chunk that no longer fits is cut at a sentence end if enough room is
+#     left, and the rest are left out. The best one is always kept, cut at a
+#     word if no whole sentence of it fits.
+# Token counts are estimates (app/chunking.py's word-piece estimate), which is
+# close enough to size a budget.
+
+CONTEXT_ASSEMBLY = os.getenv("CONTEXT_ASSEMBLY", "1") == "1"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))  # tokens of retrieved text per prompt
+CONTEXT_MIN_SCORE = float(os.getenv("CONTEXT_MIN_SCORE", "0.2"))       # cosine similarity; 0 = keep all
+CONTEXT_MIN_PART_TOKENS = 64      # a chunk is cut to fit the budget only if this much room is left
+_MIN_OVERLAP_CHARS = 20
+
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]?(?=\s)")
+
+
+def _source(doc: Document):
+    return doc.metadata.get("doc_id") or doc.metadata.get("storage_path")
+
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b` (0 below _MIN_OVERLAP_CHARS)."""
+    head = b[:_MIN_OVERLAP_CHARS]
+    if len(head) < _MIN_OVERLAP_CHARS:
+        return 0
+    start = a.find(head, max(0, len(a) - len(b)))
+    while start != -1:
+        if b.startswith(a[start:]):
+            return len(a) - start
+        start = a.find(head, start + 1)
+    return 0
+
+
+class _Part:
+    """A run of merged chunks of one document."""
+
+    def __init__(self, doc: Document, rank: int):
+        self.doc, self.rank = doc, rank
+        self.source = _source(doc)
+        self.text = doc.page_content
+        self.first = self.last = doc.metadata.get("chunk")
+        self.page = doc.metadata.get("page")
+        self.page_end = doc.metadata.get("page_end", self.page)
+        self.merged = 1
+
+    def _neighbour(self, other: "_Part") -> int:
+        """1 if `other` directly follows this run, -1 if it directly precedes it, else 0."""
+        if self.first is None or other.first is None:
+            return 0
+        return 1 if other.first == self.last + 1 else -1 if other.last == self.first - 1 else 0
+
+    def _touches(self, other: "_Part") -> bool:
+        """Whether the chunk ranges intersect or are adjacent (True when either has no chunk numbers)."""
+        if self.first is None or other.first is None:
+            return True
+        return other.first <= self.last + 1 and other.last >= self.first - 1
+
+    def merge(self, other: "_Part") -> bool:
+        """Take `other` in if it is the same document and overlaps or neighbours this run."""
+        # repeated text (boilerplate, a warning printed twice) must not join runs across a gap
+        if self.source is None or other.source != self.source or not self._touches(other):
+            return False
+        a, b = self.text, other.text
+        if b in a:
+            text = a
+        elif a in b:
+            text = b
+        elif k := _overlap(a, b):
+            text = a + b[k:]
+        elif k := _overlap(b, a):
+            text = b + a[k:]
+        elif side := self._neighbour(other):
+            text = a + "\n" + b if side > 0 else b + "\n" + a
+        else:
+            return False
+        self.text = text
+        self.rank = min(self.rank, other.rank)
+        self.merged += other.merged
+        if self.page is not None and other.page is not None:
+            self.page, self.page_end = min(self.page, other.page), max(self.page_end, other.page_end)
+        if self.first is not None and other.first is not None:
+            self.first, self.last = min(self.first, other.first), max(self.last, other.last)
+        return True
+
+    def document(self, text: str | None = None) -> Document:
+        meta = dict(self.doc.metadata)
+        if self.page is not None:
+            meta.update(page=self.page, page_end=self.page_end)
+        if self.first is not None:
+            meta["chunk"] = self.first
+        if self.merged > 1:
+            meta["merged_chunks"] = self.merged
+        return Document(page_content=text or self.text, metadata=meta)
+
+
+def _relevant(docs: list[Document], min_score: float) -> list[Document]:
+    """Drop weak vector-only matches; the best chunk always stays."""
+    return [d for i, d in enumerate(docs)
+            if i == 0 or "lexical_rank" in d.metadata or d.metadata.get("score", 1.0) >= min_score]
+
+
+def _cut(text: str, tokens: int) -> str:
+    """The longest run of whole sentences of `text` within `tokens` ("" if not even one)."""
+    end = used = 0
+    for m in _SENTENCE_END.finditer(text):
+        used += estimate_tokens(text[end:m.end()])
+        if used > tokens:
+            break
+        end = m.end()
+    return text[:end]
+
+
+def _cut_words(text: str, tokens: int) -> str:
+    """The longest run of whole words of `text` within `tokens` (at least the first word)."""
+    end = used = 0
+    for m in re.finditer(r"\S+", text):
+        used += estimate_tokens(m.group())
+        if used > tokens and end:
+            break
+        end = m.end()
+    return text[:end]
+
+
+def assemble_context(docs: list[Document], budget: int | None = None,
+                     min_score: float | None = None) -> list[Document]:
+    """Retrieved chunks (best first) -> the documents to put in the prompt, best first."""
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    min_score = CONTEXT_MIN_SCORE if min_score is None else min_score
+    parts: list[_Part] = []
+    for rank, doc in enumerate(_relevant(docs, min_score)):
+        part = _Part(doc, rank)
+        if not any(p.merge(part) for p in parts):
+            parts.append(part)
+    # a merge can make two runs of one document meet
+    merged: list[_Part] = []
+    for part in parts:
+        if not any(m.merge(part) for m in merged):
+            merged.append(part)
+
+    out, used = [], 0
+    for part in sorted(merged, key=lambda p: p.rank):
+        n = estimate_tokens(part.text)
+        if used + n <= budget:
+            out.append(part.document())
+            used += n
+        elif not out or budget - used >= CONTEXT_MIN_PART_TOKENS:
+            text = _cut(part.text, budget - used)
+            if not text and not out:  # never leave the prompt without a source
+                text = _cut_words(part.text, budget - used)
+            if text:
+                out.append(part.document(text))
+                used += estimate_tokens(text)
+    return out
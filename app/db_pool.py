@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+from functools import lru_cache
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# === Shared database pool ===
+# One engine per process for everything in rag_engine that talks to Postgres:
+# pgvector stores, bulk inserts, caches and deletes. (Flask-SQLAlchemy keeps its
+# own small pool from main.py: an engine built on another engine's pool never
+# runs its dialect initialization.)
+
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "5"))
+PG_MAX_OVERFLOW = int(os.getenv("PG_MAX_OVERFLOW", "5"))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+
+
+def database_url() -> str | None:
+    url = os.getenv("DATABASE_URL")
+    if url and url.startswith("postgres://"):
+        # Some providers give old scheme; SQLAlchemy expects postgresql://
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that counts checkouts, waits for a free connection, and timeouts."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        # every connection is in use and no overflow slot is left: we will block
+        saturated = self.checkedin() == 0 and self.overflow() >= self._max_overflow
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.checkouts += 1
+            if saturated:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        return conn
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": self.overflow(),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds, 4),
+                "max_wait_seconds": round(self.max_wait_seconds, 4),
+            }
+
+
+@lru_cache(maxsize=1)
+def get_engine():
+    return create_engine(
+        database_url(),
+        future=True,
+        poolclass=InstrumentedQueuePool,
+        pool_size=PG_POOL_SIZE,
+        max_overflow=PG_MAX_OVERFLOW,
+        pool_timeout=PG_POOL_TIMEOUT,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+    )
+
+
+def pool_stats() -> dict | None:
+    pool = get_engine().pool
+    return pool.stats() if isinstance(pool, InstrumentedQueuePool) else None
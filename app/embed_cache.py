@@ -0,0 +1,188 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+
+from sqlalchemy import text
+
+from .cache import LRUCache
+
+# === Content-addressed embedding cache ===
+# Vectors are keyed by (model name, sha256 of the chunk text), so re-uploading
+# the same PDF into a new session needs no calls to the embedding endpoint.
+# Lookups go to an in-memory LRU first, then to a persistent store (a Postgres
+# table by default, or a local SQLite file). Vectors are kept as packed float32
+# bytes (~1.5 KB for MiniLM) to keep the in-memory front small.
+
+EMBED_CACHE = os.getenv("EMBED_CACHE", "postgres")  # postgres | sqlite | memory | off
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "5000"))  # in-memory entries
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embedding_cache.sqlite3")
+
+CACHE_TABLE = "doc_assistant_embedding_cache"
+
+
+def text_hash(s: str) -> str:
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+
+def pack_vector(vec) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def unpack_vector(blob: bytes) -> list[float]:
+    out = array("f")
+    out.frombytes(blob)
+    return out.tolist()
+
+
+class PgEmbeddingStore:
+    """Persistent store in the app's Postgres database."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._ready = False
+
+    def _ensure_table(self, conn) -> None:
+        if self._ready:
+            return
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {CACHE_TABLE} ("
+            " model TEXT NOT NULL,"
+            " text_hash CHAR(64) NOT NULL,"
+            " embedding BYTEA NOT NULL,"
+            " created_at TIMESTAMPTZ NOT NULL DEFAULT now(),"
+            " PRIMARY KEY (model, text_hash))"
+        ))
+        self._ready = True
+
+    def get_many(self, model: str, hashes: list[str]) -> dict[str, bytes]:
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            rows = conn.execute(
+                text(f"SELECT text_hash, embedding FROM {CACHE_TABLE} WHERE model = :model AND text_hash = ANY(:hashes)"),
+                {"model": model, "hashes": hashes},
+            )
+            return {h: bytes(blob) for h, blob in rows}
+
+    def put_many(self, model: str, items: dict[str, bytes]) -> None:
+        with self.engine.begin() as conn:
+            self._ensure_table(conn)
+            conn.execute(
+                text(f"INSERT INTO {CACHE_TABLE} (model, text_hash, embedding) VALUES (:model, :h, :blob) "
+                     "ON CONFLICT (model, text_hash) DO NOTHING"),
+                [{"model": model, "h": h, "blob": blob} for h, blob in items.items()],
+            )
+
+
+class SqliteEmbeddingStore:
+    """Persistent store in a local SQLite file (survives restarts on a persistent disk)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, embedding BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, hashes: list[str]) -> dict[str, bytes]:
+        found = {}
+        with self._lock:
+            # stay under SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, embedding FROM embedding_cache WHERE model = ? AND text_hash IN ({marks})",
+                    [model, *part],
+                )
+                found.update({h: bytes(blob) for h, blob in rows})
+        return found
+
+    def put_many(self, model: str, items: dict[str, bytes]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embedding_cache (model, text_hash, embedding) VALUES (?, ?, ?)",
+                [(model, h, blob) for h, blob in items.items()],
+            )
+            self._conn.commit()
+
+
+class EmbeddingCache:
+    def __init__(self, model: str, store=None, maxsize: int = EMBED_CACHE_SIZE):
+        self.model = model
+        self.store = store
+        self.memory = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.store_hits = 0
+        self.store_errors = 0
+        self.misses = 0
+
+    def get_many(self, texts: list[str], local_only: bool = False) -> dict[str, list[float]]:
+        """
+        Return {text_hash: vector} for every text found in memory or the store
+        (`local_only`: memory only).
+        """
+        found: dict[str, bytes] = {}
+        pending = []
+        for h in {text_hash(t) for t in texts}:
+            blob = self.memory.get(h)
+            if blob is None:
+                pending.append(h)
+            else:
+                found[h] = blob
+        if pending and self.store is not None and not local_only:
+            try:
+                from_store = self.store.get_many(self.model, pending)
+            except Exception as e:
+                from_store = {}
+                with self._lock:
+                    self.store_errors += 1
+                print(f"[EMBED CACHE] store lookup failed: {e}")
+            for h, blob in from_store.items():
+                self.memory.put(h, blob)
+                found[h] = blob
+            with self._lock:
+                self.store_hits += len(from_store)
+        with self._lock:
+            self.misses += len(pending) - sum(1 for h in pending if h in found)
+        return {h: unpack_vector(blob) for h, blob in found.items()}
+
+    def put_many(self, texts: list[str], vectors: list[list[float]], local_only: bool = False) -> None:
+        items = {text_hash(t): pack_vector(v) for t, v in zip(texts, vectors)}
+        for h, blob in items.items():
+            self.memory.put(h, blob)
+        if items and self.store is not None and not local_only:
+            try:
+                self.store.put_many(self.model, items)
+            except Exception as e:
+                with self._lock:
+                    self.store_errors += 1
+                print(f"[EMBED CACHE] store write failed: {e}")
+
+    def stats(self) -> dict:
+        mem = self.memory.stats()
+        with self._lock:
+            return {
+                "model": self.model,
+                "backend": EMBED_CACHE,
+                "memory": mem,
+                "store_hits": self.store_hits,
+                "store_errors": self.store_errors,
+                "misses": self.misses,
+            }
+
+
+def build_embedding_cache(model: str, engine=None) -> EmbeddingCache | None:
+    """Create the cache selected by EMBED_CACHE (None when disabled)."""
+    if EMBED_CACHE == "off":
+        return None
+    if EMBED_CACHE == "sqlite":
+        return EmbeddingCache(model, SqliteEmbeddingStore(EMBED_CACHE_PATH))
+    if EMBED_CACHE == "postgres" and engine is not None:
+        return EmbeddingCache(model, PgEmbeddingStore(engine))
+    return EmbeddingCache(model)
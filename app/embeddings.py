@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tenacity import retry, stop_after_attempt, wait_exponential
+
+# === Batched, concurrent embedding ===
+# SafeEmbeddings.embed_documents hands its texts to EmbeddingBatcher, which cuts
+# them into micro-batches, sends up to EMBED_CONCURRENCY batches at once and
+# retries only the batch that failed. Results come back in input order.
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+
+# Upper bounds (seconds) of the batch latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+
+class EmbeddingStats:
+    """Thread-safe throughput counters for tuning EMBED_BATCH_SIZE / EMBED_CONCURRENCY."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0            # embed() calls (one per upsert batch)
+        self.chunks = 0           # texts embedded successfully
+        self.batches = 0          # micro-batches that succeeded
+        self.retries = 0          # failed batch attempts that were retried
+        self.failures = 0         # batches that gave up after all retries
+        self.busy_seconds = 0.0   # wall time spent inside embed()
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def record_batch(self, seconds: float) -> None:
+        with self._lock:
+            self.batches += 1
+            for i, upper in enumerate(LATENCY_BUCKETS):
+                if seconds <= upper:
+                    self.buckets[i] += 1
+                    break
+
+    def record_call(self, n_chunks: int, seconds: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.chunks += n_chunks
+            self.busy_seconds += seconds
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "batch_size": EMBED_BATCH_SIZE,
+                "concurrency": EMBED_CONCURRENCY,
+                "calls": self.calls,
+                "chunks": self.chunks,
+                "batches": self.batches,
+                "retries": self.retries,
+                "failures": self.failures,
+                "chunks_per_sec": round(self.chunks / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+                # cumulative counts, Prometheus-style ("le" = less than or equal)
+                "batch_latency_seconds": {
+                    ("+Inf" if upper == float("inf") else str(upper)): sum(self.buckets[: i + 1])
+                    for i, upper in enumerate(LATENCY_BUCKETS)
+                },
+            }
+
+
+embedding_stats = EmbeddingStats()
+
+# One pool per process, so concurrent indexing jobs share the same cap on
+# in-flight requests to the embedding endpoint.
+_pool = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="embed")
+
+
+class EmbeddingBatcher:
+    def __init__(self, embed_fn, batch_size: int = EMBED_BATCH_SIZE, stats: EmbeddingStats = embedding_stats):
+        self.embed_fn = embed_fn
+        self.batch_size = max(1, batch_size)
+        self.stats = stats
+
+    def _before_retry(self, retry_state) -> None:
+        self.stats.record_retry()
+        print(f"[EMBED] batch attempt {retry_state.attempt_number} failed, retrying: {retry_state.outcome.exception()}")
+
+    def _embed_batch(self, batch: list[str]) -> list[list[float]]:
+        @retry(reraise=True, stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, min=0.5, max=4),
+               before_sleep=self._before_retry)
+        def attempt():
+            started = time.perf_counter()
+            vectors = self.embed_fn(batch)
+            self.stats.record_batch(time.perf_counter() - started)
+            return vectors
+
+        try:
+            return attempt()
+        except Exception:
+            self.stats.record_failure()
+            raise
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        texts = list(texts)
+        if not texts:
+            return []
+        started = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            results = [self._embed_batch(batches[0])]
+        else:
+            # map() keeps input order and re-raises the first batch error
+            results = list(_pool.map(self._embed_batch, batches))
+        self.stats.record_call(len(texts), time.perf_counter() - started)
+        return [vec for batch in results for vec in batch]
@@ -0,0 +1,89 @@
+import hashlib
+import json
+
+from sqlalchemy import text
+
+from .vector_store import get_or_create_collection_id
+
+# === Whole-document dedup ===
+# Every freshly indexed PDF is registered under a fingerprint of its bytes plus
+# the pipeline settings (splitter + embedding model) and its chunks are tagged
+# with that fingerprint. When the same file is uploaded into another session,
+# its rows are copied inside Postgres (INSERT ... SELECT) instead of being
+# parsed, split and embedded again.
+
+REGISTRY_TABLE = "doc_assistant_doc_fingerprints"
+
+
+def document_fingerprint(pdf_bytes: bytes, pipeline_signature: str) -> str:
+    h = hashlib.sha256(pdf_bytes)
+    h.update(b"\0")
+    h.update(pipeline_signature.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _ensure_registry(conn) -> None:
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {REGISTRY_TABLE} ("
+        " fingerprint CHAR(64) PRIMARY KEY,"
+        " collection_id UUID NOT NULL,"
+        " chunk_count INTEGER NOT NULL,"
+        " created_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+    ))
+
+
+def has_indexed_document(engine, fingerprint: str) -> bool:
+    with engine.begin() as conn:
+        _ensure_registry(conn)
+        return conn.execute(
+            text(f"SELECT 1 FROM {REGISTRY_TABLE} WHERE fingerprint = :fp"), {"fp": fingerprint}
+        ).first() is not None
+
+
+def copy_indexed_document(engine, fingerprint: str, collection: str, metadata: dict) -> int | None:
+    """
+    Copy the chunks + vectors of an already indexed, identical PDF into
+    `collection`, overriding per-upload metadata (owner, storage path, title).
+    Returns the number of rows copied, or None if there is nothing to reuse
+    (unknown fingerprint, or the source session was deleted since).
+    """
+    with engine.connect() as conn, conn.begin() as tx:
+        _ensure_registry(conn)
+        row = conn.execute(
+            text(f"SELECT collection_id, chunk_count FROM {REGISTRY_TABLE} WHERE fingerprint = :fp"),
+            {"fp": fingerprint},
+        ).first()
+        if not row:
+            return None
+        src_id, expected = row
+        dst_id = get_or_create_collection_id(conn, collection)
+        copied = conn.execute(
+            text(
+                "INSERT INTO langchain_pg_embedding (uuid, collection_id, embedding, document, cmetadata, custom_id) "
+                "SELECT gen_random_uuid(), :dst, embedding, document, "
+                "       (cmetadata::jsonb || CAST(:meta AS jsonb))::json, gen_random_uuid()::text "
+                "FROM langchain_pg_embedding "
+                "WHERE collection_id = :src AND cmetadata->>'doc_fingerprint' = :fp"
+            ),
+            {"dst": dst_id, "src": src_id, "fp": fingerprint, "meta": json.dumps(metadata)},
+        ).rowcount
+        if copied != expected:
+            # Source rows are gone or incomplete: undo and let the caller re-index
+            tx.rollback()
+            return None
+    return copied
+
+
+def register_document(engine, fingerprint: str, collection: str, chunk_count: int) -> None:
+    """Record `collection` as the source of truth for this fingerprint (latest wins)."""
+    with engine.begin() as conn:
+        _ensure_registry(conn)
+        coll_id = get_or_create_collection_id(conn, collection)
+        conn.execute(
+            text(
+                f"INSERT INTO {REGISTRY_TABLE} (fingerprint, collection_id, chunk_count) VALUES (:fp, :cid, :n) "
+                "ON CONFLICT (fingerprint) DO UPDATE "
+                "SET collection_id = EXCLUDED.collection_id, chunk_count = EXCLUDED.chunk_count, created_at = now()"
+            ),
+            {"fp": fingerprint, "cid": coll_id, "n": chunk_count},
+        )
@@ -0,0 +1,152 @@
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from uuid import UUID
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from sqlalchemy import text
+
+from .embed_cache import text_hash
+
+# === Hybrid retrieval ===
+# MiniLM embeddings are weak on part numbers, error codes and acronyms, which
+# plain keyword search finds easily. The hybrid retriever runs a lexical search
+# next to the vector search and merges both rankings with reciprocal rank
+# fusion (score = sum of 1 / (RRF_K + rank)). The lexical side is Postgres
+# full-text search for database namespaces (a stored tsvector column over the
+# chunk text, GIN-indexed by app/vector_index.py: ranking reads the stored
+# vector instead of re-parsing every matching chunk), and a small BM25 index kept
+# with the vectors for in-memory guest namespaces. Both searches run in
+# parallel, so the fused result costs about as much as the slower of the two.
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")      # hybrid | vector
+TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "english")
+TEXT_COLUMN = "document_fts"  # generated from document with TEXT_SEARCH_CONFIG
+RRF_K = int(os.getenv("RRF_K", "60"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "2"))  # each side fetches k * this
+
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lexical")
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(s: str) -> list[str]:
+    """Lowercased words; keeps codes like "e-404" or "v2.1" as one token."""
+    return _TOKEN.findall(s.lower())
+
+
+class BM25Index:
+    """Append-only in-memory BM25 (Okapi, k1=1.5, b=0.75) over chunk texts."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self._postings: dict[str, list[tuple[int, int]]] = {}   # token -> [(doc, tf)]
+        self._lengths: list[int] = []
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def add(self, texts: list[str]) -> None:
+        with self._lock:
+            for t in texts:
+                doc = len(self._lengths)
+                counts = Counter(tokenize(t))
+                for token, tf in counts.items():
+                    self._postings.setdefault(token, []).append((doc, tf))
+                n = sum(counts.values())
+                self._lengths.append(n)
+                self._total += n
+
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        """[(doc index, score)] best first."""
+        with self._lock:
+            n_docs = len(self._lengths)
+            if not n_docs:
+                return []
+            avgdl = self._total / n_docs or 1.0
+            scores: dict[int, float] = {}
+            for token in set(tokenize(query)):
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, tf in postings:
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[doc] / avgdl)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def text_search_sql(collection_id, q: str = ":q", k: str = ":k") -> str:
+    """pg_text_search()'s query; `q` (the question) and `k` are the driver's placeholders."""
+    cid = UUID(str(collection_id))  # inlined so the partial/partition indexes apply
+    return (f"SELECT document, cmetadata, ts_rank({TEXT_COLUMN}, q, 1) AS rank "
+            f"FROM langchain_pg_embedding, "
+            f"     CAST(replace(plainto_tsquery('{TEXT_SEARCH_CONFIG}', {q})::text, '&', '|') AS tsquery) AS q "
+            f"WHERE collection_id = '{cid}' AND {TEXT_COLUMN} @@ q "
+            f"ORDER BY rank DESC LIMIT {k}")
+
+
+def pg_text_search(engine, collection_id, query: str, k: int) -> list[Document]:
+    """Full-text matches in one collection, ranked by ts_rank (length-normalized); any query word may match."""
+    if collection_id is None or not tokenize(query):
+        return []
+    with engine.connect() as conn:
+        rows = conn.execute(text(text_search_sql(collection_id)), {"q": query, "k": k}).all()
+    return [Document(page_content=doc, metadata={**(meta or {}), "lexical_rank": float(rank)})
+            for doc, meta, rank in rows]
+
+
+def reciprocal_rank_fusion(rankings: list[list[Document]], k: int, rrf_k: int = RRF_K) -> list[Document]:
+    """
+    Merge ranked lists; a chunk found by several lists keeps the first list's
+    metadata, plus any keys only a later list set (e.g. `lexical_rank`).
+    """
+    fused: dict[str, float] = {}
+    docs: dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = text_hash(doc.page_content)
+            fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            if key not in docs:
+                docs[key] = doc
+            elif doc.metadata.keys() - docs[key].metadata.keys():
+                docs[key] = Document(page_content=docs[key].page_content,
+                                     metadata={**doc.metadata, **docs[key].metadata})
+    best = heapq.nlargest(k, fused.items(), key=lambda item: item[1])
+    return [Document(page_content=docs[key].page_content,
+                     metadata={**docs[key].metadata, "rrf_score": round(score, 6)})
+            for key, score in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    `vector` (anything with search_by_vector, built for `k * HYBRID_CANDIDATES`
+    results) + lexical search `lexical(query, n) -> [Document]`, fused with RRF.
+    """
+
+    vector: BaseRetriever
+    lexical: object
+    embedding: Embeddings
+    k: int = 4
+
+    def search_with_vector(self, query: str, vector: list[float] | None = None) -> list[Document]:
+        # lexical search runs while the question is embedded and the vector search runs
+        lexical = _pool.submit(self.lexical, query, self.k * HYBRID_CANDIDATES)
+        if vector is None:
+            vector = self.embedding.embed_query(query)
+        dense = self.vector.search_by_vector(vector)
+        try:
+            sparse = lexical.result()
+        except Exception as e:  # lexical search is best effort
+            print(f"[HYBRID] lexical search failed: {e}")
+            sparse = []
+        return reciprocal_rank_fusion([dense, sparse], self.k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return self.search_with_vector(query)
@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+# === Background indexing jobs ===
+# /upload reads each PDF once and queues one job per request; a small in-process
+# worker pool does the parse → chunk → embed → pgvector work so the HTTP worker
+# is released immediately. Job state lives in this process, so run gunicorn with
+# one worker and several threads (see README) for /jobs/<id> polling to work.
+
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "2"))
+JOB_TTL_SECONDS = int(os.getenv("INDEX_JOB_TTL", "3600"))  # finished jobs are forgotten after this
+# Each queued file holds its whole PDF in memory until a worker is done with it,
+# so /upload is turned away (503) once this many files are queued or running.
+INDEX_QUEUE_MAX = int(os.getenv("INDEX_QUEUE_MAX", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=INDEX_WORKERS, thread_name_prefix="indexer")
+_jobs: dict[str, "IndexJob"] = {}
+_jobs_lock = threading.Lock()
+_pending_files = 0  # files reserved, queued or running; guarded by _jobs_lock
+
+
+class IndexQueueFull(Exception):
+    """Raised when the indexing backlog has no room for more files."""
+
+
+class FileProgress:
+    """Per-file counters updated by the indexing pipeline's progress callback."""
+
+    def __init__(self, storage_path: str, title: str, pdf_bytes: bytes | None = None):
+        from .rag_engine import document_id
+
+        self.storage_path = storage_path
+        self.doc_id = document_id(storage_path)
+        self.title = title
+        # Set for fresh uploads (stored + indexed from these bytes); None means
+        # the file is already in storage and is re-indexed from there.
+        self.pdf_bytes = pdf_bytes
+        self.status = "queued"
+        self.error = None
+        self.pages_total = 0
+        self.pages_parsed = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.chunks_written = 0
+        self.chunks_reused = 0    # replace mode: unchanged chunks that kept their vectors
+
+    def __call__(self, stage: str, n: int) -> None:
+        # "*_total" events set a value; everything else is an increment
+        if stage.endswith("_total"):
+            setattr(self, stage, n)
+        else:
+            setattr(self, stage, getattr(self, stage) + n)
+
+    def to_dict(self) -> dict:
+        return {
+            "title": self.title,
+            "doc_id": self.doc_id,
+            "status": self.status,
+            "error": self.error,
+            "pages_total": self.pages_total,
+            "pages_parsed": self.pages_parsed,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_written": self.chunks_written,
+            "chunks_reused": self.chunks_reused,
+        }
+
+
+class IndexJob:
+    def __init__(self, owner_id: str, namespace: str, files: list[FileProgress], replace: bool = False):
+        self.id = uuid4().hex
+        self.owner_id = owner_id
+        self.namespace = namespace
+        self.files = files
+        self.replace = replace  # files overwrite the documents stored at their paths
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "session_id": self.namespace,
+            "files": [f.to_dict() for f in self.files],
+        }
+
+
+def _run_job(job: IndexJob) -> None:
+    from .rag_engine import index_pdf_bytes, index_pdf_from_storage_path, replace_document_bytes
+
+    job.status = "running"
+    failed = 0
+    for f in job.files:
+        f.status = "running"
+        try:
+            if job.replace:
+                replace_document_bytes(
+                    f.pdf_bytes,
+                    f.storage_path,
+                    owner_id=job.owner_id,
+                    title=f.title,
+                    namespace=job.namespace,
+                    progress=f,
+                )
+            elif f.pdf_bytes is not None:
+                index_pdf_bytes(
+                    f.pdf_bytes,
+                    f.storage_path,
+                    owner_id=job.owner_id,
+                    title=f.title,
+                    namespace=job.namespace,
+                    progress=f,
+                )
+            else:
+                index_pdf_from_storage_path(
+                    f.storage_path,
+                    owner_id=job.owner_id,
+                    title=f.title,
+                    namespace=job.namespace,
+                    progress=f,
+                )
+            f.status = "done"
+        except Exception as e:
+            import traceback
+            failed += 1
+            f.status = "failed"
+            f.error = f"{type(e).__name__}: {e}"
+            print(f"[INDEX JOB ERROR] job={job.id} file={f.storage_path}: {f.error}\n{traceback.format_exc()}")
+        finally:
+            f.pdf_bytes = None  # release the upload as soon as this file is done
+            release_index_slots(1)
+    job.status = "failed" if failed == len(job.files) else ("partial" if failed else "done")
+    job.finished_at = time.time()
+    print(f"[INDEX JOB] job={job.id} namespace={job.namespace} status={job.status}")
+
+
+def _prune_finished() -> None:
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for job_id in [j.id for j in _jobs.values() if j.finished_at and j.finished_at < cutoff]:
+        _jobs.pop(job_id, None)
+
+
+def reserve_index_slots(n: int) -> bool:
+    """Claim room for `n` files in the backlog; False (nothing claimed) when it is full."""
+    global _pending_files
+    with _jobs_lock:
+        if _pending_files and _pending_files + n > INDEX_QUEUE_MAX:
+            return False
+        _pending_files += n  # an empty queue always takes one request, however many files
+        return True
+
+
+def release_index_slots(n: int) -> None:
+    global _pending_files
+    with _jobs_lock:
+        _pending_files = max(0, _pending_files - n)
+
+
+def submit_index_job(owner_id: str, namespace: str, uploads: list[tuple[str, bytes | None]],
+                     replace: bool = False, titles: list[str] | None = None,
+                     reserved: bool = False) -> IndexJob:
+    """
+    Queue indexing into `namespace`; returns the job right away.
+    `uploads` is a list of (storage_path, pdf_bytes) pairs; pass None as the
+    bytes to re-index a file that is already in storage. With `replace`, each
+    pair replaces the document already stored at that path (see
+    rag_engine.replace_document_bytes). `titles` name the files in the job's
+    progress (default: the storage file names). Raises IndexQueueFull when the backlog is full, unless the caller
+    already holds the slots (`reserved`, see reserve_index_slots).
+    """
+    if not reserved and not reserve_index_slots(len(uploads)):
+        raise IndexQueueFull(f"{INDEX_QUEUE_MAX} files are already waiting to be indexed")
+    titles = titles or [os.path.basename(path) for path, _ in uploads]
+    files = [FileProgress(path, title, data) for (path, data), title in zip(uploads, titles)]
+    job = IndexJob(owner_id=owner_id, namespace=namespace, files=files, replace=replace)
+    with _jobs_lock:
+        _prune_finished()
+        _jobs[job.id] = job
+    _executor.submit(_run_job, job)
+    return job
+
+
+def get_job(job_id: str) -> IndexJob | None:
+    with _jobs_lock:
+        return _jobs.get(job_id)
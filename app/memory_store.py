@@ -0,0 +1,225 @@
+import json
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from .cache import LRUCache
+from .hybrid import BM25Index
+
+# === In-process vector store ===
+# Guest sessions are small and short-lived. Their chunks and vectors stay in the
+# web process as one contiguous float32 matrix of unit-length rows, so a search
+# is a single matrix-vector product plus argpartition for the top k, with no
+# Postgres insert, no network round trip and no delete to run afterwards. The
+# stores live in an LRU with an idle TTL, so an abandoned guest session is
+# evicted on its own. With MEMORY_STORE_DIR set, each store is also written to
+# disk (vectors.npy + docs.jsonl) and memory-mapped back after a restart.
+# Job state and this store are per process, as with background indexing.
+
+GUEST_VECTOR_BACKEND = os.getenv("GUEST_VECTOR_BACKEND", "memory")  # memory | postgres
+MEMORY_STORE_MAX_NAMESPACES = int(os.getenv("MEMORY_STORE_MAX_NAMESPACES", "256"))
+MEMORY_STORE_TTL = float(os.getenv("MEMORY_STORE_TTL", "3600"))  # idle seconds before a session is dropped
+MEMORY_STORE_DIR = os.getenv("MEMORY_STORE_DIR")                  # unset = memory only
+
+
+def is_memory_namespace(namespace: str) -> bool:
+    """Guest namespaces ("<guest_id>_session") use the in-process store unless disabled."""
+    return (GUEST_VECTOR_BACKEND == "memory" and namespace.startswith("guest")
+            and namespace.endswith("_session"))
+
+
+def _unit_rows(vectors) -> np.ndarray:
+    m = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+class MemoryVectorStore:
+    """One namespace: unit-vector matrix (grown by doubling) plus parallel chunk lists."""
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._matrix = None       # (capacity, dim) float32; rows [:n] are in use
+        self.n = 0
+        self.texts: list[str] = []
+        self.metadatas: list[dict] = []
+        self.lexical = BM25Index()  # keyword side of hybrid retrieval (app/hybrid.py)
+        if path and os.path.exists(os.path.join(path, "vectors.npy")):
+            self._load()
+
+    def _load(self) -> None:
+        # read-only memmap: pages are loaded on demand; copied on the next add
+        self._matrix = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+        with open(os.path.join(self.path, "docs.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                self.texts.append(row["text"])
+                self.metadatas.append(row["metadata"])
+        self.n = min(len(self.texts), self._matrix.shape[0])
+        del self.texts[self.n:], self.metadatas[self.n:]
+        self.lexical.add(self.texts)
+
+    def add(self, texts: list[str], vectors: list[list[float]], metadatas: list[dict]) -> int:
+        rows = _unit_rows(vectors)
+        with self._lock:
+            needed = self.n + len(rows)
+            if self._matrix is None or needed > self._matrix.shape[0] or not self._matrix.flags.writeable:
+                capacity = max(needed, 2 * (self._matrix.shape[0] if self._matrix is not None else 0), 64)
+                grown = np.empty((capacity, rows.shape[1]), dtype=np.float32)
+                if self.n:
+                    grown[:self.n] = self._matrix[:self.n]
+                self._matrix = grown
+            self._matrix[self.n:needed] = rows
+            self.n = needed
+            self.texts.extend(texts)
+            self.metadatas.extend(metadatas)
+            self.lexical.add(texts)
+            if self.path:
+                self._persist(texts, metadatas)
+        return len(rows)
+
+    def retain(self, keep) -> int:
+        """
+        Per-row edit: `keep(metadata)` returns the row's new metadata, or None
+        to delete the row. Returns how many rows were deleted.
+        """
+        with self._lock:
+            rows, metadatas = [], []
+            for i, meta in enumerate(self.metadatas):
+                new = keep(meta)
+                if new is not None:
+                    rows.append(i)
+                    metadatas.append(new)
+            removed = self.n - len(rows)
+            # lists and index are replaced, not mutated, so lexical_search's snapshot stays consistent
+            if removed:
+                self._matrix = self._matrix[rows] if rows else None  # fancy indexing copies
+                self.texts = [self.texts[i] for i in rows]
+                self.n = len(rows)
+                self.lexical = BM25Index()
+                self.lexical.add(self.texts)
+            self.metadatas = metadatas
+            if self.path:
+                self._rewrite()
+            return removed
+
+    def _rewrite(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        vectors = self._matrix[:self.n] if self._matrix is not None else np.empty((0, 0), dtype=np.float32)
+        np.save(os.path.join(self.path, "vectors.tmp.npy"), vectors)
+        with open(os.path.join(self.path, "docs.tmp.jsonl"), "w", encoding="utf-8") as f:
+            for t, m in zip(self.texts, self.metadatas):
+                f.write(json.dumps({"text": t, "metadata": m}) + "\n")
+        os.replace(os.path.join(self.path, "vectors.tmp.npy"), os.path.join(self.path, "vectors.npy"))
+        os.replace(os.path.join(self.path, "docs.tmp.jsonl"), os.path.join(self.path, "docs.jsonl"))
+
+    def _persist(self, texts: list[str], metadatas: list[dict]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        tmp = os.path.join(self.path, "vectors.tmp.npy")
+        np.save(tmp, self._matrix[:self.n])
+        os.replace(tmp, os.path.join(self.path, "vectors.npy"))
+        with open(os.path.join(self.path, "docs.jsonl"), "a", encoding="utf-8") as f:
+            for t, m in zip(texts, metadatas):
+                f.write(json.dumps({"text": t, "metadata": m}) + "\n")
+
+    def search(self, vector: list[float], k: int = 4) -> list[tuple[str, dict, float]]:
+        """Top-k by cosine similarity: [(text, metadata, similarity)], best first."""
+        q = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        with self._lock:
+            if not self.n or not norm:
+                return []
+            sims = self._matrix[:self.n] @ (q / norm)
+            k = min(k, self.n)
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            return [(self.texts[i], self.metadatas[i], float(sims[i])) for i in top]
+
+    def lexical_search(self, query: str, k: int = 4) -> list[Document]:
+        with self._lock:
+            lexical, texts, metadatas = self.lexical, self.texts, self.metadatas
+        return [Document(page_content=texts[i], metadata={**metadatas[i], "lexical_rank": round(s, 6)})
+                for i, s in lexical.search(query, k)]
+
+    def nbytes(self) -> int:
+        """Approximate size of the rows in use: vectors plus chunk text."""
+        with self._lock:
+            vectors = self._matrix[:self.n].nbytes if self._matrix is not None else 0
+            return vectors + sum(len(t.encode("utf-8")) for t in self.texts)
+
+    def __len__(self) -> int:
+        return self.n
+
+
+def _store_path(namespace: str) -> str | None:
+    if not MEMORY_STORE_DIR:
+        return None
+    return os.path.join(MEMORY_STORE_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", namespace))
+
+
+def _on_evict(namespace, store, reason: str) -> None:
+    # capacity: the session may come back, keep its files for reloading;
+    # expired/removed: the session is over, so are its files
+    if reason != "capacity" and store.path:
+        shutil.rmtree(store.path, ignore_errors=True)
+
+
+_stores = LRUCache(MEMORY_STORE_MAX_NAMESPACES, ttl=MEMORY_STORE_TTL, on_evict=_on_evict)
+_stores_lock = threading.Lock()
+
+
+def get_memory_store(namespace: str, create: bool = True) -> MemoryVectorStore | None:
+    store = _stores.get(namespace)
+    if store is None:
+        with _stores_lock:
+            store = _stores.peek(namespace)
+            if store is None:
+                path = _store_path(namespace)
+                if not create and not (path and os.path.exists(path)):
+                    return None
+                store = MemoryVectorStore(path)
+                _stores.put(namespace, store)
+    return store
+
+
+def drop_memory_store(namespace: str) -> bool:
+    """Forget a namespace (and its files). True if it had any chunks."""
+    store = get_memory_store(namespace, create=False)
+    _stores.pop(namespace)
+    return bool(store and len(store))
+
+
+def memory_lexical_search(namespace: str, query: str, k: int) -> list[Document]:
+    store = get_memory_store(namespace, create=False)
+    return store.lexical_search(query, k) if store is not None else []
+
+
+def memory_store_stats() -> dict:
+    return {"backend": GUEST_VECTOR_BACKEND, "persist_dir": MEMORY_STORE_DIR, **_stores.stats()}
+
+
+class MemoryRetriever(BaseRetriever):
+    """Same interface as the Postgres retrievers; `score` (cosine similarity) in metadata."""
+
+    namespace: str
+    embedding: Embeddings
+    k: int = 4
+
+    def search_by_vector(self, vector: list[float]) -> list[Document]:
+        store = get_memory_store(self.namespace, create=False)
+        if store is None:
+            return []
+        return [Document(page_content=t, metadata={**m, "score": round(s, 6)})
+                for t, m, s in store.search(vector, self.k)]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return self.search_by_vector(self.embedding.embed_query(query))
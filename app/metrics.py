@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+from flask import g, has_request_context, request
+
+# === Per-stage timing and /metrics ===
+# Hot-path calls (question/chunk embedding, retrieval, the LLM, Supabase
+# Storage, DB commits) run inside `with stage("<name>"):`, which feeds a
+# latency histogram per stage. Every HTTP request gets a trace id (X-Request-ID,
+# taken from the request or generated) and a latency histogram per route; the
+# stages that ran for a request are logged with its trace id when it takes
+# longer than TRACE_LOG_SECONDS. main.py serves all of it at /metrics in the
+# Prometheus text format (written out here, no client library needed).
+# Like /stats, the numbers are per process.
+
+METRICS = os.getenv("METRICS", "1") == "1"
+TRACE_LOG_SECONDS = float(os.getenv("TRACE_LOG_SECONDS", "2.0"))  # log slower requests; 0 = log all
+
+# Upper bounds (seconds) of the stage and route histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram keyed by label values."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, buckets
+        self._lock = threading.Lock()
+        self._series: dict[tuple, list] = {}   # label values -> [bucket counts, sum, count]
+
+    def observe(self, seconds: float, *labelvalues) -> None:
+        with self._lock:
+            series = self._series.setdefault(labelvalues, [[0] * len(self.buckets), 0.0, 0])
+            for i, upper in enumerate(self.buckets):
+                if seconds <= upper:
+                    series[0][i] += 1
+                    break
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total, n) in sorted(self._series.items()):
+                cumulative = 0
+                for upper, c in zip(self.buckets, counts):
+                    cumulative += c
+                    le = 'le="+Inf"' if upper == float("inf") else f'le="{upper}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {total:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {n}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_labels(self.labelnames, v)} {n}" for v, n in sorted(self._values.items())]
+        return lines
+
+
+stage_seconds = Histogram("doc_assistant_stage_seconds", "Time spent in one pipeline stage.", ("stage",))
+stage_errors = Counter("doc_assistant_stage_errors_total", "Pipeline stage calls that raised.", ("stage",))
+request_seconds = Histogram("doc_assistant_request_seconds", "HTTP request latency (streams: until closed).",
+                            ("method", "route", "status"))
+prompt_tokens = Counter("doc_assistant_prompt_tokens_total",
+                        "Estimated prompt tokens sent to the LLM, before and after context assembly.", ("when",))
+_REGISTRY = (stage_seconds, stage_errors, request_seconds, prompt_tokens)
+
+
+def _current_trace() -> dict | None:
+    # flask.g also follows streamed responses (stream_with_context), unlike a contextvar
+    return g.get("trace") if has_request_context() else None
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as pipeline stage `name` (and add it to the current request's trace)."""
+    if not METRICS:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(name)
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        stage_seconds.observe(seconds, name)
+        trace = _current_trace()
+        if trace is not None:
+            trace["stages"].append((name, seconds))
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    """Record a stage measured elsewhere (e.g. time to the first LLM token)."""
+    if METRICS:
+        stage_seconds.observe(seconds, name)
+        trace = _current_trace()
+        if trace is not None:
+            trace["stages"].append((name, seconds))
+
+
+def current_trace_id() -> str | None:
+    trace = _current_trace()
+    return trace["id"] if trace else None
+
+
+def render() -> str:
+    lines = []
+    for metric in _REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app) -> None:
+    """Trace id + route histogram for every request of `app`."""
+
+    @app.before_request
+    def _start_trace():
+        trace_id = request.headers.get("X-Request-ID") or uuid4().hex[:16]
+        g.trace = {"id": trace_id[:64], "started": time.perf_counter(), "stages": []}
+
+    @app.after_request
+    def _finish_trace(response):
+        trace = g.get("trace")
+        if trace is None:
+            return response
+        response.headers["X-Request-ID"] = trace["id"]
+        method, status = request.method, response.status_code
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+
+        def done():
+            # runs when the response is closed, so streamed answers are timed to the end
+            seconds = time.perf_counter() - trace["started"]
+            if METRICS and route != "/metrics":
+                request_seconds.observe(seconds, method, route, status)
+            if seconds >= TRACE_LOG_SECONDS and trace["stages"]:
+                parts = " ".join(f"{name}={s:.3f}s" for name, s in trace["stages"])
+                print(f"[TRACE] {trace['id']} {method} {route} {status} {seconds:.3f}s: {parts}")
+
+        response.call_on_close(done)
+        return response
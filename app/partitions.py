@@ -0,0 +1,195 @@
+"""
+Partitioned storage for langchain_pg_embedding.
+
+    python -m app.partitions status
+    python -m app.partitions migrate [--drop-legacy]   # stop the app first
+    python -m app.partitions prune                      # drop partitions of deleted collections
+
+The migration renames the shared table to langchain_pg_embedding_legacy,
+creates langchain_pg_embedding as a LIST-partitioned table on collection_id
+(same columns, primary key (collection_id, uuid)), copies every collection into
+its own partition, one commit per collection, and rebuilds the vector indexes.
+It can be re-run to resume. Rows without a collection are left in the legacy
+table. Restart the app afterwards: the layout is detected once per process.
+"""
+import argparse
+from uuid import UUID
+
+from sqlalchemy import text
+
+# === Partitioned layout ===
+# With one partition per collection (= per chat session), a session's vectors
+# sit in their own heap and indexes: searches only touch that partition
+# (partition pruning on collection_id), and deleting a session is a DROP TABLE
+# instead of a DELETE that leaves dead tuples for vacuum in a table shared by
+# everyone. Partitions are created when a collection is first resolved
+# (vector_store.get_or_create_collection_id). Which layout is in use is read
+# from the database, so everything else works unchanged on either.
+
+PARENT = "langchain_pg_embedding"
+LEGACY = "langchain_pg_embedding_legacy"
+PARTITION_PREFIX = "langchain_pg_embedding_p_"
+
+_layout: dict[str, bool] = {}   # per database URL
+_known_partitions: set[str] = set()
+
+
+def partition_name(collection_id) -> str:
+    return PARTITION_PREFIX + UUID(str(collection_id)).hex
+
+
+def is_partitioned(conn) -> bool:
+    key = str(conn.engine.url)
+    if key not in _layout:
+        _layout[key] = conn.execute(
+            text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t)"), {"t": PARENT}
+        ).scalar() is True
+    return _layout[key]
+
+
+def ensure_partition(conn, collection_id) -> None:
+    """
+    Create the collection's partition if the table is partitioned. Runs on its
+    own short autocommit connection: creating a partition briefly locks the
+    parent table, and that lock must not be held through the caller's
+    transaction (e.g. a dedup copy).
+    """
+    name = partition_name(collection_id)
+    if name in _known_partitions or not is_partitioned(conn):
+        return
+    with conn.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as ddl:
+        ddl.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT} "
+            f"FOR VALUES IN ('{UUID(str(collection_id))}')"
+        ))
+    _known_partitions.add(name)
+
+
+def drop_partition(conn, collection_id) -> bool:
+    """Drop a collection's partition (all its rows at once). False on the shared layout."""
+    return drop_partitions(conn, [collection_id])
+
+
+def drop_partitions(conn, collection_ids) -> bool:
+    """
+    Drop the partitions of several collections in one DROP TABLE, so the
+    parent's lock is taken once for the whole set. False on the shared layout.
+    """
+    if not is_partitioned(conn):
+        return False
+    names = [partition_name(cid) for cid in collection_ids]
+    if names:
+        conn.execute(text(f"DROP TABLE IF EXISTS {', '.join(names)}"))
+        _known_partitions.difference_update(names)
+    return True
+
+
+def _table_exists(conn, name: str) -> bool:
+    return conn.execute(text("SELECT to_regclass(:t) IS NOT NULL"), {"t": name}).scalar()
+
+
+def status(engine) -> dict:
+    with engine.connect() as conn:
+        partitioned = conn.execute(
+            text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t)"), {"t": PARENT}
+        ).scalar() is True
+        partitions = conn.execute(
+            text("SELECT count(*) FROM pg_inherits WHERE inhparent = to_regclass(:t)"), {"t": PARENT}
+        ).scalar()
+        return {"partitioned": partitioned, "partitions": partitions, "legacy_table": _table_exists(conn, LEGACY)}
+
+
+def prune_orphans(engine) -> int:
+    """
+    Drop partitions whose collection row does not exist (left behind when the
+    transaction that created a collection rolled back). Run it while no upload
+    is in progress: a collection being created right now looks the same.
+    Returns how many were dropped.
+    """
+    with engine.connect() as conn:
+        children = conn.execute(text(
+            "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:t)"
+        ), {"t": PARENT}).scalars().all()
+        collections = {partition_name(c) for c in conn.execute(text("SELECT uuid FROM langchain_pg_collection")).scalars()}
+    orphans = [name for name in children if name.startswith(PARTITION_PREFIX) and name not in collections]
+    for name in orphans:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        _known_partitions.discard(name)
+    return len(orphans)
+
+
+def migrate(engine, drop_legacy: bool = False) -> dict:
+    from .vector_store import EMBEDDING_COLUMNS
+    from .vector_index import maintain_indexes
+
+    with engine.begin() as conn:
+        if not is_partitioned(conn) and not _table_exists(conn, LEGACY):
+            print(f"[PARTITIONS] {PARENT} -> {LEGACY}, creating partitioned {PARENT}")
+            conn.execute(text(f"ALTER TABLE {PARENT} RENAME TO {LEGACY}"))
+            conn.execute(text(
+                f"CREATE TABLE {PARENT} (LIKE {LEGACY} INCLUDING DEFAULTS INCLUDING GENERATED) PARTITION BY LIST (collection_id)"
+            ))
+            conn.execute(text(f"ALTER TABLE {PARENT} ALTER COLUMN collection_id SET NOT NULL"))
+            conn.execute(text(
+                f"ALTER TABLE {PARENT} ADD CONSTRAINT {PARENT}_part_pkey PRIMARY KEY (collection_id, uuid)"
+            ))
+            conn.execute(text(
+                f"ALTER TABLE {PARENT} ADD CONSTRAINT {PARENT}_part_collection_fkey FOREIGN KEY (collection_id) "
+                "REFERENCES langchain_pg_collection (uuid) ON DELETE CASCADE"
+            ))
+            _layout[str(engine.url)] = True
+        elif not _table_exists(conn, LEGACY):
+            return {"migrated": 0, "rows": 0, "note": "already partitioned"}
+        collection_ids = list(conn.execute(text(
+            f"SELECT c.uuid FROM langchain_pg_collection c "
+            f"WHERE EXISTS (SELECT 1 FROM {LEGACY} e WHERE e.collection_id = c.uuid)"
+        )).scalars())
+
+    migrated = rows = 0
+    for cid in collection_ids:
+        with engine.begin() as conn:
+            ensure_partition(conn, cid)
+            name = partition_name(cid)
+            if conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})")).scalar():
+                continue  # copied by an earlier, interrupted run
+            cols = EMBEDDING_COLUMNS.strip("()")
+            rows += conn.execute(
+                text(f"INSERT INTO {PARENT} {EMBEDDING_COLUMNS} SELECT {cols} FROM {LEGACY} WHERE collection_id = :cid"),
+                {"cid": cid},
+            ).rowcount
+            migrated += 1
+        print(f"[PARTITIONS] {migrated}/{len(collection_ids)} collections copied")
+
+    with engine.begin() as conn:
+        orphans = conn.execute(text(
+            f"SELECT count(*) FROM {LEGACY} e "
+            "WHERE NOT EXISTS (SELECT 1 FROM langchain_pg_collection c WHERE c.uuid = e.collection_id)"
+        )).scalar()
+        if drop_legacy:
+            conn.execute(text(f"DROP TABLE {LEGACY}"))
+    indexes = maintain_indexes(engine)
+    return {"migrated": migrated, "rows": rows, "rows_left_in_legacy": orphans,
+            "legacy_dropped": drop_legacy, "indexes": indexes}
+
+
+def main():
+    from .db_pool import get_engine
+    ap = argparse.ArgumentParser(description="Partitioned layout for langchain_pg_embedding.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("status")
+    sub.add_parser("prune")
+    m = sub.add_parser("migrate")
+    m.add_argument("--drop-legacy", action="store_true", help="drop the old shared table when done")
+    args = ap.parse_args()
+    engine = get_engine()
+    if args.cmd == "status":
+        print(status(engine))
+    elif args.cmd == "prune":
+        print({"dropped": prune_orphans(engine)})
+    else:
+        print(migrate(engine, drop_legacy=args.drop_legacy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import atexit
+import itertools
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from pypdf import PdfReader
+
+# === PDF page extraction ===
+# pypdf's extract_text() is pure Python and CPU-bound, so big PDFs are sharded
+# into page ranges and extracted on a process pool. Workers read the PDF from a
+# temp file (shared through the OS page cache) instead of receiving a pickled
+# copy of the bytes per shard. Small PDFs stay serial: handing work to the pool
+# costs more than it saves. Pages are yielded as they are extracted so callers
+# can stream them. This module only depends on pypdf so that spawned workers
+# start quickly.
+
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PAGE_WINDOW = 50  # pages extracted per PdfReader (serial) or at most per shard (pool)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded web worker can deadlock on inherited locks
+            _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def _extract_range(pdf_path: str, start: int, stop: int) -> list[str]:
+    """Worker: raw text of pages [start, stop) of the PDF at `pdf_path`."""
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _shards(n_pages: int, workers: int) -> list[tuple[int, int]]:
+    # ~2 shards per worker evens out pages that are much slower than others;
+    # capped so huge PDFs stream through in bounded pieces
+    size = min(PAGE_WINDOW, max(1, -(-n_pages // (workers * 2))))
+    return [(start, min(start + size, n_pages)) for start in range(0, n_pages, size)]
+
+
+def iter_page_texts(pdf_bytes: bytes, progress=None):
+    """
+    Yield (page_index, raw_text) for every page, in page order.
+    `progress`, if given, receives ("pages_total", n) and ("pages_parsed", k) events.
+    """
+    n_pages = len(PdfReader(BytesIO(pdf_bytes)).pages)
+    if progress is not None:
+        progress("pages_total", n_pages)
+
+    if PDF_EXTRACT_WORKERS <= 1 or n_pages < PDF_PARALLEL_MIN_PAGES:
+        reader = None
+        for i in range(n_pages):
+            # pypdf caches every parsed object on the reader; starting a fresh
+            # reader every PAGE_WINDOW pages keeps memory flat on huge PDFs
+            if i % PAGE_WINDOW == 0:
+                reader = PdfReader(BytesIO(pdf_bytes))
+            raw = reader.pages[i].extract_text() or ""
+            if progress is not None:
+                progress("pages_parsed", 1)
+            yield i, raw
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        tmp.write(pdf_bytes)
+        tmp.flush()
+        pool = _get_pool()
+        shards = iter(_shards(n_pages, PDF_EXTRACT_WORKERS))
+        # Sliding window: only a few shards are in flight or waiting to be
+        # consumed, so a slow consumer never has the whole PDF's text buffered.
+        window = deque()
+        try:
+            for start, stop in itertools.islice(shards, PDF_EXTRACT_WORKERS + 1):
+                window.append(pool.submit(_extract_range, tmp.name, start, stop))
+            page = 0
+            while window:
+                texts = window.popleft().result()  # FIFO == page order
+                nxt = next(shards, None)
+                if nxt is not None:
+                    window.append(pool.submit(_extract_range, tmp.name, *nxt))
+                if progress is not None:
+                    progress("pages_parsed", len(texts))
+                for raw in texts:
+                    yield page, raw
+                    page += 1
+        finally:
+            for fut in window:
+                fut.cancel()
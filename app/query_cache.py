@@ -0,0 +1,102 @@
+import os
+import re
+import threading
+
+from .cache import LRUCache
+from .embed_cache import SqliteEmbeddingStore, text_hash, pack_vector, unpack_vector
+
+# === Query embedding memo ===
+# /ask embeds the question with one remote call. Frontend retries after a 502
+# and users re-asking the same thing would pay for it again, so vectors are
+# memoized by (model, normalized question text) in an LRU with an idle TTL,
+# optionally backed by a local SQLite file so the memo survives worker
+# restarts. Only the sha256 of the question is persisted, never its text.
+
+QUERY_CACHE = os.getenv("QUERY_CACHE", "memory")  # memory | sqlite | off
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2000"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "86400"))  # idle seconds in memory
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "query_cache.sqlite3")
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Whitespace-insensitive key: trims and collapses runs of spaces/newlines."""
+    return _WS.sub(" ", query).strip()
+
+
+class QueryEmbeddingCache:
+    def __init__(self, model: str, store=None, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        # a separate key space from chunk vectors when sharing a SQLite file
+        self.model = f"{model}#query"
+        self.store = store
+        self.memory = LRUCache(maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.store_hits = 0
+        self.store_errors = 0
+        self.misses = 0
+        self.embed_calls = 0
+        self.embed_seconds = 0.0
+
+    def get(self, query: str) -> list[float] | None:
+        h = text_hash(normalize_query(query))
+        blob = self.memory.get(h)
+        if blob is None and self.store is not None:
+            try:
+                blob = self.store.get_many(self.model, [h]).get(h)
+            except Exception as e:
+                with self._lock:
+                    self.store_errors += 1
+                print(f"[QUERY CACHE] store lookup failed: {e}")
+            if blob is not None:
+                self.memory.put(h, blob)
+                with self._lock:
+                    self.store_hits += 1
+        if blob is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        return unpack_vector(blob)
+
+    def put(self, query: str, vector: list[float], seconds: float) -> None:
+        """Remember a freshly computed vector; `seconds` is what the remote call took."""
+        h = text_hash(normalize_query(query))
+        blob = pack_vector(vector)
+        self.memory.put(h, blob)
+        with self._lock:
+            self.embed_calls += 1
+            self.embed_seconds += seconds
+        if self.store is not None:
+            try:
+                self.store.put_many(self.model, {h: blob})
+            except Exception as e:
+                with self._lock:
+                    self.store_errors += 1
+                print(f"[QUERY CACHE] store write failed: {e}")
+
+    def stats(self) -> dict:
+        mem = self.memory.stats()
+        with self._lock:
+            hits = mem["hits"] + self.store_hits
+            lookups = hits + self.misses
+            avg = self.embed_seconds / self.embed_calls if self.embed_calls else 0.0
+            return {
+                "backend": QUERY_CACHE,
+                "memory": mem,
+                "store_hits": self.store_hits,
+                "store_errors": self.store_errors,
+                "misses": self.misses,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "avg_embed_seconds": round(avg, 4),
+                # each hit skipped one remote call of roughly average latency
+                "saved_seconds_estimate": round(hits * avg, 3),
+            }
+
+
+def build_query_cache(model: str) -> QueryEmbeddingCache | None:
+    """Create the memo selected by QUERY_CACHE (None when disabled)."""
+    if QUERY_CACHE == "off":
+        return None
+    if QUERY_CACHE == "sqlite":
+        return QueryEmbeddingCache(model, SqliteEmbeddingStore(QUERY_CACHE_PATH))
+    return QueryEmbeddingCache(model)
@@ -1,24 +1,47 @@
+import json
 import os
-from io import BytesIO
-from functools import lru_cache
+import queue
+import threading
+import time
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
 
 from uuid import uuid4
 from werkzeug.utils import secure_filename
 
 from supabase import create_client
-from pypdf import PdfReader
 from tenacity import retry, stop_after_attempt, wait_exponential
 # Embeddings / Vector store
 from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import PGVector
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
 
 # LLM + QA chain
 from langchain.chains import RetrievalQA
 from langchain_groq import ChatGroq
 
-from sqlalchemy import create_engine, text
+from .db_pool import get_engine, database_url
+from .cache import LRUCache
+from .embeddings import EmbeddingBatcher, EMBED_BATCH_SIZE
+from .embed_cache import build_embedding_cache, text_hash
+from .answer_cache import answer_cache
+from .query_cache import build_query_cache
+from .pdf_extract import iter_page_texts
+from .chunking import CHUNKER, chunk_pages, chunking_signature, estimate_tokens, split_page_chars, token_counter
+from .context import CONTEXT_ASSEMBLY, assemble_context
+from .vector_store import ensure_collection, bulk_insert_embeddings
+from .vector_index import (
+    VECTOR_SEARCH, IndexedPgRetriever, collection_id_for,
+    ensure_ann_index, text_search_ready,
+)
+from .hybrid import RETRIEVAL_MODE, HYBRID_CANDIDATES, HybridRetriever, pg_text_search
+from .memory_store import (
+    is_memory_namespace, get_memory_store, memory_lexical_search, MemoryRetriever,
+)
+from .metrics import stage, observe_stage, prompt_tokens
+from .fingerprints import document_fingerprint, has_indexed_document, copy_indexed_document, register_document
+
+from sqlalchemy import text
 import re
 _NUL_RE = re.compile(r"\x00")
 
@@ -36,30 +59,113 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE = os.getenv("SUPABASE_SERVICE_ROLE")
 PDF_BUCKET = "pdfs"  # created in Step 1
 
-PG_CONN = os.getenv("DATABASE_URL")  # same DB used by your app
-ENGINE_ARGS = {
-    "pool_size": 1,
-    "max_overflow": 0,
-    "pool_pre_ping": True,
-    "pool_recycle": 1800,
-}
+PG_CONN = database_url()  # same DB used by your app
+# One process-wide engine/pool shared by everything below (see app/db_pool.py)
+_sql_engine = get_engine()
+
+# PGVector stores are cached per namespace, so each one runs its
+# extension/table/collection setup once instead of once per chain.
+VECTOR_STORE_CACHE_SIZE = int(os.getenv("VECTOR_STORE_CACHE_SIZE", "64"))
 
 VECTOR_COLLECTION = "doc_assistant_embeddings"  # name for pgvector collection
 
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE)
+
+def _collection_name(namespace: str) -> str:
+    return VECTOR_COLLECTION if namespace == "default" else f"{VECTOR_COLLECTION}_{namespace}"
+
+
+# Chunks are embedded and written in batches so progress is visible (and
+# searchable) while a large PDF is still being indexed.
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "128"))
+
+# Supabase Storage lists (and we remove) at most this many objects per call
+STORAGE_PAGE_SIZE = int(os.getenv("STORAGE_PAGE_SIZE", "100"))
+
+# /ask/batch: questions per request, and how many retrievals / Groq calls run
+# at once (process-wide, so parallel batches share the limit)
+ASK_BATCH_MAX = int(os.getenv("ASK_BATCH_MAX", "25"))
+ASK_BATCH_RETRIEVAL_CONCURRENCY = int(os.getenv("ASK_BATCH_RETRIEVAL_CONCURRENCY", "4"))
+ASK_BATCH_LLM_CONCURRENCY = int(os.getenv("ASK_BATCH_LLM_CONCURRENCY", "4"))
+
+@lru_cache(maxsize=1)
+def get_supabase():
+    # created on first use, so the pipeline can be imported (e.g. by bench/) without credentials
+    return create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE)
 
 
 class SafeEmbeddings(Embeddings):
-    def __init__(self, inner):
+    def __init__(self, inner, batch_size: int = EMBED_BATCH_SIZE, cache=None, query_cache=None):
         self.inner = inner
+        # Splits documents into micro-batches, embeds them concurrently and
+        # retries per batch (see app/embeddings.py)
+        self.batcher = EmbeddingBatcher(inner.embed_documents, batch_size=batch_size)
+        # Optional EmbeddingCache consulted before the remote endpoint (see app/embed_cache.py)
+        self.cache = cache
+        # Optional QueryEmbeddingCache memoizing question vectors (see app/query_cache.py)
+        self.query_cache = query_cache
 
     @retry(reraise=True, stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, min=0.5, max=4))
-    def embed_query(self, text: str):
+    def _embed_query(self, text: str):
         return self.inner.embed_query(text)
 
+    def embed_query(self, text: str):
+        if self.query_cache is None:
+            with stage("embed_query"):
+                return self._embed_query(text)
+        vector = self.query_cache.get(text)
+        if vector is None:
+            started = time.perf_counter()
+            with stage("embed_query"):
+                vector = self._embed_query(text)
+            self.query_cache.put(text, vector, time.perf_counter() - started)
+        return vector
+
     @retry(reraise=True, stop=stop_after_attempt(3), wait=wait_exponential(multiplier=0.5, min=0.5, max=4))
-    def embed_documents(self, texts):
-        return self.inner.embed_documents(texts)
+    async def _aembed_query(self, text: str):
+        return await self.inner.aembed_query(text)
+
+    async def aembed_query(self, text: str):
+        """embed_query for the async /ask path (app/async_ask.py): the endpoint call does not hold a thread."""
+        vector = self.query_cache.get(text) if self.query_cache is not None else None
+        if vector is None:
+            started = time.perf_counter()
+            with stage("embed_query"):
+                vector = await self._aembed_query(text)
+            if self.query_cache is not None:
+                self.query_cache.put(text, vector, time.perf_counter() - started)
+        return vector
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Several questions at once: memoized ones from the query cache, the rest in one batched call."""
+        vectors = {t: self.query_cache.get(t) for t in texts} if self.query_cache is not None else {}
+        missing = list(dict.fromkeys(t for t in texts if vectors.get(t) is None))
+        if missing:
+            started = time.perf_counter()
+            with stage("embed_query"):
+                fresh = self.batcher.embed(missing)
+            seconds = (time.perf_counter() - started) / len(missing)
+            for t, v in zip(missing, fresh):
+                vectors[t] = v
+                if self.query_cache is not None:
+                    self.query_cache.put(t, v, seconds)
+        return [vectors[t] for t in texts]
+
+    def embed_documents(self, texts, local_only: bool = False):
+        """`local_only`: consult/fill only the in-memory cache tier (no database)."""
+        texts = list(texts)
+        if self.cache is None:
+            with stage("embed_documents"):
+                return self.batcher.embed(texts)
+        # Chunks arrive here already cleaned by upsert_documents, so the text
+        # itself is the content address.
+        cached = self.cache.get_many(texts, local_only=local_only)
+        missing = list(dict.fromkeys(t for t in texts if text_hash(t) not in cached))
+        if missing:
+            with stage("embed_documents"):
+                vectors = self.batcher.embed(missing)
+            self.cache.put_many(missing, vectors, local_only=local_only)
+            cached.update({text_hash(t): v for t, v in zip(missing, vectors)})
+        return [cached[text_hash(t)] for t in texts]
 
 EMBED_BACKEND = os.getenv("EMBED_BACKEND", "hf_inference")
 EMBED_MODEL_NAME = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
@@ -73,40 +179,65 @@ def get_embedding_model():
             model=EMBED_MODEL_NAME,
             huggingfacehub_api_token=os.getenv("HUGGINGFACEHUB_API_TOKEN"),
         )
-        return SafeEmbeddings(base)
     else:
         # Local fallback (not used on Render Free)
         from langchain_huggingface import HuggingFaceEmbeddings
         base = HuggingFaceEmbeddings(model_name=EMBED_MODEL_NAME)
-        return SafeEmbeddings(base)
+    return SafeEmbeddings(
+        base,
+        cache=build_embedding_cache(EMBED_MODEL_NAME, engine=_sql_engine),
+        query_cache=build_query_cache(EMBED_MODEL_NAME),
+    )
     
-# Splitter for PDF text
-splitter = RecursiveCharacterTextSplitter(chunk_size=700, chunk_overlap=100)
+# Identical PDFs indexed with the same settings produce the same chunks and
+# vectors, so their rows can be copied between sessions (see app/fingerprints.py)
+DOC_DEDUP = os.getenv("DOC_DEDUP", "1") == "1"
+PIPELINE_SIGNATURE = f"{EMBED_MODEL_NAME}|{chunking_signature(EMBED_MODEL_NAME)}"
 
 
 # === Storage helpers ===
-from uuid import uuid4
-from werkzeug.utils import secure_filename
-
-def upload_pdf_to_storage(file_storage, owner_id: str, subdir: str | None = None) -> str:
+def make_storage_path(filename: str | None, owner_id: str, subdir: str | None = None) -> str:
     """
-    Upload a PDF to Supabase Storage.
-    Returns a storage path like "<owner_id>/<subdir>/<unique>_<name>.pdf" (subdir optional).
+    Build a unique storage path like "<owner_id>/<subdir>/<unique>_<name>.pdf" (subdir optional).
     """
-    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE:
-        raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE env vars.")
-
     # Sanitize and make it unique
-    base_name = secure_filename(file_storage.filename) or "document.pdf"
+    base_name = secure_filename(filename or "") or "document.pdf"
     unique_prefix = uuid4().hex[:8]
     final_name = f"{unique_prefix}_{base_name}"
 
     dir_path = f"{owner_id}/{subdir}" if subdir else f"{owner_id}"
-    path = f"{dir_path}/{final_name}"
+    return f"{dir_path}/{final_name}"
+
+
+_DOC_ID_RE = re.compile(r"[A-Za-z0-9]+")
 
-    data = file_storage.read()
+
+def document_id(storage_path: str) -> str:
+    """Stable id of an uploaded PDF: the unique prefix make_storage_path gave its file name."""
+    return storage_path.rsplit("/", 1)[-1].split("_", 1)[0]
+
+
+def upload_pdf_bytes(path: str, data: bytes, overwrite: bool = False) -> str:
+    """Upload raw PDF bytes to Supabase Storage at `path` (`overwrite`: replace the object there)."""
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE:
+        raise RuntimeError("Missing SUPABASE_URL or SUPABASE_SERVICE_ROLE env vars.")
+    bucket = get_supabase().storage.from_(PDF_BUCKET)
     # Keep it simple: no boolean file_options (avoids header type issues)
-    supabase.storage.from_(PDF_BUCKET).upload(path=path, file=data)
+    with stage("storage_upload"):
+        if overwrite:
+            bucket.update(path=path, file=data)
+        else:
+            bucket.upload(path=path, file=data)
+    return path
+
+
+def upload_pdf_to_storage(file_storage, owner_id: str, subdir: str | None = None) -> str:
+    """
+    Upload a PDF to Supabase Storage.
+    Returns a storage path like "<owner_id>/<subdir>/<unique>_<name>.pdf" (subdir optional).
+    """
+    path = make_storage_path(file_storage.filename, owner_id, subdir)
+    upload_pdf_bytes(path, file_storage.read())
 
     # Reset stream if needed elsewhere
     try:
@@ -117,62 +248,387 @@ def upload_pdf_to_storage(file_storage, owner_id: str, subdir: str | None = None
     return path
 
 
-
 def download_pdf_bytes(path: str) -> bytes:
     """Download a PDF from Supabase Storage and return raw bytes."""
-    return supabase.storage.from_(PDF_BUCKET).download(path)
+    with stage("storage_download"):
+        return get_supabase().storage.from_(PDF_BUCKET).download(path)
+
+
+def _report(progress, stage: str, n: int) -> None:
+    """Forward a progress event (e.g. "pages_parsed", 1) if a callback was given."""
+    if progress is not None:
+        progress(stage, n)
 
 
 # === PDF → Documents ===
-def pdf_bytes_to_documents(pdf_bytes: bytes, metadata: dict) -> list[Document]:
-    reader = PdfReader(BytesIO(pdf_bytes))
-    docs: list[Document] = []
-    for i, page in enumerate(reader.pages):
-        raw = page.extract_text() or ""
-        text = _clean_text(raw)
-        if not text:
-            continue
-        chunks = splitter.split_text(text)
-        for chunk in chunks:
-            chunk = _clean_text(chunk)
-            if chunk:
-                docs.append(Document(page_content=chunk, metadata={**metadata, "page": i}))
-    return docs
+def iter_pdf_documents(pdf_bytes: bytes, metadata: dict, progress=None):
+    """
+    Yield cleaned chunk Documents as pages are extracted, so the full list of
+    pages and chunks never has to sit in memory at once (chunking: app/chunking.py).
+    """
+    # Large PDFs are extracted on a process pool (see app/pdf_extract.py)
+    pages = ((i, _clean_text(raw)) for i, raw in iter_page_texts(pdf_bytes, progress=progress))
+    if CHUNKER == "chars":
+        chunks = (d for i, text in pages if text for d in split_page_chars(i, text, metadata))
+    else:
+        _, count = token_counter(EMBED_MODEL_NAME)
+        chunks = chunk_pages(pages, metadata, count=count)
+    n = 0
+    for d in chunks:
+        chunk = _clean_text(d.page_content)
+        if chunk:
+            # position in the document: app/context.py joins neighbouring chunks
+            yield Document(page_content=chunk, metadata={**d.metadata, "chunk": n})
+            n += 1
+
+
+def pdf_bytes_to_documents(pdf_bytes: bytes, metadata: dict, progress=None) -> list[Document]:
+    return list(iter_pdf_documents(pdf_bytes, metadata, progress=progress))
+
+
+def _batched(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _prefetch(items, depth: int = 2):
+    """
+    Run the `items` generator on a helper thread, at most `depth` results ahead.
+    Lets PDF parsing/splitting of the next batch overlap embedding of the
+    current one while keeping the buffer (and memory) bounded.
+    """
+    buf = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry) -> bool:
+        # give up once the consumer has gone away, instead of blocking forever
+        while not stop.is_set():
+            try:
+                buf.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+        finally:
+            # run the generator chain's finally blocks (extraction temp file,
+            # process-pool futures) now, not whenever it is garbage collected
+            close = getattr(items, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    print(f"[INGEST] closing the document stream failed: {e}")
+
+    worker = threading.Thread(target=produce, name="ingest-prefetch", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, err = buf.get()
+            if item is done:
+                if err is not None:
+                    raise err
+                return
+            yield item
+    finally:
+        stop.set()
+        worker.join(timeout=5)
 
 
 # === Indexing (pgvector) ===
-def upsert_documents(docs: list[Document], namespace: str = "default") -> None:
-    collection = VECTOR_COLLECTION if namespace == "default" else f"{VECTOR_COLLECTION}_{namespace}"
-    cleaned = [
-        Document(page_content=_clean_text(d.page_content), metadata=d.metadata)
+def upsert_document_stream(docs, namespace: str = "default", progress=None, before_write=None) -> int:
+    """
+    Streaming ingestion: consume `docs` (any iterable, e.g. iter_pdf_documents)
+    in batches of UPSERT_BATCH_SIZE — embed, insert, commit, repeat. Only a
+    couple of batches are buffered, so memory stays flat whatever the PDF
+    size, and /ask can answer from the first batches while the rest is still
+    being indexed. `before_write`, if given, is called once before the first
+    insert. Returns # of chunks written.
+    """
+    embedder = get_embedding_model()
+    in_memory = is_memory_namespace(namespace)
+    collection_id = None
+    written = 0
+    # chunk_hash lets a replaced document keep the vectors of unchanged chunks
+    cleaned = (
+        Document(page_content=chunk, metadata={**d.metadata, "chunk_hash": text_hash(chunk)})
         for d in docs
-        if _clean_text(d.page_content)
-    ]
-    if not cleaned:
-        return
-    PGVector.from_documents(
-        documents=cleaned,
-        embedding=get_embedding_model(),
-        collection_name=collection,
-        connection_string=PG_CONN,
-        engine_args=ENGINE_ARGS,
+        for chunk in (_clean_text(d.page_content),)
+        if chunk
     )
+    for batch in _prefetch(_batched(cleaned, UPSERT_BATCH_SIZE)):
+        texts = [d.page_content for d in batch]
+        vectors = embedder.embed_documents(texts, local_only=in_memory)
+        _report(progress, "chunks_embedded", len(batch))
+        if written == 0 and before_write is not None:
+            before_write()
+        if in_memory:
+            # guest sessions: kept in this process only (app/memory_store.py)
+            get_memory_store(namespace).add(texts, vectors, [d.metadata for d in batch])
+        else:
+            if collection_id is None:
+                # resolved once per stream; rows then go in via COPY (app/vector_store.py)
+                collection_id = ensure_collection(_sql_engine, _collection_name(namespace), embedding=embedder)
+            with stage("vector_write"):
+                bulk_insert_embeddings(_sql_engine, collection_id, texts, vectors, [d.metadata for d in batch])
+        answer_cache.invalidate(namespace)
+        written += len(batch)
+        _report(progress, "chunks_written", len(batch))
+    _report(progress, "chunks_total", written)
+    return written
+
+
+def upsert_documents(docs: list[Document], namespace: str = "default", progress=None) -> None:
+    """Embed and insert a list of documents (thin wrapper over upsert_document_stream)."""
+    upsert_document_stream(docs, namespace=namespace, progress=progress)
+
+
+def _pdf_metadata(path: str, owner_id: str, title: str | None) -> dict:
+    meta = {"owner_id": owner_id, "storage_path": path, "doc_id": document_id(path)}
+    if title:
+        meta["title"] = title
+    return meta
 
 
-def index_pdf_from_storage_path(path: str, owner_id: str, title: str | None = None, namespace: str = "default") -> int:
+def _reuse_indexed_copy(fingerprint: str, metadata: dict, namespace: str, progress=None) -> int | None:
+    """Copy rows of an identical, already indexed PDF into `namespace`; None if not possible."""
+    try:
+        copied = copy_indexed_document(_sql_engine, fingerprint, _collection_name(namespace), metadata)
+    except Exception as e:
+        print(f"[DEDUP] copy failed, indexing normally: {e}")
+        return None
+    if copied is not None:
+        answer_cache.invalidate(namespace)
+        print(f"[DEDUP] reused {copied} chunks for {metadata.get('storage_path')} in namespace {namespace}")
+        _report(progress, "chunks_total", copied)
+        _report(progress, "chunks_written", copied)
+        _refresh_ann_index(namespace)
+    return copied
+
+
+def _dedup_enabled(namespace: str) -> bool:
+    # the fingerprint registry and row copies live in Postgres
+    return DOC_DEDUP and not is_memory_namespace(namespace)
+
+
+def _already_indexed(fingerprint: str) -> bool:
+    """has_indexed_document(), but a registry error only skips dedup."""
+    try:
+        return has_indexed_document(_sql_engine, fingerprint)
+    except Exception as e:
+        print(f"[DEDUP] fingerprint lookup failed, indexing normally: {e}")
+        return False
+
+
+def _index_new_documents(docs, fingerprint: str, namespace: str, progress=None, before_write=None) -> int:
+    written = upsert_document_stream(docs, namespace=namespace, progress=progress, before_write=before_write)
+    if is_memory_namespace(namespace):
+        return written
+    if written and DOC_DEDUP:
+        try:
+            register_document(_sql_engine, fingerprint, _collection_name(namespace), written)
+        except Exception as e:
+            print(f"[DEDUP] could not register fingerprint: {e}")
+    if written:
+        _refresh_ann_index(namespace)
+    return written
+
+
+def index_pdf_from_storage_path(path: str, owner_id: str, title: str | None = None, namespace: str = "default",
+                                progress=None) -> int:
     """
     Download a PDF from storage, chunk, embed, upsert into pgvector.
+    Used for re-indexing files that are already in storage.
+    `progress`, if given, is called as progress(stage, n) while indexing.
     Returns # of chunks indexed.
     """
     raw = download_pdf_bytes(path)
-    meta = {"owner_id": owner_id, "storage_path": path}
-    if title:
-        meta["title"] = title
-    docs = pdf_bytes_to_documents(raw, metadata=meta)
-    if not docs:
+    meta = _pdf_metadata(path, owner_id, title)
+    fingerprint = document_fingerprint(raw, PIPELINE_SIGNATURE)
+    if _dedup_enabled(namespace):
+        copied = _reuse_indexed_copy(fingerprint, meta, namespace, progress)
+        if copied is not None:
+            return copied
+    docs = iter_pdf_documents(raw, metadata={**meta, "doc_fingerprint": fingerprint}, progress=progress)
+    return _index_new_documents(docs, fingerprint, namespace, progress)
+
+
+def index_pdf_bytes(pdf_bytes: bytes, path: str, owner_id: str, title: str | None = None,
+                    namespace: str = "default", progress=None) -> int:
+    """
+    Upload `pdf_bytes` to storage at `path` and index the same bytes, so a new
+    upload is never downloaded back from storage. The upload runs on a helper
+    thread while the first pages are parsed and embedded; it must succeed
+    before any chunk is written, so a failed upload never leaves vectors
+    pointing at a missing file.
+    A byte-identical PDF that was indexed before is copied instead of parsed.
+    Returns # of chunks indexed.
+    """
+    meta = _pdf_metadata(path, owner_id, title)
+    fingerprint = document_fingerprint(pdf_bytes, PIPELINE_SIGNATURE)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage-upload") as pool:
+        uploading = pool.submit(upload_pdf_bytes, path, pdf_bytes)
+        if _dedup_enabled(namespace) and _already_indexed(fingerprint):
+            uploading.result()
+            copied = _reuse_indexed_copy(fingerprint, meta, namespace, progress)
+            if copied is not None:
+                return copied
+        docs = iter_pdf_documents(pdf_bytes, metadata={**meta, "doc_fingerprint": fingerprint}, progress=progress)
+        written = _index_new_documents(docs, fingerprint, namespace, progress, before_write=uploading.result)
+        uploading.result()  # surface upload errors even for PDFs without text
+    return written
+
+
+# === Per-document changes ===
+# Chunks carry the doc_id of their PDF (older rows only have storage_path,
+# which contains it) and a chunk_hash of their text.
+_DOC_ROWS = ("collection_id = :cid AND (cmetadata->>'doc_id' = :doc "
+             "OR (cmetadata->>'doc_id' IS NULL AND cmetadata->>'storage_path' LIKE :path))")
+
+
+def _doc_params(cid, doc_id: str) -> dict:
+    if not _DOC_ID_RE.fullmatch(doc_id):
+        raise ValueError(f"invalid document id: {doc_id!r}")
+    return {"cid": cid, "doc": doc_id, "path": f"%/{doc_id}\\_%"}
+
+
+def _is_doc(meta: dict, doc_id: str) -> bool:
+    return meta.get("doc_id", document_id(meta.get("storage_path", ""))) == doc_id
+
+
+def delete_document(namespace: str, doc_id: str) -> int:
+    """Remove one PDF's chunks from a session namespace. Returns # of chunks removed."""
+    if is_memory_namespace(namespace):
+        _doc_params(None, doc_id)
+        store = get_memory_store(namespace, create=False)
+        removed = store.retain(lambda m: None if _is_doc(m, doc_id) else m) if store else 0
+    else:
+        cid = collection_id_for(_sql_engine, _collection_name(namespace))
+        if cid is None:
+            return 0
+        with _sql_engine.begin() as conn:
+            removed = conn.execute(
+                text(f"DELETE FROM langchain_pg_embedding WHERE {_DOC_ROWS}"), _doc_params(cid, doc_id)
+            ).rowcount
+    answer_cache.invalidate(namespace)
+    return removed
+
+
+def _retain_chunks(namespace: str, doc_id: str, fresh: dict[str, Document]) -> set[str]:
+    """
+    Keep one existing row of `doc_id` per chunk hash that is still in `fresh`
+    (its metadata replaced by the fresh chunk's); delete all other rows of the
+    document. Returns the hashes kept.
+    """
+    kept: set[str] = set()
+    if is_memory_namespace(namespace):
+        store = get_memory_store(namespace, create=False)
+        if store is None:
+            return kept
+
+        def keep(meta):
+            if not _is_doc(meta, doc_id):
+                return meta
+            h = meta.get("chunk_hash")
+            if h in fresh and h not in kept:
+                kept.add(h)
+                return fresh[h].metadata
+            return None
+
+        store.retain(keep)
+        return kept
+
+    cid = collection_id_for(_sql_engine, _collection_name(namespace))
+    if cid is None:
+        return kept
+    with _sql_engine.begin() as conn:
+        rows = conn.execute(
+            text(f"SELECT uuid, cmetadata->>'chunk_hash' FROM langchain_pg_embedding WHERE {_DOC_ROWS}"),
+            _doc_params(cid, doc_id),
+        ).all()
+        keep_ids, keep_meta, drop_ids = [], [], []
+        for row_id, h in rows:
+            if h in fresh and h not in kept:
+                kept.add(h)
+                keep_ids.append(str(row_id))
+                keep_meta.append(json.dumps(fresh[h].metadata))
+            else:
+                drop_ids.append(str(row_id))
+        if drop_ids:
+            conn.execute(text(
+                "DELETE FROM langchain_pg_embedding WHERE collection_id = :cid AND uuid = ANY(CAST(:ids AS uuid[]))"
+            ), {"cid": cid, "ids": drop_ids})
+        if keep_ids:
+            # page numbers, title and fingerprint may have changed even where the text did not
+            conn.execute(text(
+                "UPDATE langchain_pg_embedding e SET cmetadata = CAST(v.meta AS json) "
+                "FROM (SELECT unnest(CAST(:ids AS uuid[])) AS id, unnest(CAST(:metas AS text[])) AS meta) v "
+                "WHERE e.collection_id = :cid AND e.uuid = v.id"
+            ), {"cid": cid, "ids": keep_ids, "metas": keep_meta})
+    return kept
+
+
+def replace_document_bytes(pdf_bytes: bytes, path: str, owner_id: str, title: str | None = None,
+                           namespace: str = "default", progress=None) -> int:
+    """
+    Replace the PDF stored at `path` with a revised file, keeping its doc_id:
+    the storage object is overwritten, chunks whose text is unchanged keep
+    their vectors, chunks that disappeared are deleted, and only new chunks are
+    embedded and written. Returns # of chunks embedded.
+    """
+    meta = _pdf_metadata(path, owner_id, title)
+    fingerprint = document_fingerprint(pdf_bytes, PIPELINE_SIGNATURE)
+    upload_pdf_bytes(path, pdf_bytes, overwrite=True)
+
+    fresh: dict[str, Document] = {}
+    for d in iter_pdf_documents(pdf_bytes, metadata={**meta, "doc_fingerprint": fingerprint}, progress=progress):
+        h = text_hash(d.page_content)
+        fresh.setdefault(h, Document(page_content=d.page_content, metadata={**d.metadata, "chunk_hash": h}))
+    kept = _retain_chunks(namespace, meta["doc_id"], fresh)
+    _report(progress, "chunks_reused", len(kept))
+    answer_cache.invalidate(namespace)
+
+    changed = [d for h, d in fresh.items() if h not in kept]
+    written = _index_new_documents(changed, fingerprint, namespace, progress) if changed else 0
+    if kept and not is_memory_namespace(namespace) and DOC_DEDUP:
+        try:
+            register_document(_sql_engine, fingerprint, _collection_name(namespace), len(fresh))
+        except Exception as e:
+            print(f"[DEDUP] could not register fingerprint: {e}")
+    _report(progress, "chunks_total", len(fresh))
+    print(f"[REPLACE] {path}: {len(kept)} chunks kept, {written} re-embedded, namespace {namespace}")
+    return written
+
+
+def find_document_path(owner_id: str, session_namespace: str, doc_id: str) -> str | None:
+    """Storage path of a session's PDF by doc_id, or None."""
+    for path, _size in list_storage_objects(f"{owner_id}/{session_namespace}"):
+        if document_id(path) == doc_id:
+            return path
+    return None
+
+
+def delete_storage_for_document(owner_id: str, session_namespace: str, doc_id: str) -> int:
+    """Delete one PDF of a session from Supabase Storage. Returns # of objects removed."""
+    path = find_document_path(owner_id, session_namespace, doc_id)
+    if path is None:
         return 0
-    upsert_documents(docs, namespace=namespace)
-    return len(docs)
+    return delete_storage_paths([path])
 
 
 # === Backward-compatible API ===
@@ -181,27 +637,19 @@ def build_vector_index(documents, namespace: str = "default"):
     For compatibility with your previous code:
     - Instead of Chroma, this builds/returns a PGVector store.
     """
-    collection = (
-        VECTOR_COLLECTION if namespace == "default" else f"{VECTOR_COLLECTION}_{namespace}"
-    )
-    store = PGVector.from_documents(
-        documents=documents,
-        embedding=get_embedding_model(),
-        collection_name=collection,
-        connection_string=PG_CONN,
-        engine_args=ENGINE_ARGS,
-    )
-    return store
+    upsert_documents(documents, namespace=namespace)
+    return get_vector_store(namespace)
 
 
 # === RAG chain ===
 
 def get_qa_chain(vector_db_or_retriever, *, k=None, model="llama3-8b-8192",
-                 max_tokens=512, request_timeout=20, max_retries=2):
+                 max_tokens=512, request_timeout=20, max_retries=2, llm=None):
     """
     Accepts either:
       - a vector store (we'll call .as_retriever, optionally with k), or
       - a retriever object (used as-is).
+    `llm` replaces the Groq model (e.g. a fake chat model in bench/).
     """
     if hasattr(vector_db_or_retriever, "as_retriever"):
         retriever = (vector_db_or_retriever.as_retriever(search_kwargs={"k": k})
@@ -209,7 +657,7 @@ def get_qa_chain(vector_db_or_retriever, *, k=None, model="llama3-8b-8192",
     else:
         retriever = vector_db_or_retriever
 
-    llm = ChatGroq(
+    llm = llm or ChatGroq(
         temperature=0,
         model_name=model,
         max_tokens=max_tokens,          # keeps answers compact (faster)
@@ -218,68 +666,325 @@ def get_qa_chain(vector_db_or_retriever, *, k=None, model="llama3-8b-8192",
     )
     return RetrievalQA.from_chain_type(llm=llm, retriever=retriever)
 
-def ask_question(qa_chain, query: str) -> str:
-    # RetrievalQA expects the "query" key; output is under "result"
-    out = qa_chain.invoke({"query": query})
-    # Some LC builds return a plain string already; handle both
-    return out.get("result", out) if isinstance(out, dict) else out
+def _retrieve(qa_chain, query: str, vector=None) -> list[Document]:
+    """The chain's retrieval step; reuses an already computed query vector when it can."""
+    with stage("retrieve"):
+        return _run_retriever(qa_chain.retriever, query, vector)
+
+
+def _run_retriever(retriever, query: str, vector=None) -> list[Document]:
+    if vector is not None and hasattr(retriever, "search_with_vector"):
+        return retriever.search_with_vector(query, vector)
+    if vector is not None and hasattr(retriever, "search_by_vector"):
+        return retriever.search_by_vector(vector)
+    if vector is not None and hasattr(retriever, "vectorstore") and retriever.search_type == "similarity":
+        return retriever.vectorstore.similarity_search_by_vector(vector, **retriever.search_kwargs)
+    return retriever.invoke(query)
+
+
+def _prompt_tokens(qa_chain, query: str, docs: list[Document]) -> int:
+    """Estimated tokens of the prompt the stuff chain builds from `docs`."""
+    from langchain_core.prompts import format_document
+
+    stuff = qa_chain.combine_documents_chain
+    context = stuff.document_separator.join(format_document(d, stuff.document_prompt) for d in docs)
+    return estimate_tokens(stuff.llm_chain.prompt.format(**{stuff.document_variable_name: context, "question": query}))
+
+
+def _context(qa_chain, query: str, docs: list[Document]) -> list[Document]:
+    """Retrieved chunks -> what goes into the prompt (app/context.py), logging the token saving."""
+    if not CONTEXT_ASSEMBLY or not docs:
+        return docs
+    with stage("context"):
+        before = _prompt_tokens(qa_chain, query, docs)
+        used = assemble_context(docs)
+        after = _prompt_tokens(qa_chain, query, used)
+    prompt_tokens.inc("before", amount=before)
+    prompt_tokens.inc("after", amount=after)
+    print(f"[CONTEXT] {len(docs)} chunks / {before} prompt tokens -> {len(used)} / {after}")
+    return used
+
+
+def _chunk_ids(docs: list[Document]) -> list[str]:
+    return [text_hash(d.page_content) for d in docs]
+
+
+def _cached_answer(namespace: str | None, query: str):
+    """(cached answer or None, query vector, namespace version) for the semantic answer cache."""
+    if namespace is None or not answer_cache.enabled:
+        return None, None, None
+    version = answer_cache.version(namespace)  # read before retrieval; see answer_cache.store
+    vector = get_embedding_model().embed_query(query)
+    return answer_cache.lookup(namespace, vector), vector, version
+
+
+def ask_question(qa_chain, query: str, namespace: str | None = None) -> str:
+    """
+    Answer `query` with the RetrievalQA chain. With `namespace`, near-identical
+    questions asked since the namespace last changed are answered from the
+    semantic answer cache (app/answer_cache.py).
+    """
+    cached, vector, version = _cached_answer(namespace, query)
+    if cached is not None:
+        return cached
+
+    # the RetrievalQA chain's two steps, run separately so each is timed
+    docs = _retrieve(qa_chain, query, vector)
+    context = _context(qa_chain, query, docs)
+    with stage("llm"):
+        out = qa_chain.combine_documents_chain.invoke({"input_documents": context, "question": query})
+    answer = out["output_text"]
+    if vector is not None and docs:
+        answer_cache.store(namespace, vector, _chunk_ids(docs), answer, version)
+    return answer
+
+
+def stream_answer(qa_chain, query: str, namespace: str | None = None):
+    """
+    Run the same retrieve -> stuff -> LLM steps as `ask_question`, but yield
+    events as they happen, so the first tokens reach the user while Groq is
+    still generating:
+      {"event": "retrieval", "chunks": n}
+      {"event": "token", "text": "..."}   (many)
+      {"event": "done", "answer": "<full text>"}
+    A semantic cache hit yields the cached answer as a single token.
+    """
+    from langchain_core.prompts import format_document
+
+    cached, vector, version = _cached_answer(namespace, query)
+    if cached is not None:
+        yield {"event": "retrieval", "chunks": 0, "cached": True}
+        yield {"event": "token", "text": cached}
+        yield {"event": "done", "answer": cached, "cached": True}
+        return
+
+    docs = _retrieve(qa_chain, query, vector)
+    used = _context(qa_chain, query, docs)
+    yield {"event": "retrieval", "chunks": len(used)}
+
+    stuff = qa_chain.combine_documents_chain
+    context = stuff.document_separator.join(format_document(d, stuff.document_prompt) for d in used)
+    prompt = stuff.llm_chain.prompt.format_prompt(**{stuff.document_variable_name: context, "question": query})
+
+    parts = []
+    started = time.perf_counter()
+    for chunk in stuff.llm_chain.llm.stream(prompt.to_messages()):
+        if chunk.content:
+            if not parts:
+                observe_stage("llm_first_token", time.perf_counter() - started)
+            parts.append(chunk.content)
+            yield {"event": "token", "text": chunk.content}
+    observe_stage("llm", time.perf_counter() - started)
+    answer = "".join(parts)
+    if vector is not None and docs:
+        answer_cache.store(namespace, vector, _chunk_ids(docs), answer, version)
+    yield {"event": "done", "answer": answer}
+
+
+_retrieval_pool = ThreadPoolExecutor(max_workers=ASK_BATCH_RETRIEVAL_CONCURRENCY, thread_name_prefix="batch-retrieve")
+_llm_pool = ThreadPoolExecutor(max_workers=ASK_BATCH_LLM_CONCURRENCY, thread_name_prefix="batch-llm")
+
+
+def ask_questions(qa_chain, queries: list[str], namespace: str | None = None) -> list[dict]:
+    """
+    Answer several questions against one chain: every question is embedded in
+    one batched call, retrievals run concurrently on the shared pool, then the
+    Groq calls fan out (at most ASK_BATCH_LLM_CONCURRENCY at a time). Returns
+    [{"answer": ...} or {"error": ...}] in the order of `queries`; a failing
+    question does not fail the others. Repeated questions are answered once.
+    """
+    unique = list(dict.fromkeys(queries))
+    vectors = get_embedding_model().embed_queries(unique)
+    use_cache = namespace is not None and answer_cache.enabled
+    version = answer_cache.version(namespace) if use_cache else None  # read before retrieval
+
+    results: dict[str, dict] = {}
+    pending = []
+    for query, vector in zip(unique, vectors):
+        cached = answer_cache.lookup(namespace, vector) if use_cache else None
+        if cached is not None:
+            results[query] = {"answer": cached, "cached": True}
+        else:
+            pending.append((query, vector))
+
+    retrievals = [_retrieval_pool.submit(_retrieve, qa_chain, q, v) for q, v in pending]
+
+    def answer(query, docs):
+        context = _context(qa_chain, query, docs)
+        with stage("llm"):
+            out = qa_chain.combine_documents_chain.invoke({"input_documents": context, "question": query})
+        return out["output_text"]
+
+    calls = []
+    for (query, vector), retrieval in zip(pending, retrievals):
+        try:
+            docs = retrieval.result()
+        except Exception as e:
+            results[query] = {"error": f"retrieval failed: {e}"}
+            continue
+        calls.append((query, vector, docs, _llm_pool.submit(answer, query, docs)))
+    for query, vector, docs, call in calls:
+        try:
+            results[query] = {"answer": call.result()}
+        except Exception as e:
+            results[query] = {"error": str(e)}
+            continue
+        if use_cache and docs:
+            answer_cache.store(namespace, vector, _chunk_ids(docs), results[query]["answer"], version)
+    return [results[q] for q in queries]
+
+
+_vector_stores = LRUCache(VECTOR_STORE_CACHE_SIZE)
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store(namespace: str = "default") -> PGVector:
+    """Cached PGVector store for a namespace, bound to the shared engine."""
+    store = _vector_stores.get(namespace)
+    if store is None:
+        # One builder at a time: avoids a stampede of setup queries, and
+        # LangChain's table-class setup is not thread-safe on first use.
+        with _vector_store_lock:
+            store = _vector_stores.peek(namespace)
+            if store is None:
+                store = PGVector(
+                    embedding_function=get_embedding_model(),
+                    collection_name=_collection_name(namespace),
+                    connection_string=PG_CONN,
+                    connection=_sql_engine,
+                )
+                _vector_stores.put(namespace, store)
+    return store
+
+
+TEXT_SEARCH_RECHECK = 60.0  # seconds between checks while the full-text index is missing
+_text_search = {"ready": False, "checked": None}
+
+
+def _text_search_ready() -> bool:
+    """
+    Whether Postgres full-text search is usable. The column and index are only
+    built by `python -m app.vector_index`; until then hybrid retrieval falls
+    back to vector search, and this is checked again every TEXT_SEARCH_RECHECK.
+    """
+    if _text_search["ready"]:
+        return True
+    now = time.monotonic()
+    if _text_search["checked"] is None or now - _text_search["checked"] >= TEXT_SEARCH_RECHECK:
+        first = _text_search["checked"] is None
+        _text_search["checked"] = now
+        try:
+            _text_search["ready"] = text_search_ready(_sql_engine)
+        except Exception as e:  # e.g. fresh database without LangChain's tables yet
+            print(f"[HYBRID] full-text index check failed: {e}")
+        if first and not _text_search["ready"]:
+            print("[HYBRID] full-text index missing; vector-only retrieval until "
+                  "`python -m app.vector_index` builds it")
+    return _text_search["ready"]
+
 
 def get_retriever(k: int = 4, namespace: str = "default"):
     """
-    Build a retriever backed by pgvector (no rebuild per ask).
+    Build a retriever backed by pgvector (no rebuild per ask). By default it
+    queries through app/vector_index.py so per-collection ANN indexes are used.
     """
-    collection = VECTOR_COLLECTION if namespace == "default" else f"{VECTOR_COLLECTION}_{namespace}"
-    store = PGVector(
-        embedding_function=get_embedding_model(),
-        collection_name=collection,
-        connection_string=PG_CONN,
-        engine_args=ENGINE_ARGS,  # your small pool caps
-    )
-    return store.as_retriever(search_kwargs={"k": k})
+    if is_memory_namespace(namespace):
+        return MemoryRetriever(namespace=namespace, embedding=get_embedding_model(), k=k)
+    if VECTOR_SEARCH == "pgvector":
+        return get_vector_store(namespace).as_retriever(search_kwargs={"k": k})
+    return IndexedPgRetriever(engine=_sql_engine, collection=_collection_name(namespace),
+                              embedding=get_embedding_model(), k=k)
 
 
+def get_hybrid_retriever(k: int = 4, namespace: str = "default"):
+    """
+    Vector + keyword retrieval fused with RRF (app/hybrid.py): Postgres
+    full-text search for database namespaces, BM25 for in-memory ones. While
+    the full-text index is missing, a database namespace's keyword side finds
+    nothing and the result is the vector ranking; this is decided per query,
+    so cached chains switch to hybrid once the index is built.
+    """
+    embedder = get_embedding_model()
+    n = k * HYBRID_CANDIDATES
+    if is_memory_namespace(namespace):
+        vector = MemoryRetriever(namespace=namespace, embedding=embedder, k=n)
+        lexical = partial(memory_lexical_search, namespace)
+    else:
+        collection = _collection_name(namespace)
+        vector = IndexedPgRetriever(engine=_sql_engine, collection=collection, embedding=embedder, k=n)
+
+        def lexical(query, limit):
+            if not _text_search_ready():
+                return []
+            return pg_text_search(_sql_engine, collection_id_for(_sql_engine, collection), query, limit)
+    return HybridRetriever(vector=vector, lexical=lexical, embedding=embedder, k=k)
+
+
+def get_session_retriever(k: int = 4, namespace: str = "default"):
+    """The retriever /ask uses, per RETRIEVAL_MODE (hybrid | vector)."""
+    if RETRIEVAL_MODE == "hybrid":
+        return get_hybrid_retriever(k=k, namespace=namespace)
+    return get_retriever(k=k, namespace=namespace)
+
+
+def _refresh_ann_index(namespace: str) -> None:
+    """Give a collection its ANN index once it has grown past VECTOR_INDEX_MIN_ROWS."""
+    try:
+        collection_id = collection_id_for(_sql_engine, _collection_name(namespace))
+        if collection_id is not None:
+            ensure_ann_index(_sql_engine, collection_id)
+    except Exception as e:
+        print(f"[VECTOR INDEX] could not index namespace {namespace}: {e}")
+
+
+def release_namespace(namespace: str) -> None:
+    """Drop in-process objects cached for a namespace (its rows stay in Postgres)."""
+    _vector_stores.pop(namespace)
+
+
+
+def list_storage_objects(prefix: str) -> list[tuple[str, int]]:
+    """
+    Every file directly under `prefix` in the PDF bucket: [(path, size in bytes)].
+    Storage returns at most STORAGE_PAGE_SIZE entries per call, so this pages.
+    """
+    bucket = get_supabase().storage.from_(PDF_BUCKET)
+    objects, offset = [], 0
+    while True:
+        with stage("storage_list"):
+            page = bucket.list(path=prefix, options={"limit": STORAGE_PAGE_SIZE, "offset": offset}) or []
+        for obj in page:
+            if obj.get("id") is None:  # a sub-folder, not a file
+                continue
+            size = (obj.get("metadata") or {}).get("size") or 0
+            objects.append((f"{prefix}/{obj['name']}", int(size)))
+        if len(page) < STORAGE_PAGE_SIZE:
+            return objects
+        offset += len(page)
+
+
+def delete_storage_paths(paths: list[str]) -> int:
+    """Remove objects from the PDF bucket, STORAGE_PAGE_SIZE per call. Returns # of paths sent."""
+    bucket = get_supabase().storage.from_(PDF_BUCKET)
+    for batch in _batched(paths, STORAGE_PAGE_SIZE):
+        with stage("storage_remove"):
+            bucket.remove(batch)
+    return len(paths)
 
-# Reuse your DATABASE_URL
-_sql_engine = create_engine(
-    PG_CONN,
-    future=True,
-    pool_size=1,
-    max_overflow=0,
-    pool_pre_ping=True,
-    pool_recycle=1800,
-)
 
 def delete_storage_for_session(owner_id: str, session_namespace: str) -> int:
     """
     Delete ALL objects under pdfs/<owner_id>/<session_namespace>/ in Supabase Storage.
     Returns number of objects removed.
     """
-    prefix = f"{owner_id}/{session_namespace}"
-    # list files directly under the session folder
-    items = supabase.storage.from_(PDF_BUCKET).list(path=prefix)
-    if not items:
-        return 0
-    paths = [f"{prefix}/{obj['name']}" for obj in items]  # full paths to files
-    if paths:
-        supabase.storage.from_(PDF_BUCKET).remove(paths)
-    return len(paths)
+    return delete_storage_paths([path for path, _size in list_storage_objects(f"{owner_id}/{session_namespace}")])
 
 
 def delete_embeddings_namespace(session_namespace: str) -> bool:
     """
     Delete the pgvector 'collection' and all embeddings for a given session namespace.
     We named collections as f"{VECTOR_COLLECTION}_{namespace}".
-    Returns True if a collection was found and deleted.
+    Returns True if a collection (or in-memory store) was found and deleted.
     """
-    collection = f"{VECTOR_COLLECTION}_{session_namespace}" if session_namespace != "default" else VECTOR_COLLECTION
-    with _sql_engine.begin() as conn:
-        coll_id = conn.execute(
-            text("SELECT id FROM langchain_pg_collection WHERE name = :name"),
-            {"name": collection},
-        ).scalar()
-        if not coll_id:
-            return False
-        # delete embeddings then the collection row
-        conn.execute(text("DELETE FROM langchain_pg_embedding WHERE collection_id = :cid"), {"cid": coll_id})
-        conn.execute(text("DELETE FROM langchain_pg_collection WHERE id = :cid"), {"cid": coll_id})
-    return True
\ No newline at end of file
+    from .cleanup import purge_namespaces
+    return purge_namespaces([session_namespace])["purged"] > 0
\ No newline at end of file
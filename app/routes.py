@@ -1,17 +1,26 @@
+import json
 import os
 from uuid import uuid4
 
-from flask import Blueprint, request, jsonify, render_template
+from flask import Blueprint, Response, request, jsonify, render_template, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from .rag_engine import (
-    upload_pdf_to_storage,
-    index_pdf_from_storage_path,
-    get_retriever,
+    make_storage_path,
+    get_session_retriever,
     get_qa_chain,
     ask_question,
+    ask_questions,
+    stream_answer,
+    ASK_BATCH_MAX,
+    release_namespace,
+    document_id,
+    _DOC_ID_RE,
+    find_document_path,
+    delete_document,
+    delete_storage_for_document,
 )
 
 # Optional helper if you implemented it in rag_engine.py
@@ -20,6 +29,10 @@ try:
 except Exception:
     delete_storage_paths = None  # type: ignore
 
+from .jobs import IndexQueueFull, get_job, release_index_slots, reserve_index_slots, submit_index_job
+from .cleanup import register_idle_cache, schedule_purge, touch_guest
+from .cache import LRUCache
+from .metrics import stage
 from .models import User, ChatLog, Document, ChatSession
 from flask_mail import Message
 from app.utils import db, mail
@@ -30,8 +43,29 @@ routes = Blueprint("routes", __name__)
 
 ALLOWED_EXTENSIONS = {"pdf"}
 
-# We no longer use a local user_vectors cache (pgvector persists)
-user_chains = {}
+# === QA chain cache ===
+# Chains are cheap to rebuild (pgvector persists), so keep a bounded, per-worker
+# cache: least recently used chains go first, and chains idle for longer than
+# CHAIN_CACHE_TTL are dropped even when guests never send the cleanup beacon.
+CHAIN_CACHE_SIZE = int(os.getenv("CHAIN_CACHE_SIZE", "256"))
+CHAIN_CACHE_TTL = float(os.getenv("CHAIN_CACHE_TTL", "1800"))  # idle seconds
+
+
+def _release_chain(key, chain, reason: str) -> None:
+    # keys are (user_id, session_id) for users, "<guest>_session" for guests
+    namespace = str(key[1]) if isinstance(key, tuple) else str(key)
+    release_namespace(namespace)
+    if reason != "removed":
+        print(f"[CHAIN] Evicted chain {key!r} ({reason})")
+
+
+user_chains = LRUCache(CHAIN_CACHE_SIZE, ttl=CHAIN_CACHE_TTL, on_evict=_release_chain)
+register_idle_cache(user_chains)  # idle chains go on the reaper tick, not only on the next lookup
+
+
+def _commit() -> None:
+    with stage("db_commit"):
+        db.session.commit()
 
 
 def allowed_file(filename: str) -> bool:
@@ -62,7 +96,7 @@ def process_signup():
         password=generate_password_hash(data["password"]),
     )
     db.session.add(user)
-    db.session.commit()
+    _commit()
     return jsonify({"message": "Signup successful"})
 
 
@@ -124,7 +158,7 @@ def forgot_password():
         mail.send(msg)
 
         user.password = generate_password_hash(new_password)
-        db.session.commit()
+        _commit()
         return jsonify({"message": "Password sent successfully"})
     except Exception as e:
         print(f"[EMAIL ERROR] {e}")
@@ -158,7 +192,7 @@ def edit_profile():
 
     current_user.first_name = first
     current_user.last_name = last
-    db.session.commit()
+    _commit()
     return jsonify({"message": "Profile updated successfully."})
 
 
@@ -183,7 +217,7 @@ def change_password():
         return jsonify({"error": "New password must be at least 6 characters"}), 400
 
     user.password = generate_password_hash(new_password)
-    db.session.commit()
+    _commit()
     return jsonify({"message": "Password updated successfully"})
 
 
@@ -195,7 +229,7 @@ def create_session():
     title = data.get("title", "New Chat")
     session_obj = ChatSession(user_id=current_user.id, title=title)
     db.session.add(session_obj)
-    db.session.commit()
+    _commit()
     return jsonify({"session_id": session_obj.id, "title": session_obj.title})
 
 
@@ -217,35 +251,54 @@ def delete_session(session_id):
     if not session_to_delete:
         return jsonify({"error": "Session not found"}), 404
 
-    # Delete chat logs
+    # Chat logs, Document rows and the session itself go in one commit
     ChatLog.query.filter_by(session_id=session_id).delete()
+    Document.query.filter_by(user_id=current_user.id, session_id=session_id).delete()
+    db.session.delete(session_to_delete)
+    _commit()
+    user_chains.pop((current_user.id, session_id), None)
 
-    # Delete PDFs for this session (Storage) and DB Document rows
-    try:
-        from .rag_engine import delete_storage_for_session, delete_embeddings_namespace
-
-        # Files live under <owner>/<session_namespace>
-        owner_id = str(current_user.id)
-        session_namespace = str(session_id)
+    # Storage files (<owner>/<session_id>/...) and vectors are purged in the background
+    schedule_purge([(str(current_user.id), str(session_id))])
 
-        removed = delete_storage_for_session(owner_id, session_namespace)
-        print(f"[DELETE] Removed {removed} storage objects for user {owner_id}, session {session_id}")
+    return jsonify({"message": "Session and its contents deleted"})
 
-        # Remove vector embeddings/collection for this session
-        deleted_coll = delete_embeddings_namespace(session_namespace)
-        print(f"[DELETE] Embedding collection deleted? {deleted_coll}")
+@routes.route("/session/<session_id>/document/<doc_id>", methods=["DELETE"])
+def delete_session_document(session_id, doc_id):
+    """
+    Remove one PDF from a session: its vectors, its storage object and (for
+    users) its Document row. Guests pass their session namespace
+    ("<guest_id>_session", as returned by /upload) and the X-Guest-ID header.
+    """
+    if not _DOC_ID_RE.fullmatch(doc_id):
+        return jsonify({"error": "Invalid document id"}), 400
+    if current_user.is_authenticated:
+        if not session_id.isdigit() or not ChatSession.query.filter_by(
+                id=int(session_id), user_id=current_user.id).first():
+            return jsonify({"error": "Session not found"}), 404
+        owner_id = str(current_user.id)
+    else:
+        guest_id = request.headers.get("X-Guest-ID")
+        if not guest_id or session_id != f"{guest_id}_session":
+            return jsonify({"error": "Session not found"}), 404
+        owner_id = guest_id
 
-        # Remove Document rows that pointed to those files
-        Document.query.filter_by(user_id=current_user.id, session_id=session_id).delete()
+    try:
+        chunks = delete_document(session_id, doc_id)
+        files = delete_storage_for_document(owner_id, session_id, doc_id)
     except Exception as e:
-        print(f"[DELETE] Error cleaning storage/embeddings: {e}")
-
-    # Remove session + cached chain
-    db.session.delete(session_to_delete)
-    db.session.commit()
-    user_chains.pop((current_user.id, session_id), None)
+        print(f"[DELETE DOCUMENT ERROR] {e}")
+        return jsonify({"error": str(e)}), 500
+    if current_user.is_authenticated:
+        for doc in Document.query.filter_by(user_id=current_user.id, session_id=int(session_id)).all():
+            if document_id(doc.filename) == doc_id:
+                db.session.delete(doc)
+        _commit()
+    print(f"[DELETE] document {doc_id} in session {session_id}: {chunks} chunks, {files} files")
+    if not chunks and not files:
+        return jsonify({"error": "Document not found"}), 404
+    return jsonify({"message": "Document deleted", "doc_id": doc_id, "chunks_removed": chunks, "files_removed": files})
 
-    return jsonify({"message": "Session and its contents deleted"})
 
 @routes.route("/session/<int:session_id>", methods=["PUT"])
 @login_required
@@ -260,11 +313,17 @@ def rename_session(session_id):
         return jsonify({"error": "Session not found"}), 404
 
     session_obj.title = new_title
-    db.session.commit()
+    _commit()
     return jsonify({"message": "Title updated", "title": new_title})
 
 
 # --------------------- File Upload ---------------------
+def _index_queue_full():
+    resp = jsonify({"error": "Too many documents are being indexed right now; try again shortly"})
+    resp.headers["Retry-After"] = "30"
+    return resp, 503
+
+
 @routes.route("/upload", methods=["POST"])
 def upload_file():
     try:
@@ -286,10 +345,16 @@ def upload_file():
         if not files:
             return jsonify({"error": "No file provided"}), 400
 
+        replace_doc_id = request.form.get("replace_doc_id")
+        if replace_doc_id:
+            return _replace_upload(user_id, session_id, files, replace_doc_id)
+
         uploaded_storage_paths = []
         uploaded_filenames = []
+        uploads = []
 
-        # Upload to Supabase Storage + create Document rows (logged-in users)
+        # Read each PDF once; the background job uploads these bytes to Supabase
+        # Storage while it parses them. Create Document rows (logged-in users).
         for file in files:
             if not file or not allowed_file(file.filename):
                 continue
@@ -298,7 +363,8 @@ def upload_file():
             display_name = secure_filename(file.filename) or "document.pdf"
 
             # >>> key change: include session subfolder <<<
-            storage_path = upload_pdf_to_storage(file, str(user_id), subdir=str(session_id))
+            storage_path = make_storage_path(file.filename, str(user_id), subdir=str(session_id))
+            uploads.append((storage_path, file.read()))
             uploaded_storage_paths.append(storage_path)
             uploaded_filenames.append(display_name)
 
@@ -309,46 +375,40 @@ def upload_file():
 
         if not uploaded_storage_paths:
             return jsonify({"error": "No valid PDFs"}), 400
-
-        if isinstance(user_id, int):
-            db.session.commit()
-            if session_id is None:
-                new_title = f"New Chat ({uploaded_filenames[0]})"
-                new_session = ChatSession(user_id=user_id, title=new_title)
-                db.session.add(new_session)
-                db.session.commit()
-                session_id = new_session.id
-
-            # Log uploaded file names
-            for filename in uploaded_filenames:
-                log = ChatLog(user_id=user_id, session_id=session_id, question="", answer=f"🗂 Uploaded File: {filename}")
-                db.session.add(log)
-            db.session.commit()
-
-            # Index each PDF into pgvector
-            for storage_path in uploaded_storage_paths:
-                index_pdf_from_storage_path(
-                    storage_path,
-                    owner_id=str(user_id),
-                    title=os.path.basename(storage_path),
-                    namespace=str(session_id),
-                )
-            # Do NOT build LLM chain here; /ask will build on first question
-
-        else:
-            # Guest flow
-            for storage_path in uploaded_storage_paths:
-                index_pdf_from_storage_path(
-                    storage_path,
-                    owner_id=str(user_id),
-                    title=os.path.basename(storage_path),
-                    namespace=str(session_id),
-                )
-            # Do not build chain here; /ask will build on first question
+        # claim room in the indexing backlog before anything is committed
+        if not reserve_index_slots(len(uploads)):
+            db.session.rollback()
+            return _index_queue_full()
+        try:
+            if isinstance(user_id, int):
+                _commit()
+                if session_id is None:
+                    new_title = f"New Chat ({uploaded_filenames[0]})"
+                    new_session = ChatSession(user_id=user_id, title=new_title)
+                    db.session.add(new_session)
+                    _commit()
+                    session_id = new_session.id
+
+                # Log uploaded file names
+                for filename in uploaded_filenames:
+                    log = ChatLog(user_id=user_id, session_id=session_id, question="", answer=f"🗂 Uploaded File: {filename}")
+                    db.session.add(log)
+                _commit()
+
+            if not current_user.is_authenticated:
+                touch_guest(str(user_id), session_id)
+
+            # Index in the background; /ask answers from whatever is already indexed
+            job = submit_index_job(str(user_id), str(session_id), uploads, reserved=True)
+        except Exception:
+            release_index_slots(len(uploads))
+            raise
 
         print(f"[UPLOAD] user_id: {user_id}, session_id: {session_id}")
-        print(f"[UPLOAD] uploaded: {uploaded_filenames}")
-        return jsonify({"message": "Documents uploaded and indexed successfully", "session_id": session_id})
+        print(f"[UPLOAD] uploaded: {uploaded_filenames}, job_id: {job.id}")
+        documents = [{"doc_id": document_id(p), "title": n} for p, n in zip(uploaded_storage_paths, uploaded_filenames)]
+        return jsonify({"message": "Documents uploaded; indexing started", "session_id": session_id,
+                        "job_id": job.id, "documents": documents}), 202
 
     except Exception as e:
         import traceback
@@ -357,16 +417,62 @@ def upload_file():
         return jsonify({"error": f"{type(e).__name__}: {str(e)}"}), 500
 
 
+def _replace_upload(user_id, session_id, files, doc_id):
+    """/upload with replace_doc_id: a revised version of a PDF already in the session."""
+    files = [f for f in files if f and allowed_file(f.filename)]
+    if len(files) != 1:
+        return jsonify({"error": "Replace takes exactly one PDF"}), 400
+    if session_id is None or not _DOC_ID_RE.fullmatch(doc_id):
+        return jsonify({"error": "session_id and a valid replace_doc_id are required"}), 400
+    if isinstance(user_id, int) and not ChatSession.query.filter_by(id=session_id, user_id=user_id).first():
+        return jsonify({"error": "Session not found"}), 404
+
+    # the new version goes to the same storage path, so the doc_id stays the same
+    storage_path = find_document_path(str(user_id), str(session_id), doc_id)
+    if storage_path is None:
+        return jsonify({"error": "Document not found"}), 404
+    display_name = secure_filename(files[0].filename) or "document.pdf"
+    try:
+        job = submit_index_job(str(user_id), str(session_id), [(storage_path, files[0].read())],
+                               replace=True, titles=[display_name])
+    except IndexQueueFull:
+        return _index_queue_full()
+    if isinstance(user_id, int):
+        db.session.add(ChatLog(user_id=user_id, session_id=session_id, question="",
+                               answer=f"🗂 Replaced File: {display_name}"))
+        _commit()
+
+    print(f"[UPLOAD] replacing {storage_path} with {display_name}, job_id: {job.id}")
+    return jsonify({"message": "Document replaced; re-indexing started", "session_id": session_id,
+                    "job_id": job.id, "documents": [{"doc_id": doc_id, "title": display_name}]}), 202
+
+
+# --------------------- Indexing Jobs ---------------------
+@routes.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = get_job(job_id)
+    guest_id = request.headers.get("X-Guest-ID")
+    user_id = current_user.id if current_user.is_authenticated else guest_id or "guest"
+    if not job or job.owner_id != str(user_id):
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
 # --------------------- Ask ---------------------
-@routes.route("/ask", methods=["POST"])
-def ask():
+def _ask_context():
+    """Parse an ask request into (query, user_id, session_id, qa_chain) or an error response."""
     data = request.json or {}
     query = (data.get("question") or "").strip()
-    session_id = data.get("session_id")
-
     if not query:
-        return jsonify({"error": "No question provided"}), 400
+        return None, (jsonify({"error": "No question provided"}), 400)
+    ctx, error = _session_chain(data.get("session_id"))
+    if error:
+        return None, error
+    return (query, *ctx), None
 
+
+def _session_chain(session_id):
+    """(user_id, session_id, qa_chain) for the caller's session, or an error response."""
     guest_id = request.headers.get("X-Guest-ID")
     user_id = current_user.id if current_user.is_authenticated else guest_id or "guest"
     print(f"[ASK] Guest ID: {guest_id}, user_id: {user_id}, session_id: {session_id}")
@@ -384,34 +490,117 @@ def ask():
         qa_chain = user_chains.get((user_id, session_id))
         if not qa_chain:
             print(f"[ASK] Building chain for user {user_id}, session {session_id}")
-            retriever = get_retriever(k=6, namespace=str(session_id))
+            retriever = get_session_retriever(k=6, namespace=str(session_id))
             qa_chain = get_qa_chain(retriever)
-            user_chains[(user_id, session_id)] = qa_chain
+            user_chains.put((user_id, session_id), qa_chain)
     else:
+        touch_guest(str(user_id), session_id)
         qa_chain = user_chains.get(session_id)
         if not qa_chain:
             print(f"[ASK] Building guest chain for session {session_id}")
-            retriever = get_retriever(k=6, namespace=str(session_id))
+            retriever = get_session_retriever(k=6, namespace=str(session_id))
             qa_chain = get_qa_chain(retriever)
-            user_chains[session_id] = qa_chain
+            user_chains.put(session_id, qa_chain)
 
     if not qa_chain:
-        return jsonify({"error": "No documents indexed for this session"}), 400
+        return None, (jsonify({"error": "No documents indexed for this session"}), 400)
+    return (user_id, session_id, qa_chain), None
 
-    try:
-        answer = ask_question(qa_chain, query)
 
-        if isinstance(user_id, int) and session_id is not None:
-            log = ChatLog(user_id=user_id, session_id=session_id, question=query, answer=answer)
-            db.session.add(log)
-            db.session.commit()
+def _log_answer(user_id, session_id, query: str, answer: str) -> None:
+    _log_answers(user_id, session_id, [(query, answer)])
+
+
+def _log_answers(user_id, session_id, pairs) -> None:
+    """ChatLog rows for (question, answer) pairs, written in one commit."""
+    if isinstance(user_id, int) and session_id is not None and pairs:
+        db.session.add_all([ChatLog(user_id=user_id, session_id=session_id, question=q, answer=a) for q, a in pairs])
+        _commit()
+
 
+@routes.route("/ask", methods=["POST"])
+def ask():
+    ctx, error = _ask_context()
+    if error:
+        return error
+    query, user_id, session_id, qa_chain = ctx
+
+    try:
+        answer = ask_question(qa_chain, query, namespace=str(session_id))
+        _log_answer(user_id, session_id, query, answer)
         return jsonify({"answer": answer})
     except Exception as e:
         print(f"[ASK ERROR] {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@routes.route("/ask/batch", methods=["POST"])
+def ask_batch():
+    """
+    Several questions in one request: {"questions": [...], "session_id": ...}.
+    Returns {"answers": [{"question", "answer"} or {"question", "error"}]} in
+    the same order; answered questions are logged in one commit.
+    """
+    data = request.json or {}
+    questions = data.get("questions")
+    if not isinstance(questions, list):
+        return jsonify({"error": "questions must be a list"}), 400
+    questions = [q.strip() for q in questions if isinstance(q, str) and q.strip()]
+    if not questions:
+        return jsonify({"error": "No question provided"}), 400
+    if len(questions) > ASK_BATCH_MAX:
+        return jsonify({"error": f"At most {ASK_BATCH_MAX} questions per request"}), 400
+
+    ctx, error = _session_chain(data.get("session_id"))
+    if error:
+        return error
+    user_id, session_id, qa_chain = ctx
+    print(f"[ASK BATCH] {len(questions)} questions, session {session_id}")
+
+    try:
+        results = ask_questions(qa_chain, questions, namespace=str(session_id))
+        _log_answers(user_id, session_id, [(q, r["answer"]) for q, r in zip(questions, results) if "answer" in r])
+        return jsonify({"answers": [{"question": q, **r} for q, r in zip(questions, results)]})
+    except Exception as e:
+        print(f"[ASK BATCH ERROR] {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+def _sse(event: dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+
+@routes.route("/ask/stream", methods=["POST"])
+def ask_stream():
+    """
+    Same as /ask, but answers as Server-Sent Events: `retrieval` once the
+    chunks are fetched, `token` for each piece of text from the LLM, then
+    `done` with the full answer (or `error`). The ChatLog row is written
+    after the stream completes.
+    """
+    ctx, error = _ask_context()
+    if error:
+        return error
+    query, user_id, session_id, qa_chain = ctx
+
+    def generate():
+        try:
+            for event in stream_answer(qa_chain, query, namespace=str(session_id)):
+                if event["event"] == "done":
+                    _log_answer(user_id, session_id, query, event["answer"])
+                yield _sse(event)
+        except Exception as e:
+            print(f"[ASK STREAM ERROR] {e}")
+            yield _sse({"event": "error", "error": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        # no caching, and ask nginx-style proxies not to buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # --------------------- History ---------------------
 @routes.route("/history/<int:session_id>", methods=["GET"])
 @login_required
@@ -450,19 +639,9 @@ def cleanup_guest():
     if not guest_id:
         return jsonify({"error": "Missing guest ID"}), 400
 
-    # Remove in-memory chain
-    user_chains.pop(guest_id, None)
-
-    # Remove Storage files and embeddings for this guest's session namespace
-    try:
-        from .rag_engine import delete_storage_for_session, delete_embeddings_namespace
-        owner_id = str(guest_id)
-        session_namespace = f"{guest_id}_session"
-
-        removed = delete_storage_for_session(owner_id, session_namespace)
-        deleted_coll = delete_embeddings_namespace(session_namespace)
-        print(f"[GUEST CLEANUP] removed={removed}, collection_deleted={deleted_coll}")
-    except Exception as e:
-        print(f"[GUEST CLEANUP ERROR] {e}")
+    # Remove in-memory chain (guest chains are keyed by their session namespace)
+    user_chains.pop(f"{guest_id}_session", None)
 
-    return jsonify({"message": f"Guest {guest_id} cleaned up"})
\ No newline at end of file
+    # Storage files and embeddings of the guest's namespace go in the background
+    schedule_purge([(str(guest_id), f"{guest_id}_session")])
+    return jsonify({"message": f"Guest {guest_id} cleanup scheduled"}), 202
@@ -0,0 +1,296 @@
+"""
+ANN index management and search for pgvector collections.
+
+    python -m app.vector_index             # index every collection above the threshold
+    python -m app.vector_index --rebuild   # drop and recreate them (e.g. after changing HNSW_M)
+"""
+import argparse
+import os
+from uuid import UUID
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from sqlalchemy import text
+
+from .cache import LRUCache
+from .partitions import is_partitioned, partition_name
+from .hybrid import TEXT_SEARCH_CONFIG, TEXT_COLUMN
+
+# === Vector indexes ===
+# All collections share langchain_pg_embedding, and LangChain's PGVector filters
+# it by collection_id with no index, so every question scans the whole table.
+# Here:
+#   * a btree on collection_id keeps exact search cheap for small collections;
+#   * collections with at least VECTOR_INDEX_MIN_ROWS rows get their own
+#     partial HNSW (or IVFFlat) index, WHERE collection_id = '<uuid>' (on the
+#     partitioned layout, a plain index on the collection's partition);
+#   * a stored tsvector column over the chunk text, with a GIN index, serves
+#     hybrid retrieval's keyword side (app/hybrid.py);
+#   * the shared indexes and the column are built by `python -m app.vector_index`
+#     at deploy time, never inside a request (adding the column rewrites the
+#     whole table); requests only check text_search_ready();
+#   * search() runs the same cosine-distance query as PGVector, with the
+#     collection id inlined so the planner can pick the partial index, and with
+#     hnsw.ef_search / ivfflat.probes set per query.
+# The embedding column is untyped `vector`, so indexes are built on the
+# expression embedding::vector(EMBED_DIM) and queries order by that same
+# expression.
+
+VECTOR_SEARCH = os.getenv("VECTOR_SEARCH", "indexed")           # indexed | pgvector (LangChain's query)
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "hnsw")                # hnsw | ivfflat | off
+VECTOR_INDEX_MIN_ROWS = int(os.getenv("VECTOR_INDEX_MIN_ROWS", "2000"))
+EMBED_DIM = int(os.getenv("EMBED_DIM", "384"))                   # all-MiniLM-L6-v2
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+
+INDEX_PREFIX = "doc_assistant_ann_"
+COLLECTION_ID_INDEX = "doc_assistant_embedding_collection_id"
+TEXT_INDEX = "doc_assistant_embedding_fts"
+
+
+def _vector_expr() -> str:
+    return f"(embedding::vector({EMBED_DIM}))"
+
+
+def index_name(collection_id) -> str:
+    return INDEX_PREFIX + UUID(str(collection_id)).hex
+
+
+def _index_exists(conn, name: str) -> bool:
+    return conn.execute(text("SELECT to_regclass(:n) IS NOT NULL"), {"n": name}).scalar()
+
+
+def _drop_invalid_index(conn, name: str) -> bool:
+    """
+    A CREATE INDEX CONCURRENTLY that was interrupted leaves an INVALID index
+    behind, which IF NOT EXISTS would then skip forever; drop it so it is
+    built again. True if one was dropped.
+    """
+    row = conn.execute(text(
+        "SELECT i.indisvalid, t.relkind = 'p' FROM pg_index i JOIN pg_class t ON t.oid = i.indrelid "
+        "WHERE i.indexrelid = to_regclass(:n)"
+    ), {"n": name}).first()
+    if row is None or row[0]:
+        return False
+    print(f"[VECTOR INDEX] dropping invalid index {name}")
+    # an index on a partitioned parent cannot be dropped CONCURRENTLY
+    concurrently = "" if row[1] else "CONCURRENTLY "
+    conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {name}"))
+    return True
+
+
+def ensure_collection_id_index(engine) -> None:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if is_partitioned(conn):
+            return  # partition pruning already narrows scans to one collection
+        _drop_invalid_index(conn, COLLECTION_ID_INDEX)
+        conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {COLLECTION_ID_INDEX} "
+            "ON langchain_pg_embedding (collection_id)"
+        ))
+
+
+def _column_exists(conn, name: str) -> bool:
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'langchain_pg_embedding' AND column_name = :c)"
+    ), {"c": name}).scalar()
+
+
+def ensure_text_index(engine) -> None:
+    """
+    Stored tsvector column + GIN index for the lexical side of hybrid retrieval.
+    Adding the column rewrites langchain_pg_embedding under an exclusive lock,
+    so this only runs from maintain_indexes (`python -m app.vector_index`).
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if _index_exists(conn, TEXT_INDEX) and not _drop_invalid_index(conn, TEXT_INDEX):
+            return
+        if not _column_exists(conn, TEXT_COLUMN):
+            print(f"[VECTOR INDEX] adding full-text column {TEXT_COLUMN}")
+            conn.execute(text(
+                f"ALTER TABLE langchain_pg_embedding ADD COLUMN IF NOT EXISTS {TEXT_COLUMN} tsvector "
+                f"GENERATED ALWAYS AS (to_tsvector('{TEXT_SEARCH_CONFIG}', document)) STORED"
+            ))
+        print("[VECTOR INDEX] building full-text index")
+        # an index on a partitioned parent cannot be built CONCURRENTLY; it is
+        # created once and new partitions inherit it
+        concurrently = "" if is_partitioned(conn) else "CONCURRENTLY "
+        conn.execute(text(
+            f"CREATE INDEX {concurrently}IF NOT EXISTS {TEXT_INDEX} ON langchain_pg_embedding USING gin ({TEXT_COLUMN})"
+        ))
+
+
+def text_search_ready(engine) -> bool:
+    """Whether ensure_text_index has run: the full-text column exists and its GIN index is valid."""
+    if engine.dialect.name != "postgresql":
+        return False
+    with engine.connect() as conn:
+        return bool(conn.execute(text(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:n)"
+        ), {"n": TEXT_INDEX}).scalar())
+
+
+def ensure_ann_index(engine, collection_id, method: str | None = None, min_rows: int | None = None) -> bool:
+    """
+    Build the partial ANN index for one collection once it has enough rows.
+    Built CONCURRENTLY, so other sessions keep writing meanwhile; an invalid
+    one left by an interrupted build is rebuilt. Returns True if the
+    collection has an index afterwards.
+    """
+    method = method or VECTOR_INDEX
+    min_rows = VECTOR_INDEX_MIN_ROWS if min_rows is None else min_rows
+    if method == "off":
+        return False
+    cid = UUID(str(collection_id))  # validated: it is inlined into DDL below
+    name = index_name(cid)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if _index_exists(conn, name) and not _drop_invalid_index(conn, name):
+            return True
+        rows = conn.execute(
+            text("SELECT count(*) FROM langchain_pg_embedding WHERE collection_id = :cid"), {"cid": cid}
+        ).scalar()
+        if rows < min_rows:
+            return False
+        if method == "ivfflat":
+            # pgvector's guidance: rows / 1000 lists for up to ~1M rows
+            using = f"ivfflat ({_vector_expr()} vector_cosine_ops) WITH (lists = {max(10, rows // 1000)})"
+        else:
+            using = (f"hnsw ({_vector_expr()} vector_cosine_ops) "
+                     f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})")
+        if is_partitioned(conn):
+            # a plain index on the collection's own partition
+            target = f"{partition_name(cid)} USING {using}"
+        else:
+            target = f"langchain_pg_embedding USING {using} WHERE collection_id = '{cid}'"
+        print(f"[VECTOR INDEX] building {method} index for collection {cid} ({rows} rows)")
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}"))
+        if is_partitioned(conn):
+            # a freshly filled partition has no statistics yet, and the planner
+            # would keep seq-scanning it on a default estimate of a few rows
+            conn.execute(text(f"ANALYZE {partition_name(cid)}"))
+    return True
+
+
+def drop_ann_index(engine, collection_id) -> None:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name(collection_id)}"))
+
+
+def maintain_indexes(engine, rebuild: bool = False) -> dict:
+    """
+    Build the shared collection_id and full-text indexes, index every
+    collection above the threshold and drop indexes whose collection is gone.
+    Invalid indexes (an interrupted CONCURRENTLY build) are rebuilt. With
+    `rebuild`, existing ANN indexes are recreated.
+    """
+    ensure_collection_id_index(engine)
+    ensure_text_index(engine)
+    with engine.connect() as conn:
+        collections = {str(c) for c in conn.execute(text("SELECT uuid FROM langchain_pg_collection")).scalars()}
+        existing = list(conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE indexname LIKE :p"), {"p": INDEX_PREFIX + "%"}
+        ).scalars())
+    dropped = 0
+    for name in existing:
+        cid = str(UUID(name[len(INDEX_PREFIX):]))
+        if rebuild or cid not in collections:
+            drop_ann_index(engine, cid)
+            dropped += 1
+    indexed = sum(1 for cid in collections if ensure_ann_index(engine, cid))
+    return {"collections": len(collections), "indexed": indexed, "dropped": dropped}
+
+
+def search_settings(k: int, ef_search: int | None = None, probes: int | None = None,
+                    exact: bool = False) -> list[str]:
+    """The SET LOCAL statements search() runs before its query."""
+    if exact:
+        return ["SET LOCAL enable_indexscan = off"]
+    return [f"SET LOCAL hnsw.ef_search = {int(ef_search or max(HNSW_EF_SEARCH, k))}",
+            f"SET LOCAL ivfflat.probes = {int(probes or IVFFLAT_PROBES)}"]
+
+
+def search_sql(collection_id, q: str = ":q", k: str = ":k") -> str:
+    """search()'s query; `q` (vector literal) and `k` are the driver's placeholders."""
+    cid = UUID(str(collection_id))
+    return (f"SELECT document, cmetadata, {_vector_expr()} <=> CAST({q} AS vector({EMBED_DIM})) AS distance "
+            f"FROM langchain_pg_embedding WHERE collection_id = '{cid}' "
+            f"ORDER BY distance LIMIT {k}")
+
+
+def vector_literal(vector: list[float]) -> str:
+    return "[" + ",".join(repr(float(x)) for x in vector) + "]"
+
+
+def search(engine, collection_id, vector: list[float], k: int = 4, ef_search: int | None = None,
+           probes: int | None = None, exact: bool = False) -> list[tuple[str, dict, float]]:
+    """
+    Top-k rows of one collection by cosine distance: [(document, metadata, distance)].
+    `exact` disables index scans (ground truth for benchmarks).
+    """
+    with engine.begin() as conn:
+        for statement in search_settings(k, ef_search, probes, exact):
+            conn.execute(text(statement))
+        rows = conn.execute(text(search_sql(collection_id)), {"q": vector_literal(vector), "k": k}).all()
+    return [(doc, meta or {}, float(dist)) for doc, meta, dist in rows]
+
+
+_collection_ids = LRUCache(4096)  # collection name -> uuid, only for collections that exist
+
+
+def collection_id_for(engine, collection: str):
+    """Uuid of a collection by name (cached once found), or None if it does not exist yet."""
+    cid = _collection_ids.get(collection)
+    if cid is None:
+        with engine.connect() as conn:
+            cid = conn.execute(
+                text("SELECT uuid FROM langchain_pg_collection WHERE name = :name"), {"name": collection}
+            ).scalar()
+        if cid is not None:
+            _collection_ids.put(collection, cid)
+    return cid
+
+
+def forget_collection(collection: str) -> None:
+    _collection_ids.pop(collection)
+
+
+class IndexedPgRetriever(BaseRetriever):
+    """
+    Retriever over one collection using search(). Each document's metadata
+    gets `score` (cosine similarity, 1 - distance).
+    """
+
+    engine: object
+    collection: str
+    embedding: Embeddings
+    k: int = 4
+    ef_search: int | None = None
+    probes: int | None = None
+
+    def search_by_vector(self, vector: list[float]) -> list[Document]:
+        cid = collection_id_for(self.engine, self.collection)
+        if cid is None:  # nothing indexed in this session yet
+            return []
+        hits = search(self.engine, cid, vector, k=self.k, ef_search=self.ef_search, probes=self.probes)
+        return [Document(page_content=doc, metadata={**meta, "score": round(1.0 - dist, 6)})
+                for doc, meta, dist in hits]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return self.search_by_vector(self.embedding.embed_query(query))
+
+
+def main():
+    from .db_pool import get_engine
+    ap = argparse.ArgumentParser(description="Create/refresh per-collection pgvector ANN indexes.")
+    ap.add_argument("--rebuild", action="store_true", help="drop and recreate existing ANN indexes")
+    args = ap.parse_args()
+    print(maintain_indexes(get_engine(), rebuild=args.rebuild))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import json
+import os
+import struct
+from io import BytesIO
+from uuid import UUID, uuid4
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from .partitions import ensure_partition
+
+# === Bulk vector writer ===
+# Writes chunk rows straight into LangChain's langchain_pg_embedding table, so
+# get_retriever (PGVector) reads them exactly as if add_embeddings had written
+# them. The collection id is resolved once per stream, and each batch goes in
+# with a single binary COPY (or a multi-row INSERT via execute_values) inside
+# one transaction, instead of one ORM object per row.
+
+VECTOR_BULK_METHOD = os.getenv("VECTOR_BULK_METHOD", "copy")  # copy | values
+
+EMBEDDING_COLUMNS = "(uuid, collection_id, embedding, document, cmetadata, custom_id)"
+
+
+def get_or_create_collection_id(conn, collection: str):
+    """
+    Resolve a pgvector collection by name, creating the row if needed (and,
+    on the partitioned layout, its partition; see app/partitions.py).
+    """
+    coll_id = conn.execute(
+        text("SELECT uuid FROM langchain_pg_collection WHERE name = :name"), {"name": collection}
+    ).scalar()
+    if coll_id:
+        ensure_partition(conn, coll_id)
+        return coll_id
+    # partition first: creating it locks langchain_pg_collection (foreign key),
+    # which would wait on our own uncommitted insert into that table
+    coll_id = uuid4()
+    ensure_partition(conn, coll_id)
+    conn.execute(
+        text("INSERT INTO langchain_pg_collection (uuid, name) VALUES (:uuid, :name)"),
+        {"uuid": coll_id, "name": collection},
+    )
+    return coll_id
+
+
+def _create_langchain_tables(engine, embedding) -> None:
+    """Let LangChain create the vector extension + its tables (first run on a fresh DB)."""
+    from langchain_community.vectorstores import PGVector
+    PGVector(
+        embedding_function=embedding,
+        collection_name="_bootstrap",
+        connection_string=engine.url.render_as_string(hide_password=False),
+        connection=engine,
+    ).delete_collection()
+
+
+def ensure_collection(engine, collection: str, embedding=None):
+    """Return the collection uuid, creating tables/collection on a fresh database."""
+    try:
+        with engine.begin() as conn:
+            return get_or_create_collection_id(conn, collection)
+    except ProgrammingError as e:
+        if "langchain_pg_collection" not in str(e) or embedding is None:
+            raise
+    _create_langchain_tables(engine, embedding)
+    with engine.begin() as conn:
+        return get_or_create_collection_id(conn, collection)
+
+
+_metadata_is_jsonb: dict[str, bool] = {}  # per database URL
+
+
+def _cmetadata_is_jsonb(engine) -> bool:
+    # LangChain creates cmetadata as json (default) or jsonb (use_jsonb=True);
+    # binary COPY has to encode the two differently.
+    key = str(engine.url)
+    if key not in _metadata_is_jsonb:
+        with engine.connect() as conn:
+            _metadata_is_jsonb[key] = conn.execute(text(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'langchain_pg_embedding' AND column_name = 'cmetadata'"
+            )).scalar() == "jsonb"
+    return _metadata_is_jsonb[key]
+
+
+def _vector_literal(vec) -> str:
+    return "[" + (("%.9g," * len(vec))[:-1] % tuple(vec)) + "]"
+
+
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_COPY_TRAILER = struct.pack(">h", -1)
+
+
+def _field(data: bytes) -> bytes:
+    return struct.pack(">i", len(data)) + data
+
+
+def _copy_rows(cur, collection_id, texts, vectors, metadatas, jsonb: bool) -> None:
+    """Binary COPY: vectors go over the wire as pgvector's binary format (no float formatting)."""
+    coll = _field(UUID(str(collection_id)).bytes)
+    buf = BytesIO()
+    buf.write(_COPY_HEADER)
+    for doc, vec, meta in zip(texts, vectors, metadatas):
+        meta_bytes = json.dumps(meta or {}).encode("utf-8")
+        buf.write(struct.pack(">h", 6))
+        buf.write(_field(uuid4().bytes))
+        buf.write(coll)
+        buf.write(_field(struct.pack(f">HH{len(vec)}f", len(vec), 0, *vec)))
+        buf.write(_field(doc.encode("utf-8")))
+        buf.write(_field(b"\x01" + meta_bytes if jsonb else meta_bytes))
+        buf.write(_field(str(uuid4()).encode("ascii")))
+    buf.write(_COPY_TRAILER)
+    buf.seek(0)
+    cur.copy_expert(f"COPY langchain_pg_embedding {EMBEDDING_COLUMNS} FROM STDIN WITH (FORMAT binary)", buf)
+
+
+def _values_rows(cur, collection_id, texts, vectors, metadatas) -> None:
+    from psycopg2.extras import execute_values
+    coll = str(collection_id)
+    rows = [
+        (str(uuid4()), coll, _vector_literal(vec), doc, json.dumps(meta or {}), str(uuid4()))
+        for doc, vec, meta in zip(texts, vectors, metadatas)
+    ]
+    execute_values(
+        cur,
+        f"INSERT INTO langchain_pg_embedding {EMBEDDING_COLUMNS} VALUES %s",
+        rows,
+        template="(%s::uuid, %s::uuid, %s::vector, %s, %s::json, %s)",
+        page_size=1000,
+    )
+
+
+def bulk_insert_embeddings(engine, collection_id, texts: list[str], vectors: list[list[float]],
+                           metadatas: list[dict], method: str | None = None) -> int:
+    """
+    Insert rows for one collection in a single transaction.
+    Returns the number of rows written.
+    """
+    if not texts:
+        return 0
+    method = method or VECTOR_BULK_METHOD
+    jsonb = _cmetadata_is_jsonb(engine) if method == "copy" else False
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            if method == "copy":
+                _copy_rows(cur, collection_id, texts, vectors, metadatas, jsonb)
+            else:
+                _values_rows(cur, collection_id, texts, vectors, metadatas)
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    return len(texts)
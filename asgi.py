@@ -0,0 +1,161 @@
+"""
+ASGI entry point. POST /ask is answered by the async pipeline
+(app/async_ask.py), so a worker waiting on the embedding endpoint, Postgres
+or Groq holds no thread; every other route is the Flask app, run on a
+thread pool as under gunicorn's threaded worker.
+
+    uvicorn asgi:app --port 8000
+    gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT asgi:app
+"""
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from asgiref.sync import AsyncToSync, sync_to_async
+from flask import jsonify
+from werkzeug.exceptions import HTTPException
+
+from main import app as flask_app
+from app.async_ask import aask_question, close_pool
+from app.routes import _ask_context, _log_answer
+
+ASYNC_ASK = os.getenv("ASYNC_ASK", "1") == "1"                 # 0 = /ask runs in Flask like every other route
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "8"))   # threads for the Flask routes
+
+_wsgi_threads = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+async def _read_body(receive, body) -> None:
+    while True:
+        message = await receive()
+        body.write(message.get("body", b""))
+        if not message.get("more_body"):
+            body.seek(0)
+            return
+
+
+def _environ(scope, body) -> dict:
+    """The WSGI environ (PEP 3333) the Flask routes would see for this request."""
+    script_name = scope.get("root_path", "").encode("utf8").decode("latin1")
+    path = scope["path"].encode("utf8").decode("latin1")
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path[len(script_name):] if path.startswith(script_name) else path,
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else f"HTTP_{name}"
+        value = value.decode("latin1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _run_wsgi(scope, body, send) -> None:
+    """Run one request through the Flask app on a pool thread, streaming its response out through `send`."""
+    start = {}
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and start.get("sent"):
+            raise exc_info[1].with_traceback(exc_info[2])
+        start.update(status=int(status.split(" ", 1)[0]),
+                     headers=[(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers])
+
+    def send_start():
+        if not start.get("sent"):
+            start["sent"] = True
+            send({"type": "http.response.start", "status": start["status"], "headers": start["headers"]})
+
+    iterable = flask_app(_environ(scope, body), start_response)
+    try:
+        for chunk in iterable:  # a streamed response (/ask/stream) yields as it goes
+            if chunk:
+                send_start()
+                send({"type": "http.response.body", "body": chunk, "more_body": True})
+        send_start()
+        send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+
+
+async def flask_asgi(scope, receive, send) -> None:
+    """Every route but the async /ask: the Flask app on _wsgi_threads, as under gunicorn's threaded worker."""
+    with SpooledTemporaryFile(max_size=65536) as body:
+        await _read_body(receive, body)
+        await sync_to_async(_run_wsgi, thread_sensitive=False, executor=_wsgi_threads)(
+            scope, body, AsyncToSync(send))
+
+
+async def _ask_response():
+    """routes.ask, with the pipeline awaited; session lookup and the ChatLog write run on threads."""
+    rv = flask_app.preprocess_request()  # before_request hooks (trace id)
+    if rv is not None:
+        return flask_app.make_response(rv)
+    # the Flask request context is copied into the thread, so current_user and request work there
+    try:
+        ctx, error = await asyncio.to_thread(_ask_context)
+    except HTTPException as e:  # e.g. a malformed JSON body: 400, as the Flask route answers
+        return flask_app.make_response(flask_app.handle_http_exception(e))
+    if error:
+        return flask_app.make_response(error)
+    query, user_id, session_id, qa_chain = ctx
+
+    try:
+        answer = await aask_question(qa_chain, query, namespace=str(session_id))
+        await asyncio.to_thread(_log_answer, user_id, session_id, query, answer)
+        return jsonify({"answer": answer})
+    except Exception as e:
+        print(f"[ASK ERROR] {e}")
+        return flask_app.make_response((jsonify({"error": str(e)}), 500))
+
+
+async def _ask(scope, receive, send) -> None:
+    with SpooledTemporaryFile(max_size=65536) as body:
+        await _read_body(receive, body)
+        with flask_app.request_context(_environ(scope, body)):
+            response = flask_app.process_response(await _ask_response())  # after_request: X-Request-ID, timing
+            try:
+                await send({"type": "http.response.start", "status": response.status_code,
+                            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1"))
+                                        for k, v in response.headers.items()]})
+                await send({"type": "http.response.body", "body": response.get_data()})
+            finally:
+                response.close()
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_pool()
+            _wsgi_threads.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    elif ASYNC_ASK and scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/ask":
+        await _ask(scope, receive, send)
+    else:
+        await flask_asgi(scope, receive, send)
@@ -0,0 +1,101 @@
+"""
+Benchmark: exact scan vs per-collection HNSW/IVFFlat index (app/vector_index.py).
+
+    DATABASE_URL=postgresql://... python -m bench.ann_search --rows 20000 --queries 200
+
+Loads clustered random vectors into a throwaway collection, takes exact
+top-k (index scans off, like LangChain's PGVector query today) as ground
+truth, then reports recall@k and p50/p99 latency for each ef_search (HNSW) or
+probes (IVFFlat) value. The collection and its index are dropped afterwards.
+"""
+import argparse
+import os
+import random
+import time
+
+from sqlalchemy import create_engine, text
+
+from app.vector_store import ensure_collection, bulk_insert_embeddings
+from app.vector_index import EMBED_DIM, ensure_ann_index, drop_ann_index, search, _vector_expr
+from bench.bulk_insert import _NoEmbeddings
+
+COLLECTION = "bench_ann_search"
+
+
+def _clustered(n: int, dim: int, clusters: int, rnd: random.Random) -> list[list[float]]:
+    # real chunk embeddings cluster by topic; uniform noise would flatter recall
+    centers = [[rnd.gauss(0, 1) for _ in range(dim)] for _ in range(clusters)]
+    return [[c + rnd.gauss(0, 0.35) for c in rnd.choice(centers)] for _ in range(n)]
+
+
+def _percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def _run(engine, cid, queries, k, **kw):
+    latencies, results = [], []
+    for q in queries:
+        started = time.perf_counter()
+        hits = search(engine, cid, q, k=k, **kw)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append({doc for doc, _, _ in hits})
+    return results, latencies
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--method", choices=("hnsw", "ivfflat"), default="hnsw")
+    ap.add_argument("--sweep", default="10,20,40,80,160", help="ef_search (hnsw) or probes (ivfflat) values")
+    ap.add_argument("--clusters", type=int, default=50)
+    args = ap.parse_args()
+
+    url = os.environ["DATABASE_URL"].replace("postgres://", "postgresql://", 1)
+    engine = create_engine(url, future=True, pool_pre_ping=True)
+    rnd = random.Random(0)
+    vectors = _clustered(args.rows, EMBED_DIM, args.clusters, rnd)
+    queries = [[x + rnd.gauss(0, 0.2) for x in rnd.choice(vectors)] for _ in range(args.queries)]
+
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM langchain_pg_collection WHERE name = :n"), {"n": COLLECTION})
+    cid = ensure_collection(engine, COLLECTION, embedding=_NoEmbeddings())
+    try:
+        print(f"{args.rows} rows, dim={EMBED_DIM}, {args.queries} queries, k={args.k}, method={args.method}")
+        started = time.perf_counter()
+        for i in range(0, args.rows, 1000):
+            part = vectors[i:i + 1000]
+            bulk_insert_embeddings(engine, cid, [f"chunk {j}" for j in range(i, i + len(part))], part,
+                                   [{} for _ in part])
+        print(f"  load            {time.perf_counter() - started:7.2f}s")
+
+        truth, exact_ms = _run(engine, cid, queries, args.k, exact=True)
+
+        started = time.perf_counter()
+        ensure_ann_index(engine, cid, method=args.method, min_rows=0)
+        print(f"  index build     {time.perf_counter() - started:7.2f}s")
+        with engine.connect() as conn:
+            plan = conn.execute(text(
+                f"EXPLAIN SELECT document FROM langchain_pg_embedding WHERE collection_id = '{cid}' "
+                f"ORDER BY {_vector_expr()} <=> CAST(:q AS vector({EMBED_DIM})) LIMIT {args.k}"
+            ), {"q": str(queries[0])}).scalars().all()
+        print("  plan: " + " / ".join(line.strip() for line in plan[:2]))
+
+        print(f"  {'search':<16}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p99 ms':>10}")
+        print(f"  {'exact scan':<16}{1.0:>10.3f}{_percentile(exact_ms, 50):>10.2f}{_percentile(exact_ms, 99):>10.2f}")
+        knob = "ef_search" if args.method == "hnsw" else "probes"
+        for value in (int(v) for v in args.sweep.split(",")):
+            found, ms = _run(engine, cid, queries, args.k, **{knob: value})
+            recall = sum(len(f & t) for f, t in zip(found, truth)) / (args.k * len(truth))
+            label = f"{knob}={value}"
+            print(f"  {label:<16}{recall:>10.3f}{_percentile(ms, 50):>10.2f}{_percentile(ms, 99):>10.2f}")
+    finally:
+        drop_ann_index(engine, cid)
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM langchain_pg_collection WHERE uuid = :cid"), {"cid": cid})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Load test: POST /ask on the sync Flask worker vs the async ASGI path (asgi.py).
+
+    python -m bench.ask_load                                     # in-memory guest store, no services needed
+    python -m bench.ask_load --concurrency 4 --concurrency 64 --llm-latency 1.5
+    DATABASE_URL=postgresql://... python -m bench.ask_load --backend postgres
+
+Starts each server in a subprocess with the app's real routes, retrieval and
+prompt, on a synthetic corpus indexed into one guest session. The embedding
+endpoint and Groq are replaced by local models that wait --embed-latency /
+--llm-latency seconds the way the network does (time.sleep in the sync
+calls, asyncio.sleep in the async ones), so the numbers show how many
+questions one worker keeps in flight:
+  sync   gunicorn main:app, 1 worker, gthread, --threads (the Render settings)
+  async  uvicorn asgi:app, 1 worker
+For each concurrency level, --requests questions (default 4 per client, at
+least 16) are sent by that many clients at once; reports requests/s, latency
+p50/p95/p99 and errors, and writes everything to bench/results/ask_load-<time>.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.pipeline import _latencies, build_corpus, build_questions, hashing_embeddings
+
+GUEST_ID = "guestload"
+
+
+# === Server side ===
+def slow_models(embed_latency: float, llm_latency: float):
+    """(embeddings, chat model) that answer locally after the given network-like delays."""
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+    from app.vector_index import EMBED_DIM
+
+    hashing = hashing_embeddings(EMBED_DIM)
+
+    class SlowEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            return hashing.embed_documents(texts)  # indexing happens before the test, no delay
+
+        def embed_query(self, text):
+            time.sleep(embed_latency)
+            return hashing.embed_query(text)
+
+        async def aembed_query(self, text):
+            await asyncio.sleep(embed_latency)
+            return hashing.embed_query(text)
+
+    class SlowChat(BaseChatModel):
+        @property
+        def _llm_type(self) -> str:
+            return "slow-fake"
+
+        def _result(self) -> ChatResult:
+            message = AIMessage(content="The manual says to replace the part and restart the system.")
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        def _generate(self, messages, stop=None, run_manager=None, **kw) -> ChatResult:
+            time.sleep(llm_latency)
+            return self._result()
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kw) -> ChatResult:
+            await asyncio.sleep(llm_latency)
+            return self._result()
+
+    return SlowEmbeddings(), SlowChat()
+
+
+def prepare_app(args) -> None:
+    """Swap in the local models and index the corpus into the guest session."""
+    from functools import partial
+    import app.rag_engine as rag
+    import app.routes as routes
+
+    embeddings, llm = slow_models(args.embed_latency, args.llm_latency)
+    embedder = rag.SafeEmbeddings(embeddings)  # no query memo: every question pays the embedding call
+    rag.get_embedding_model = lambda: embedder
+    routes.get_qa_chain = partial(rag.get_qa_chain, llm=llm)
+
+    namespace = f"{GUEST_ID}_session"
+    rag.delete_embeddings_namespace(namespace)
+    docs = []
+    for title, pdf, _ in build_corpus(args.docs, args.pages, args.sentences, args.seed):
+        docs += rag.pdf_bytes_to_documents(pdf, {"title": title, "source": title})
+    rag.upsert_documents(docs, namespace=namespace)
+    print(f"[LOAD] {args.mode}: {len(docs)} chunks indexed into {namespace}", flush=True)
+
+
+def serve(args) -> None:
+    if args.mode == "async":
+        import uvicorn
+        import asgi
+        prepare_app(args)
+        uvicorn.run(asgi.app, host="127.0.0.1", port=args.port, log_level="warning", lifespan="on")
+        return
+
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in {"bind": f"127.0.0.1:{args.port}", "workers": 1, "worker_class": "gthread",
+                               "threads": args.threads, "timeout": 300, "loglevel": "warning"}.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            prepare_app(args)
+            return app
+
+    Server().run()
+
+
+# === Client side ===
+def _env(args) -> dict:
+    env = dict(os.environ, ANSWER_CACHE="0", EMBED_CACHE="memory", REAPER_INTERVAL="0",
+               SECRET_KEY=os.getenv("SECRET_KEY", "bench"))
+    if args.backend == "memory":
+        env["GUEST_VECTOR_BACKEND"] = "memory"
+        env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/bench_ask_load.sqlite3")
+    else:
+        env["GUEST_VECTOR_BACKEND"] = "postgres"
+    return env
+
+
+def _start(args, mode: str, port: int) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "bench.ask_load", "serve", "--mode", mode, "--port", str(port),
+           "--threads", str(args.threads), "--embed-latency", str(args.embed_latency),
+           "--llm-latency", str(args.llm_latency), "--docs", str(args.docs), "--pages", str(args.pages),
+           "--sentences", str(args.sentences), "--seed", str(args.seed)]
+    return subprocess.Popen(cmd, env=_env(args))
+
+
+async def _wait_ready(client, url: str, server: subprocess.Popen, timeout: float = 300) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with {server.returncode}")
+        try:
+            if (await client.get(url + "/healthz")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.25)
+    raise TimeoutError("server did not start")
+
+
+async def _level(client, url: str, questions: list[str], concurrency: int, n: int) -> dict:
+    ms, errors = [], 0
+    queue = asyncio.Queue()
+    for i in range(n):
+        queue.put_nowait(questions[i % len(questions)])
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            question = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                r = await client.post(url + "/ask", json={"question": question}, headers={"X-Guest-ID": GUEST_ID})
+                ok = r.status_code == 200 and "answer" in r.json()
+            except Exception:
+                ok = False
+            if ok:
+                ms.append((time.perf_counter() - started) * 1000)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    return {"concurrency": concurrency, "requests": n, "errors": errors, "seconds": round(seconds, 3),
+            "requests_per_s": round(len(ms) / seconds, 2), **_latencies(ms)}
+
+
+async def _measure(args, mode: str, port: int, questions: list[str]) -> list[dict]:
+    import httpx
+
+    url = f"http://127.0.0.1:{port}"
+    server = _start(args, mode, port)
+    try:
+        limits = httpx.Limits(max_connections=max(args.concurrency) + 8)
+        async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+            await _wait_ready(client, url, server)
+            await _level(client, url, questions, 2, 4)  # warm-up: chain build, pools
+            levels = []
+            for c in args.concurrency:
+                n = args.requests or max(4 * c, 16)
+                levels.append(await _level(client, url, questions, c, n))
+                print(f"  {mode:<6}" + "  ".join(f"{k}={v}" for k, v in levels[-1].items()), flush=True)
+            return levels
+    finally:
+        server.terminate()
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def run(args) -> dict:
+    corpus = build_corpus(args.docs, args.pages, args.sentences, args.seed)
+    questions = [q for q, _, _ in build_questions(corpus, 200, args.seed)]
+    result = {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "config": {k: v for k, v in vars(args).items() if k not in ("command", "out", "mode", "port")}}
+    for i, mode in enumerate(("sync", "async")):
+        result[mode] = asyncio.run(_measure(args, mode, args.port + i, questions))
+    if args.backend == "postgres":
+        os.environ.update(_env(args))  # the servers' settings, so the guest session is found
+        from app.rag_engine import delete_embeddings_namespace
+        delete_embeddings_namespace(f"{GUEST_ID}_session")
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("command", nargs="?", default="run", choices=("run", "serve"))
+    ap.add_argument("--backend", choices=("memory", "postgres"), default="memory")
+    ap.add_argument("--concurrency", type=int, action="append", help="clients at once (repeatable; default 1 8 32)")
+    ap.add_argument("--requests", type=int, help="questions per level (default 4 per client, at least 16)")
+    ap.add_argument("--threads", type=int, default=2, help="gunicorn threads of the sync server")
+    ap.add_argument("--embed-latency", type=float, default=0.1, help="seconds per question embedding")
+    ap.add_argument("--llm-latency", type=float, default=0.5, help="seconds per answer")
+    ap.add_argument("--docs", type=int, default=4)
+    ap.add_argument("--pages", type=int, default=10, help="pages per synthetic document")
+    ap.add_argument("--sentences", type=int, default=30, help="sentences per synthetic page")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--mode", choices=("sync", "async"), help=argparse.SUPPRESS)
+    ap.add_argument("--out", help="JSON results path (default bench/results/ask_load-<time>.json)")
+    args = ap.parse_args()
+
+    if args.command == "serve":
+        serve(args)
+        return
+    if args.backend == "postgres" and not os.getenv("DATABASE_URL"):
+        ap.error("--backend postgres needs DATABASE_URL")
+    args.concurrency = args.concurrency or [1, 8, 32]
+
+    result = run(args)
+    print(f"\n  {'clients':>8}{'sync req/s':>12}{'async req/s':>13}{'sync p95 ms':>13}{'async p95 ms':>14}")
+    for s, a in zip(result["sync"], result["async"]):
+        print(f"  {s['concurrency']:>8}{s['requests_per_s']:>12}{a['requests_per_s']:>13}"
+              f"{s.get('p95_ms', '-'):>13}{a.get('p95_ms', '-'):>14}")
+
+    out = args.out or os.path.join("bench", "results", f"ask_load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
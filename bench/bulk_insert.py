@@ -0,0 +1,80 @@
+"""
+Benchmark: PGVector ORM inserts vs the bulk writer in app/vector_store.py.
+
+    DATABASE_URL=postgresql://... python -m bench.bulk_insert --rows 5000
+
+Writes random vectors into throwaway collections and deletes them afterwards.
+"""
+import argparse
+import os
+import random
+import time
+
+from sqlalchemy import create_engine, text
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import PGVector
+
+from app.vector_store import ensure_collection, bulk_insert_embeddings
+
+
+class _NoEmbeddings(Embeddings):
+    """Vectors are precomputed; PGVector only needs an Embeddings instance."""
+
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+
+def _rows(n: int, dim: int):
+    rnd = random.Random(0)
+    texts = [f"chunk {i} " + "lorem ipsum dolor sit amet " * 20 for i in range(n)]
+    vectors = [[rnd.uniform(-1, 1) for _ in range(dim)] for _ in range(n)]
+    metas = [{"owner_id": "bench", "storage_path": "bench/doc.pdf", "page": i // 5} for i in range(n)]
+    return texts, vectors, metas
+
+
+def bench_orm(engine, url, name, texts, vectors, metas, batch):
+    store = PGVector(embedding_function=_NoEmbeddings(), collection_name=name,
+                     connection_string=url, connection=engine)
+    for i in range(0, len(texts), batch):
+        store.add_embeddings(texts=texts[i:i + batch], embeddings=vectors[i:i + batch],
+                             metadatas=metas[i:i + batch])
+
+
+def bench_bulk(method):
+    def run(engine, url, name, texts, vectors, metas, batch):
+        cid = ensure_collection(engine, name, embedding=_NoEmbeddings())
+        for i in range(0, len(texts), batch):
+            bulk_insert_embeddings(engine, cid, texts[i:i + batch], vectors[i:i + batch],
+                                   metas[i:i + batch], method=method)
+    return run
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--batch", type=int, default=128, help="rows per insert call (UPSERT_BATCH_SIZE)")
+    args = ap.parse_args()
+
+    url = os.environ["DATABASE_URL"].replace("postgres://", "postgresql://", 1)
+    engine = create_engine(url, future=True, pool_pre_ping=True)
+    texts, vectors, metas = _rows(args.rows, args.dim)
+
+    print(f"{args.rows} rows, dim={args.dim}, batch={args.batch}")
+    for label, fn in (("pgvector add_embeddings", bench_orm),
+                      ("bulk execute_values", bench_bulk("values")),
+                      ("bulk COPY", bench_bulk("copy"))):
+        name = f"bench_bulk_{label.split()[-1].lower()}"
+        started = time.perf_counter()
+        fn(engine, url, name, texts, vectors, metas, args.batch)
+        elapsed = time.perf_counter() - started
+        print(f"  {label:<24} {elapsed:7.2f}s  {args.rows / elapsed:9.0f} rows/s")
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM langchain_pg_collection WHERE name = :n"), {"n": name})
+
+
+if __name__ == "__main__":
+    main()
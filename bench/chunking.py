@@ -0,0 +1,127 @@
+"""
+Report: chunk count and size distribution, per-page splitter vs token chunker.
+
+    python -m bench.chunking                       # synthetic manuals with headings and paragraphs
+    python -m bench.chunking --pdf a.pdf --pdf b.pdf
+
+Both chunkers run on the same extracted page texts (app/pdf_extract.py), and
+every chunk is measured in tokens of the embedding model (app/chunking.py's
+counter). Reports the number of chunks, tokens per chunk (mean, p5, p50, p95,
+max), chunks under CHUNK_MIN_TOKENS, chunks over the model's 256-token input,
+chunks that span pages, total tokens embedded and embedding calls (batches of
+EMBED_BATCH_SIZE). Writes everything to bench/results/chunking-<time>.json.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+
+from bench.ann_search import _percentile
+from bench.pipeline import _COMMON, _PARTS, _TOPICS, _sentence, synthetic_pdf
+
+MODEL_MAX_TOKENS = 256  # all-MiniLM-L6-v2 input limit, special tokens included
+
+
+def structured_corpus(docs: int, pages: int, seed: int) -> list[tuple[str, bytes]]:
+    """Manuals with numbered section headings and paragraphs of 2-8 sentences that run across pages."""
+    rnd = random.Random(seed)
+    corpus = []
+    for d in range(docs):
+        topic = _TOPICS[d % len(_TOPICS)]
+        texts, section = [], 0
+        for _ in range(pages):
+            lines = []
+            for _ in range(rnd.randint(4, 7)):
+                if rnd.random() < 0.3:
+                    section += 1
+                    lines.append(f"{section}. {rnd.choice(_PARTS).title()} {rnd.choice(_COMMON).title()}")
+                lines.append(" ".join(_sentence(rnd, topic) for _ in range(rnd.randint(2, 8))))
+            texts.append("\n".join(lines))
+        corpus.append((f"{topic}-manual-{d}", synthetic_pdf(texts)))
+    return corpus
+
+
+def measure(chunks_per_doc: list[list], count, seconds: float, batch_size: int, min_tokens: int) -> dict:
+    sizes = [count(d.page_content) for docs in chunks_per_doc for d in docs]
+    n = len(sizes)
+    if not n:
+        return {"chunks": 0}
+    return {
+        "chunks": n,
+        "tokens_mean": round(sum(sizes) / n, 1),
+        "tokens_p5": _percentile(sizes, 5),
+        "tokens_p50": _percentile(sizes, 50),
+        "tokens_p95": _percentile(sizes, 95),
+        "tokens_max": max(sizes),
+        "small_chunks": sum(s < min_tokens for s in sizes),
+        "over_model_limit": sum(s + 2 > MODEL_MAX_TOKENS for s in sizes),
+        "cross_page_chunks": sum(d.metadata.get("page_end", d.metadata["page"]) != d.metadata["page"]
+                                 for docs in chunks_per_doc for d in docs),
+        "tokens_embedded": sum(sizes),
+        "embed_calls": sum(math.ceil(len(docs) / batch_size) for docs in chunks_per_doc),
+        "seconds": round(seconds, 3),
+    }
+
+
+def run(args) -> dict:
+    from app import chunking
+    from app.embeddings import EMBED_BATCH_SIZE
+    from app.pdf_extract import iter_page_texts
+
+    model = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    counter, count = chunking.token_counter(model)
+    if args.pdf:
+        corpus = []
+        for path in args.pdf:
+            with open(path, "rb") as f:
+                corpus.append((os.path.basename(path), f.read()))
+    else:
+        corpus = structured_corpus(args.docs, args.pages, args.seed)
+    pages = [[(i, t.replace("\x00", "").strip()) for i, t in iter_page_texts(data)] for _, data in corpus]
+    print(f"{len(corpus)} documents, {sum(map(len, pages))} pages, token counter: {counter}")
+
+    result = {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "counter": counter,
+              "config": {"chunk_tokens": chunking.CHUNK_TOKENS, "overlap_tokens": chunking.CHUNK_OVERLAP_TOKENS,
+                         "min_tokens": chunking.CHUNK_MIN_TOKENS, "chunk_size_chars": chunking.CHUNK_SIZE,
+                         "overlap_chars": chunking.CHUNK_OVERLAP, "embed_batch_size": EMBED_BATCH_SIZE,
+                         "docs": len(corpus), "pdf": args.pdf}}
+    runs = {
+        "chars": lambda doc: [c for i, t in doc if t for c in chunking.split_page_chars(i, t, {})],
+        "tokens": lambda doc: list(chunking.chunk_pages(doc, {}, count=count)),
+    }
+    for name, chunker in runs.items():
+        started = time.perf_counter()
+        chunks = [chunker(doc) for doc in pages]
+        result[name] = measure(chunks, count, time.perf_counter() - started, EMBED_BATCH_SIZE,
+                               chunking.CHUNK_MIN_TOKENS)
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--docs", type=int, default=8)
+    ap.add_argument("--pages", type=int, default=25, help="pages per synthetic document")
+    ap.add_argument("--pdf", action="append", help="measure these PDFs instead (repeatable)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="JSON results path (default bench/results/chunking-<time>.json)")
+    args = ap.parse_args()
+
+    result = run(args)
+    keys = [k for k in result["chars"] if k != "seconds"] + ["seconds"]
+    print(f"\n  {'':<20}{'chars':>10}{'tokens':>10}{'change':>10}")
+    for key in keys:
+        old, new = result["chars"].get(key), result["tokens"].get(key)
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        print(f"  {key:<20}{old:>10}{new:>10}{change:>10}")
+
+    out = args.out or os.path.join("bench", "results", f"chunking-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
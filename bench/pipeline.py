@@ -0,0 +1,344 @@
+"""
+Benchmark: the whole RAG pipeline, offline.
+
+    python -m bench.pipeline                                   # in-memory store, no services needed
+    DATABASE_URL=postgresql://... python -m bench.pipeline --backend postgres
+    python -m bench.pipeline --baseline bench/results/pipeline-20260101-120000.json
+
+Builds a synthetic corpus (or takes --pdf files), then times each stage through
+the app's own functions: PDF extraction (pdf_bytes_to_documents), embedding and
+writing (upsert_documents), retrieval (the retriever /ask uses) and answering
+(ask_question). Embeddings come from a local hashing model and answers from a
+fake chat model, so no network is used and the numbers measure the pipeline
+itself. Reports pages/s, chunks/s, inserts/s, query p50/p95/p99, hit rate
+(a chunk from the page a question was taken from is in the top k), mean
+prompt tokens before and after context assembly, and the process memory
+high-water mark after each stage, and writes everything to a JSON file that
+--baseline compares against.
+
+--backend memory indexes into a guest namespace (app/memory_store.py);
+--backend postgres into a throwaway session collection, deleted afterwards.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_TOPICS = ["pump", "valve", "sensor", "battery", "router", "printer", "turbine", "compressor",
+           "thermostat", "conveyor", "inverter", "scanner"]
+_PARTS = ["housing", "seal", "filter", "cable", "board", "fan", "motor", "gasket", "display", "relay"]
+_COMMON = ("the unit should be checked before each shift and the operator must record the result "
+           "in the maintenance log when a fault is found replace the part and restart the system").split()
+
+_HIGHLIGHTS = [
+    ("extract", "pages_per_s"), ("extract", "chunks_per_s"), ("index", "chunks_per_s"),
+    ("index", "inserts_per_s"), ("retrieve", "p50_ms"), ("retrieve", "p95_ms"), ("retrieve", "p99_ms"),
+    ("retrieve", "hit_rate"), ("ask", "p50_ms"), ("ask", "p95_ms"), ("ask", "p99_ms"), ("memory", "peak_rss_mb"),
+]
+
+
+# === Synthetic corpus ===
+def _sentence(rnd: random.Random, topic: str) -> str:
+    part = rnd.choice(_PARTS)
+    code = f"{topic[:2].upper()}-{rnd.randint(100, 999)}"
+    words = rnd.sample(_COMMON, 8)
+    return f"The {topic} {part} reports code {code} when {' '.join(words)}."
+
+
+def _page_text(rnd: random.Random, topic: str, sentences: int) -> str:
+    return " ".join(_sentence(rnd, topic) for _ in range(sentences))
+
+
+def synthetic_pdf(pages: list[str]) -> bytes:
+    """Minimal PDF with one Helvetica text stream per page (lines wrapped at ~95 chars)."""
+    objects: list[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = font + 2 * len(pages) + 1  # the /Pages object comes after every page
+    kids = []
+    for page in pages:
+        lines = []
+        for paragraph in page.split("\n"):
+            line = ""
+            for word in paragraph.split():
+                if len(line) + len(word) > 95:
+                    lines.append(line)
+                    line = ""
+                line = f"{line} {word}" if line else word
+            lines.append(line)
+        ops = ["BT /F1 10 Tf 12 TL 40 800 Td"]
+        ops += ["(" + ln.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj T*" for ln in lines]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        content = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] "
+                        b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font, content)))
+    add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{k} 0 R" for k in kids).encode(), len(kids)))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+def build_corpus(docs: int, pages: int, sentences: int, seed: int):
+    """[(title, pdf bytes, [page texts])]: each document is about one topic."""
+    rnd = random.Random(seed)
+    corpus = []
+    for d in range(docs):
+        topic = _TOPICS[d % len(_TOPICS)]
+        texts = [_page_text(rnd, topic, sentences) for _ in range(pages)]
+        corpus.append((f"{topic}-manual-{d}", synthetic_pdf(texts), texts))
+    return corpus
+
+
+def build_questions(corpus, n: int, seed: int):
+    """[(question, title, page)]: a run of words from one page, with where it came from."""
+    rnd = random.Random(seed + 1)
+    questions = []
+    for _ in range(n):
+        title, _, texts = rnd.choice(corpus)
+        if not texts:
+            continue
+        page = rnd.randrange(len(texts))
+        words = texts[page].split()
+        if len(words) < 10:
+            continue
+        start = rnd.randrange(len(words) - 8)
+        questions.append(("What does it mean: " + " ".join(words[start:start + 8]) + "?", title, page))
+    return questions
+
+
+# === Offline models ===
+def hashing_embeddings(dim: int):
+    from langchain_core.embeddings import Embeddings
+    from app.hybrid import tokenize
+
+    class HashingEmbeddings(Embeddings):
+        """Signed feature hashing of word tokens: similar wording, similar vectors."""
+
+        def _vector(self, text: str) -> list[float]:
+            v = [0.0] * dim
+            for token in tokenize(text):
+                h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+                v[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+            norm = sum(x * x for x in v) ** 0.5 or 1.0
+            return [x / norm for x in v]
+
+        def embed_documents(self, texts):
+            return [self._vector(t) for t in texts]
+
+        def embed_query(self, text):
+            return self._vector(text)
+
+    return HashingEmbeddings()
+
+
+# === Measurements ===
+def _peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)  # pdf_extract worker processes
+    return round(kb / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _rate(n: float, seconds: float) -> float:
+    return round(n / seconds, 1) if seconds > 0 else 0.0
+
+
+def _latencies(ms: list[float]) -> dict:
+    from bench.ann_search import _percentile
+    if not ms:
+        return {"n": 0}
+    return {"n": len(ms), "p50_ms": round(_percentile(ms, 50), 3), "p95_ms": round(_percentile(ms, 95), 3),
+            "p99_ms": round(_percentile(ms, 99), 3), "max_ms": round(max(ms), 3)}
+
+
+class _StageClock:
+    """Progress callback for upsert_documents: splits each batch into embed and write time."""
+
+    def __init__(self):
+        self.embed_seconds = self.write_seconds = 0.0
+        self._last = time.perf_counter()
+
+    def __call__(self, stage: str, n: int) -> None:
+        now = time.perf_counter()
+        if stage == "chunks_embedded":
+            self.embed_seconds += now - self._last
+        elif stage == "chunks_written":
+            self.write_seconds += now - self._last
+        else:
+            return
+        self._last = now
+
+
+def run(args) -> dict:
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    import app.rag_engine as rag
+    from app.embed_cache import build_embedding_cache
+    from app.metrics import prompt_tokens
+    from app.query_cache import build_query_cache
+    from app.vector_index import EMBED_DIM
+    from app.pdf_extract import iter_page_texts
+
+    embedder = rag.SafeEmbeddings(hashing_embeddings(EMBED_DIM),
+                                  cache=build_embedding_cache("bench-hashing", engine=rag._sql_engine),
+                                  query_cache=build_query_cache("bench-hashing"))
+    rag.get_embedding_model = lambda: embedder  # every stage below picks up the offline model
+    namespace = "guestbench_session" if args.backend == "memory" else f"bench_pipeline_{os.getpid()}"
+    result = {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "backend": args.backend,
+              "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+              "env": {k: os.getenv(k) for k in ("EMBED_BATCH_SIZE", "EMBED_CONCURRENCY", "UPSERT_BATCH_SIZE",
+                                                "PDF_EXTRACT_WORKERS", "RETRIEVAL_MODE", "VECTOR_INDEX",
+                                                "EMBED_CACHE", "ANSWER_CACHE", "CONTEXT_ASSEMBLY",
+                                                "CONTEXT_TOKEN_BUDGET")},
+              "memory": {}}
+
+    if args.pdf:
+        corpus = []
+        for path in args.pdf:
+            with open(path, "rb") as f:
+                data = f.read()
+            texts = [text for _, text in iter_page_texts(data)]
+            corpus.append((os.path.basename(path), data, texts))
+    else:
+        corpus = build_corpus(args.docs, args.pages, args.sentences, args.seed)
+    questions = build_questions(corpus, args.queries, args.seed)
+    print(f"{len(corpus)} documents, {args.queries} questions, backend={args.backend}, namespace={namespace}")
+
+    # extraction: PDF bytes -> cleaned chunks
+    docs, pages = [], 0
+
+    def count_pages(stage, n):
+        nonlocal pages
+        if stage == "pages_parsed":
+            pages += n
+
+    started = time.perf_counter()
+    for title, data, _ in corpus:
+        docs += rag.pdf_bytes_to_documents(data, {"owner_id": "bench", "storage_path": f"bench/{title}.pdf",
+                                                  "title": title}, progress=count_pages)
+    seconds = time.perf_counter() - started
+    result["extract"] = {"seconds": round(seconds, 3), "pages": pages, "chunks": len(docs),
+                         "pages_per_s": _rate(pages, seconds), "chunks_per_s": _rate(len(docs), seconds)}
+    result["memory"]["after_extract_mb"] = _peak_rss_mb()
+
+    try:
+        # embedding + writing
+        clock = _StageClock()
+        started = time.perf_counter()
+        rag.upsert_documents(docs, namespace=namespace, progress=clock)
+        seconds = time.perf_counter() - started
+        result["index"] = {"seconds": round(seconds, 3), "chunks": len(docs),
+                           "chunks_per_s": _rate(len(docs), seconds),
+                           "embed_seconds": round(clock.embed_seconds, 3),
+                           "write_seconds": round(clock.write_seconds, 3),
+                           "inserts_per_s": _rate(len(docs), clock.write_seconds)}
+        result["memory"]["after_index_mb"] = _peak_rss_mb()
+
+        # retrieval, through the retriever /ask builds
+        retriever = rag.get_session_retriever(k=args.k, namespace=namespace)
+        for question, _, _ in questions[:5]:
+            retriever.invoke(question)  # warm-up: connections, lazy indexes
+        ms, hits = [], 0
+        for question, title, page in questions:
+            started = time.perf_counter()
+            found = retriever.invoke(question)
+            ms.append((time.perf_counter() - started) * 1000)
+            hits += any(d.metadata.get("title") == title
+                        and d.metadata.get("page") <= page <= d.metadata.get("page_end", d.metadata.get("page"))
+                        for d in found)
+        result["retrieve"] = {**_latencies(ms), "k": args.k,
+                              "hit_rate": round(hits / len(questions), 3) if questions else None}
+        result["memory"]["after_retrieve_mb"] = _peak_rss_mb()
+
+        # answering: retrieval + stuff prompt + (fake) LLM
+        llm = FakeListChatModel(responses=["The manual says to replace the part and restart the system."])
+        chain = rag.get_qa_chain(retriever, llm=llm)
+        tokens = {when: prompt_tokens.value(when) for when in ("before", "after")}
+        ms = []
+        for question, _, _ in questions:
+            started = time.perf_counter()
+            rag.ask_question(chain, question, namespace=namespace)
+            ms.append((time.perf_counter() - started) * 1000)
+        result["ask"] = _latencies(ms)
+        if questions and prompt_tokens.value("before") > tokens["before"]:
+            # mean prompt size with all retrieved chunks vs after context assembly (app/context.py)
+            for when, start in tokens.items():
+                result["ask"][f"prompt_tokens_{when}"] = round((prompt_tokens.value(when) - start) / len(questions), 1)
+    finally:
+        rag.delete_embeddings_namespace(namespace)
+    result["memory"]["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def compare(result: dict, baseline: dict) -> None:
+    print(f"\n  {'metric':<24}{'baseline':>12}{'now':>12}{'change':>10}")
+    for stage, key in _HIGHLIGHTS:
+        old, new = baseline.get(stage, {}).get(key), result.get(stage, {}).get(key)
+        if old is None or new is None:
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        print(f"  {stage + '.' + key:<24}{old:>12}{new:>12}{change:>10}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--backend", choices=("memory", "postgres"), default="memory")
+    ap.add_argument("--docs", type=int, default=8)
+    ap.add_argument("--pages", type=int, default=25, help="pages per synthetic document")
+    ap.add_argument("--sentences", type=int, default=30, help="sentences per synthetic page")
+    ap.add_argument("--pdf", action="append", help="benchmark these PDFs instead (repeatable)")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="JSON results path (default bench/results/pipeline-<time>.json)")
+    ap.add_argument("--baseline", help="earlier JSON results to compare against")
+    args = ap.parse_args()
+
+    # app modules read their settings at import time
+    os.environ.setdefault("EMBED_CACHE", "memory")
+    os.environ.setdefault("ANSWER_CACHE", "0")       # every question goes through retrieval + LLM
+    if args.backend == "memory":
+        os.environ["GUEST_VECTOR_BACKEND"] = "memory"
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/bench_pipeline.sqlite3")
+    elif not os.getenv("DATABASE_URL"):
+        ap.error("--backend postgres needs DATABASE_URL")
+
+    result = run(args)
+    for stage in ("extract", "index", "retrieve", "ask", "memory"):
+        print(f"  {stage:<9}" + "  ".join(f"{k}={v}" for k, v in result[stage].items()))
+
+    out = args.out or os.path.join("bench", "results", f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {out}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 import os
-from flask import Flask, render_template, redirect, url_for
+from flask import Flask, Response, render_template, redirect, url_for, jsonify
 from dotenv import load_dotenv
 from app.utils import db, mail, login_manager
 from app.models import User
+from app import metrics
 
 # Load environment variables
 load_dotenv()
@@ -40,6 +41,9 @@ mail.init_app(app)
 login_manager.init_app(app)
 login_manager.login_view = "routes.show_login"
 
+# Trace id (X-Request-ID) and latency histogram for every request
+metrics.init_app(app)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -47,6 +51,10 @@ def load_user(user_id):
 from app.routes import routes
 app.register_blueprint(routes)
 
+# Purges guest namespaces that have been idle for GUEST_IDLE_TTL (app/cleanup.py)
+from app.cleanup import start_reaper
+start_reaper()
+
 # --- Render health check endpoint (no auth) ---
 @app.route("/healthz")
 def healthz():
@@ -59,6 +67,35 @@ def healthz():
         print(f"[HEALTHZ warmup skipped] {e}")
     return "ok", 200
 
+# --- Prometheus metrics: per-stage and per-route latency histograms (no auth) ---
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# --- Runtime stats for tuning (no auth, like /healthz) ---
+@app.route("/stats")
+def stats():
+    from app.embeddings import embedding_stats
+    from app.db_pool import pool_stats
+    from app.rag_engine import get_embedding_model, _vector_stores
+    from app.routes import user_chains
+    from app.answer_cache import answer_cache
+    from app.memory_store import memory_store_stats
+    from app.cleanup import cleanup_stats
+    embedder = get_embedding_model()
+    cache, query_cache = embedder.cache, embedder.query_cache
+    return jsonify({
+        "embeddings": embedding_stats.snapshot(),
+        "embedding_cache": cache.stats() if cache else None,
+        "query_cache": query_cache.stats() if query_cache else None,
+        "db_pool": pool_stats(),
+        "vector_stores": _vector_stores.stats(),
+        "qa_chains": user_chains.stats(),
+        "answer_cache": answer_cache.stats(),
+        "memory_vector_stores": memory_store_stats(),
+        "cleanup": cleanup_stats(),
+    })
+
 @app.route("/")
 def index():
     return redirect(url_for("routes.show_login"))
@@ -65,11 +65,11 @@ sendBtn.onclick = async () => {
   input.value = "";
 
   try {
-    const res = await fetch("/ask", {
+    const res = await fetch("/ask/stream", {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
-        "Accept": "application/json",
+        "Accept": "text/event-stream",
         ...(isGuest ? { "X-Guest-ID": guestId || "" } : {})
       },
       body: JSON.stringify({ question, session_id: currentSessionId })
@@ -92,21 +92,63 @@ sendBtn.onclick = async () => {
     }
 
     // Guard against HTML error pages
-    if (!isJSON) {
-      addMessage("bot", " Server returned a non-JSON response. Please try again.");
+    if (!ct.includes("text/event-stream") || !res.body) {
+      addMessage("bot", " Server returned an unexpected response. Please try again.");
       return;
     }
 
-    const data = await res.json().catch(() => ({}));
-    const answer = data.answer || data.error || "No response.";
-    addMessage("bot", answer);
-    chatLog.push({ question, answer });
+    const answer = await renderAnswerStream(res.body);
+    if (answer) chatLog.push({ question, answer });
 
   } catch (e) {
     addMessage("bot", ` ${e.message || "Network error"}. Please try again.`);
   }
 };
 
+// Reads the /ask/stream Server-Sent Events and grows one bot message as tokens arrive.
+// Returns the full answer, or null if the stream ended with an error.
+async function renderAnswerStream(body) {
+  const msg = document.createElement("div");
+  msg.className = "message bot";
+  msg.innerText = "…";
+  chatBox.appendChild(msg);
+
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let text = "";
+
+  const handle = (evt) => {
+    if (evt.event === "token") {
+      text += evt.text;
+      msg.innerText = text;
+    } else if (evt.event === "done") {
+      text = evt.answer || text || "No response.";
+      msg.innerText = text;
+    } else if (evt.event === "error") {
+      msg.innerText = ` ${evt.error || "Error"}. Please try again.`;
+      text = null;
+    }
+    chatBox.scrollTop = chatBox.scrollHeight;
+  };
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const frame = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      const data = frame.split("\n").filter(l => l.startsWith("data:")).map(l => l.slice(5).trim()).join("\n");
+      if (!data) continue;
+      try { handle(JSON.parse(data)); } catch {}
+    }
+  }
+  if (text === "") msg.innerText = "No response.";
+  return text;
+}
+
 
 const showOverlay = () => {
     document.getElementById("uploading-overlay").style.display = "flex";
@@ -189,6 +231,11 @@ fileInput.onchange = async () => {
             addMessage("bot", `🗂 Uploaded File: ${uploadedFileName}`);
         }
 
+        if (data.job_id) {
+            addMessage("bot", "⏳ Indexing started — you can ask questions while the rest is indexed.");
+            pollIndexJob(data.job_id);
+        }
+
     } catch (err) {
         console.error("Upload failed:", err.message);
         alert("File cannot be uploaded:\n" + err.message);
@@ -197,6 +244,40 @@ fileInput.onchange = async () => {
     }
 };
 
+// Poll /jobs/<id> until background indexing finishes; the chat stays usable meanwhile.
+async function pollIndexJob(jobId, intervalMs = 2000) {
+    while (true) {
+        await new Promise(r => setTimeout(r, intervalMs));
+        let job;
+        try {
+            const res = await fetch(`/jobs/${jobId}`, {
+                headers: {
+                    "Accept": "application/json",
+                    ...(isGuest ? { "X-Guest-ID": guestId || "" } : {})
+                }
+            });
+            const ct = res.headers.get("content-type") || "";
+            if (!ct.includes("application/json")) continue;  // transient 502/504 page
+            if (res.status === 404) return;
+            if (!res.ok) continue;
+            job = await res.json();
+        } catch {
+            continue;  // network hiccup: keep polling
+        }
+
+        if (job.status === "queued" || job.status === "running") continue;
+
+        for (const f of job.files || []) {
+            if (f.status === "done") {
+                addMessage("bot", `✅ Indexed ${f.title}: ${f.pages_parsed} pages, ${f.chunks_written} chunks`);
+            } else {
+                addMessage("bot", `⚠️ Could not index ${f.title}: ${f.error || "unknown error"}`);
+            }
+        }
+        return;
+    }
+}
+
 micBtn.onclick = () => {
     const recognition = new webkitSpeechRecognition();
     recognition.lang = "en-US";
@@ -0,0 +1,51 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("REAPER_INTERVAL", "0")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/doc_assistant_test_asgi.sqlite3")
+
+httpx = pytest.importorskip("httpx")
+asgi = pytest.importorskip("asgi")
+
+GUEST = {"X-Guest-ID": "guesttest"}
+
+
+def _post_ask(**kw):
+    async def post():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/ask", **kw)
+    return asyncio.run(post())
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"{not json", "application/json"),   # BadRequest
+    (b"question=hi", "text/plain"),        # UnsupportedMediaType
+])
+def test_bad_body_gets_the_same_4xx_as_the_flask_route(body, content_type):
+    headers = {**GUEST, "Content-Type": content_type}
+    expected = asgi.flask_app.test_client().post("/ask", data=body, headers=headers).status_code
+    assert 400 <= expected < 500
+    assert _post_ask(content=body, headers=headers).status_code == expected
+
+
+def test_missing_question_is_a_400():
+    r = _post_ask(json={}, headers=GUEST)
+    assert r.status_code == 400
+    assert r.json() == {"error": "No question provided"}
+    assert "X-Request-ID" in r.headers
+
+
+def test_flask_routes_are_served_through_the_bridge():
+    async def get():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/healthz?probe=1", headers={"X-Request-ID": "abc123"})
+    r = asyncio.run(get())
+    expected = asgi.flask_app.test_client().get("/healthz?probe=1")
+    assert r.status_code == expected.status_code
+    assert r.headers.get("X-Request-ID") == "abc123"
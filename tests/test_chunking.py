@@ -0,0 +1,27 @@
+import base64
+
+from app.chunking import CHUNK_TOKENS, chunk_pages, estimate_tokens
+
+
+def _chunks(pages):
+    return list(chunk_pages(enumerate(pages), {"source": "manual.pdf"}))
+
+
+def test_no_chunk_exceeds_the_token_limit_on_unpunctuated_runs():
+    blob = base64.b64encode(bytes(range(256)) * 9).decode()       # one ~3000-char token
+    url = "https://example.com/" + "-".join(f"part{i}" for i in range(400))
+    row = " ".join(f"{i:06d}" for i in range(900))                  # a table row without punctuation
+    chunks = _chunks([f"Intro text before the blob. {blob} and after it.", url, row])
+    assert chunks
+    assert max(c.metadata["tokens"] for c in chunks) <= CHUNK_TOKENS
+    assert max(estimate_tokens(c.page_content) for c in chunks) <= CHUNK_TOKENS
+    assert "".join(c.page_content for c in chunks).replace(" ", "").count(blob) == 1
+
+
+def test_a_chunk_keeps_the_section_it_starts_in():
+    body = " ".join(f"Check valve {i} and tighten the clamp before restarting the pump." for i in range(60))
+    page = f"1 Overview\nThis manual covers the pump.\n\n2 Maintenance\n{body}"
+    chunks = _chunks([page])
+    assert chunks[0].page_content.startswith("1 Overview") and "2 Maintenance" in chunks[0].page_content
+    assert chunks[0].metadata["section"] == "1 Overview"
+    assert [c.metadata["section"] for c in chunks[1:]] == ["2 Maintenance"] * (len(chunks) - 1)
@@ -0,0 +1,51 @@
+from langchain_core.documents import Document
+
+from app.chunking import estimate_tokens
+from app.context import assemble_context
+
+
+def _doc(text, **meta):
+    return Document(page_content=text, metadata={"doc_id": "manual", "score": 0.9, **meta})
+
+
+def test_over_budget_chunk_without_sentence_end_is_cut_at_a_word():
+    text = " ".join(f"word{i}" for i in range(500))  # no punctuation to cut at
+    out = assemble_context([_doc(text, chunk=0)], budget=100, min_score=0)
+    assert len(out) == 1
+    kept = out[0].page_content
+    assert text.startswith(kept) and kept.split() == text.split()[:len(kept.split())]
+    assert 0 < estimate_tokens(kept) <= 100
+
+
+def test_over_budget_chunk_is_cut_at_a_sentence_end():
+    text = "The pump must be primed first. " * 40
+    out = assemble_context([_doc(text, chunk=0)], budget=60, min_score=0)
+    assert len(out) == 1
+    assert out[0].page_content.endswith(".") and estimate_tokens(out[0].page_content) <= 60
+
+
+def test_chunks_that_fit_are_kept_whole_best_first():
+    docs = [_doc("Reset the breaker.", chunk=0, doc_id="a"),
+            _doc("Check the fuse.", chunk=1, doc_id="b")]
+    out = assemble_context(docs, budget=1000, min_score=0)
+    assert [d.page_content for d in out] == ["Reset the breaker.", "Check the fuse."]
+
+
+def test_runs_with_a_gap_are_not_merged_by_repeated_text():
+    warning = "Disconnect power before opening the cover."
+    docs = [_doc(f"Step two: drain the tank. {warning}", chunk=2, page=1),
+            _doc(f"{warning} Step four: refill the tank.", chunk=4, page=2),
+            _doc("Step three: replace the filter.", chunk=3, page=1)]
+    out = assemble_context(docs, budget=1000, min_score=0)
+    assert len(out) == 1
+    text = out[0].page_content
+    assert text.index("Step two") < text.index("Step three") < text.index("Step four")
+    assert text.count("Step three") == 1
+    assert out[0].metadata["merged_chunks"] == 3
+
+
+def test_runs_with_a_gap_stay_separate_parts():
+    docs = [_doc("Step two: drain the tank and wait.", chunk=2),
+            _doc("Step two: drain the tank and wait. More about step two.", chunk=5)]
+    out = assemble_context(docs, budget=1000, min_score=0)
+    assert [d.metadata["chunk"] for d in out] == [2, 5]